@@ -129,6 +129,11 @@ CREATE TABLE IF NOT EXISTS ppg_ir_windows (
 
 CREATE INDEX idx_ppg_ir_windows_timestamp ON ppg_ir_windows (device_id, timestamp);
 
+-- Signal quality index computed on ingest (see server/utils/ppg2abp/signal_quality.py)
+ALTER TABLE ppg_ir_windows
+    ADD COLUMN IF NOT EXISTS sqi REAL,              -- 0 (unusable) to 1 (clean); NULL for windows stored before scoring
+    ADD COLUMN IF NOT EXISTS sqi_components JSONB;  -- perfusion, template_correlation, clipping_ratio, spectral_concentration, hr_bpm
+
 -- Add new metric types to sync_status
 ALTER TABLE sync_status
     DROP CONSTRAINT IF EXISTS sync_status_metric_type_check;
@@ -136,3 +141,92 @@ ALTER TABLE sync_status
 ALTER TABLE sync_status
     ADD CONSTRAINT sync_status_metric_type_check 
     CHECK (metric_type IN ('heart_rate', 'steps', 'sleep', 'characteristics', 'body_measurements'));
+
+-- Table for storing the full diagnosis model output of each analysis,
+-- so thresholds can be re-applied without running inference again
+CREATE TABLE IF NOT EXISTS risk_analysis_vectors (
+    id SERIAL PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) NOT NULL,
+    model_version VARCHAR(255) NOT NULL,  -- e.g. "DATEXIS/CORe-clinical-diagnosis-prediction@<revision>"
+    num_labels INTEGER NOT NULL,
+    probabilities TEXT NOT NULL,          -- base64-encoded little-endian float16 vector, one value per label
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_risk_analysis_vectors_device ON risk_analysis_vectors (device_id, created_at);
+
+-- Latest vector of every device (optionally of one model version), read by bulk re-thresholding
+CREATE OR REPLACE FUNCTION latest_risk_analysis_vectors(p_model_version VARCHAR DEFAULT NULL)
+RETURNS SETOF risk_analysis_vectors AS $$
+    SELECT DISTINCT ON (device_id) *
+    FROM risk_analysis_vectors
+    WHERE p_model_version IS NULL OR model_version = p_model_version
+    ORDER BY device_id, created_at DESC
+$$ LANGUAGE sql STABLE;
+
+-- Generated SOAP notes keyed by a hash of their canonicalized inputs and the prompt version
+CREATE TABLE IF NOT EXISTS soap_notes (
+    cache_key CHAR(64) PRIMARY KEY,       -- sha256 of canonical inputs + prompt version
+    prompt_version VARCHAR(64) NOT NULL,
+    soap_note TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Latest risk analysis of each device with a fingerprint of its inputs,
+-- returned as-is while nothing it depends on has changed
+CREATE TABLE IF NOT EXISTS risk_analysis_snapshots (
+    id SERIAL PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) NOT NULL,
+    fingerprint CHAR(64) NOT NULL,        -- sha256 of sync times, note ids, characteristics version, prompt versions, threshold
+    model_version VARCHAR(255),
+    result JSONB NOT NULL,                -- Full /risk-analysis response
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(device_id)  -- One snapshot per device
+);
+
+-- Background risk analysis / recommendation jobs
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id UUID PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) NOT NULL,
+    kind VARCHAR(50) NOT NULL,            -- 'risk_analysis' or 'recommendations'
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    params JSONB,
+    result JSONB,
+    error TEXT,
+    error_status INTEGER,                 -- HTTP status the synchronous endpoint would have returned
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE,
+    CONSTRAINT valid_job_status CHECK (status IN ('queued', 'running', 'succeeded', 'failed'))
+);
+
+-- At most one active job per device and kind, so repeated taps share one pipeline
+CREATE UNIQUE INDEX idx_analysis_jobs_active ON analysis_jobs (device_id, kind)
+    WHERE status IN ('queued', 'running');
+
+-- Digest of the inputs each recommendation category was last generated from,
+-- so a refresh only regenerates the categories whose inputs changed
+CREATE TABLE IF NOT EXISTS recommendation_runs (
+    id SERIAL PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) NOT NULL,
+    category VARCHAR(50) NOT NULL,        -- 'Heart_Rate', 'Sleep' or 'Steps'
+    digest CHAR(64) NOT NULL,             -- sha256 of the category's clusters, metric, notes, count and prompt versions
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(device_id, category)  -- One run per device and category
+);
+
+-- Per-beat blood pressure estimated from PPG IR windows (see server/utils/ppg2abp/beats.py),
+-- kept instead of the 1024-sample ABP waveforms the model outputs
+CREATE TABLE IF NOT EXISTS bp_estimates (
+    id BIGSERIAL PRIMARY KEY,
+    device_id INTEGER REFERENCES devices(id) NOT NULL,
+    window_id INTEGER REFERENCES ppg_ir_windows(id) ON DELETE SET NULL,  -- Window the beat was estimated from
+    timestamp TIMESTAMP WITH TIME ZONE NOT NULL,  -- Time of the systolic peak
+    sbp REAL NOT NULL,                    -- mmHg
+    dbp REAL NOT NULL,                    -- mmHg
+    map REAL NOT NULL,                    -- mmHg
+    hr REAL NOT NULL,                     -- bpm, from the peak-to-peak interval
+    confidence REAL NOT NULL,             -- 0 to 1: beat regularity times the window's signal quality
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(device_id, timestamp)  -- One estimate per beat; also serves history reads
+);
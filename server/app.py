@@ -2,9 +2,15 @@ from flask import Flask, jsonify
 from flask_cors import CORS
 import os
 from routes.health import health_bp
-from routes.risk_analysis import risk_analysis_bp, load_model
+from routes.risk_analysis import risk_analysis_bp
 from routes.notes import notes_bp
 from routes.recommendations import recommendations_bp
+from routes.jobs import jobs_bp
+from routes.bp_prediction import bp_prediction_bp
+from utils.metrics import get_metrics
+from utils import timing
+from utils.inference_client import get_model_status, get_worker_metrics, use_inference_worker
+from utils.icd9_index import load_icd9_index
 import threading
 import logging
 
@@ -18,6 +24,7 @@ load_dotenv()
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+timing.init_app(app)  # Per-stage Server-Timing headers and latency histograms
 
 # Configure Flask app
 debug_mode = os.environ.get('FLASK_ENV') == 'development'
@@ -32,21 +39,29 @@ app.config.update(
 def load_model_on_startup():
     with app.app_context():
         try:
+            # Imported here so web workers backed by the inference worker never load torch
+            from utils.diagnosis_model import load_model
             load_model()
         except Exception as e:
             app.logger.error(f"Failed to load model on startup: {e}")
             # Don't raise the exception - let the server start anyway
             # The risk analysis endpoint will return appropriate errors
 
-# Start model loading in background thread
-model_thread = threading.Thread(target=load_model_on_startup)
-model_thread.start()
+# Start model loading in background thread, unless a dedicated inference worker serves the model
+if not use_inference_worker():
+    model_thread = threading.Thread(target=load_model_on_startup)
+    model_thread.start()
+
+# Descriptions are looked up in every web worker; load the index now so a missing one is reported at startup
+load_icd9_index()
 
 # Register blueprints
 app.register_blueprint(health_bp, url_prefix='/api/health')
 app.register_blueprint(risk_analysis_bp, url_prefix='/api')
 app.register_blueprint(notes_bp, url_prefix='/api/notes')
 app.register_blueprint(recommendations_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api')
+app.register_blueprint(bp_prediction_bp, url_prefix='/api')
 
 # Basic error handling
 @app.errorhandler(404)
@@ -62,6 +77,27 @@ def internal_error(error):
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
+# Liveness: the process is up and serving requests
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    return jsonify({"status": "alive"}), 200
+
+# Readiness: model-backed endpoints can serve traffic
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    model_status = get_model_status()
+    status_code = 200 if model_status['ready'] else 503
+    return jsonify({"status": "ready" if model_status['ready'] else "not_ready", "model": model_status}), status_code
+
+# Process metrics (time-to-ready, first-request latency, per-stage latency histograms, ...),
+# plus the inference worker's model and queue metrics when the model runs there
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    process_metrics = get_metrics()
+    if use_inference_worker():
+        process_metrics['inference_worker'] = get_worker_metrics()
+    return jsonify(process_metrics), 200
+
 # Root endpoint
 @app.route('/', methods=['GET'])
 def root():
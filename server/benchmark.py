@@ -0,0 +1,121 @@
+"""
+    Load test for the risk analysis and recommendations pipelines, run in-process
+    against the Flask app.
+
+    With LLM_MODE=replay or simulate (see utils/llm_transport.py) no Gemini calls are
+    made, and a clinical-text-only risk analysis doesn't touch Supabase. The diagnosis
+    model still comes from the Hugging Face hub unless it is already cached (set
+    HF_HUB_OFFLINE=1 to be sure), and ICD-9 descriptions from data/icd9_index.json.
+    Record real responses once, then replay them:
+        LLM_MODE=record python benchmark.py --requests 5
+        python benchmark.py --llm-mode replay --requests 200 --concurrency 8 --metrics-file bench.json
+    or simulate Gemini with a latency distribution:
+        LLM_SIM_LATENCY=lognormal:1500:0.4 python benchmark.py --llm-mode simulate --soap-mode llm
+
+    Requests with --user-id also read and write Supabase.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPTS = [
+    "Patient reports intermittent chest tightness on exertion and shortness of breath climbing stairs.",
+    "Patient reports difficulty falling asleep, waking several times a night and daytime fatigue.",
+    "Patient reports frequent headaches in the afternoon and occasional dizziness when standing up.",
+    "Patient reports increased thirst, frequent urination and unintended weight loss over two months.",
+    "Patient reports lower back pain after long periods of sitting and stiffness in the morning."
+]
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark the risk analysis and recommendations pipelines")
+    parser.add_argument('--endpoint', choices=('risk-analysis', 'recommendations'), default='risk-analysis')
+    parser.add_argument('--requests', type=int, default=50, help="Total requests to send")
+    parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight at once")
+    parser.add_argument('--llm-mode', help="Overrides LLM_MODE (live, record, replay or simulate)")
+    parser.add_argument('--soap-mode', help="soap_mode sent with each request (llm, template, auto or hybrid)")
+    parser.add_argument('--user-id', help="device_id to analyze (uses Supabase; required for recommendations)")
+    parser.add_argument('--prompts-file', help="Clinical texts to cycle through, one per line")
+    parser.add_argument('--model-timeout', type=float, default=300, help="Seconds to wait for the diagnosis model to load")
+    parser.add_argument('--metrics-file', help="Write the summary and the server's /metrics snapshot as JSON to this file")
+    args = parser.parse_args()
+
+    # Must be set before the app (and with it the LLM transport) is imported
+    if args.llm_mode:
+        os.environ['LLM_MODE'] = args.llm_mode
+    if args.endpoint == 'recommendations' and not args.user_id:
+        parser.error("--user-id is required for the recommendations endpoint")
+
+    from app import app
+    from utils.inference_client import wait_for_model
+    from utils.llm_transport import LLM_MODE
+    from utils.metrics import get_metrics, percentile
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts_file:
+        with open(args.prompts_file) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    if args.endpoint == 'risk-analysis':
+        logger.warning("Waiting for the diagnosis model to load")
+        if not wait_for_model(args.model_timeout):
+            raise SystemExit("Diagnosis model did not become ready")
+
+    def send(index):
+        client = app.test_client()
+        if args.endpoint == 'risk-analysis':
+            # force skips the unchanged-inputs shortcut so every request runs the whole pipeline
+            body = {'prompt': prompts[index % len(prompts)], 'force': True}
+        else:
+            body = {}
+        if args.user_id:
+            body['user_id'] = args.user_id
+        if args.soap_mode:
+            body['soap_mode'] = args.soap_mode
+
+        start_time = time.monotonic()
+        response = client.post(f"/api/{args.endpoint}", json=body)
+        return response.status_code, (time.monotonic() - start_time) * 1000
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(send, range(args.requests)))
+    wall_seconds = time.monotonic() - start_time
+
+    latencies = sorted(latency for _, latency in results)
+    status_codes = {}
+    for status_code, _ in results:
+        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+
+    summary = {
+        'endpoint': args.endpoint,
+        'llm_mode': LLM_MODE,
+        'soap_mode': args.soap_mode,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'status_codes': status_codes,
+        'wall_seconds': round(wall_seconds, 2),
+        'requests_per_second': round(args.requests / wall_seconds, 2) if wall_seconds else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': round(latencies[-1], 1) if latencies else None
+        }
+    }
+    print(json.dumps(summary, indent=2))
+
+    if args.metrics_file:
+        with open(args.metrics_file, 'w') as f:
+            json.dump({'summary': summary, 'metrics': get_metrics()}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Builds the bundled ICD-9-CM description index for the diagnosis model.
+
+Run once (e.g. during the Docker build) from the server directory:
+    python build_icd9_index.py
+
+This script deliberately doesn't import the utils package, so building the index
+only needs the Hugging Face hub (for the model's label set) and the NLM API.
+Lookups run concurrently and transient NLM errors are retried with backoff. Codes
+NLM doesn't know are reported and listed under 'unmatched' in the index; the build
+fails only if lookups still error out after their retries.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+NLM_SEARCH_URL = "https://clinicaltables.nlm.nih.gov/api/icd9cm_dx/v3/search"
+
+# Same model and index location as utils/icd9_index.py
+MODEL_NAME = "DATEXIS/CORe-clinical-diagnosis-prediction"
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'icd9_index.json')
+
+# Retries per NLM lookup (with exponential backoff) and concurrent lookups while building
+NLM_RETRIES = int(os.getenv('ICD9_NLM_RETRIES', '3'))
+NLM_BACKOFF_SECONDS = 1.0
+NLM_WORKERS = int(os.getenv('ICD9_NLM_WORKERS', '8'))
+
+_sessions = threading.local()
+
+
+def normalize_code(code: str) -> str:
+    """Strip the dot from an ICD-9 code so "414.0" and "4140" share one key."""
+    return code.replace('.', '').strip()
+
+
+def fetch_icd9_description(session: requests.Session, code: str, retries: int = NLM_RETRIES) -> str:
+    """
+    Get the description for an ICD-9 code from the NLM clinical tables API.
+
+    Args:
+        session (requests.Session): Session reused across lookups
+        code (str): ICD-9 code without a dot (e.g. "4140")
+        retries (int): Extra attempts after a failed request, with exponential backoff
+
+    Returns:
+        str: Description of the code, or None if not found
+
+    Raises:
+        requests.RequestException: If every attempt fails
+    """
+    # Format code with dot if needed (e.g., 001.1 instead of 0011)
+    formatted_code = f"{code[:3]}.{code[3:]}" if len(code) > 3 else code
+
+    params = {
+        "terms": formatted_code,
+        "ef": "long_name",
+        "sf": "code_dotted"
+    }
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(NLM_SEARCH_URL, params=params, timeout=10)
+            response.raise_for_status()
+            break
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            delay = NLM_BACKOFF_SECONDS * 2 ** attempt
+            logger.warning(f"NLM lookup for {code} failed ({str(e)}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+    data = response.json()
+    if data and len(data) >= 3 and data[1]:
+        descriptions = data[2].get("long_name", [])
+        if descriptions:
+            return descriptions[0].strip()
+    return None
+
+
+def _lookup(code: str):
+    """Look up one code with this thread's session, returning (code, description, error)."""
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+    try:
+        return code, fetch_icd9_description(_sessions.session, code), None
+    except requests.RequestException as e:
+        return code, None, str(e)
+
+
+def build_icd9_index(output_path: str = DEFAULT_INDEX_PATH, model_name: str = MODEL_NAME,
+                     allow_failures: bool = False, workers: int = NLM_WORKERS) -> dict:
+    """
+    Build the code-to-description index from the model's label set and write it to disk.
+
+    Args:
+        output_path (str): Where to write the JSON index
+        model_name (str): Hugging Face model whose id2label defines the label set
+        allow_failures (bool): Write the index even if some lookups failed after their retries
+        workers (int): Concurrent NLM lookups
+
+    Returns:
+        dict: The index that was written
+
+    Raises:
+        RuntimeError: If lookups failed and allow_failures is False
+    """
+    # Only the builder needs transformers; the runtime NLM fallback imports this module too
+    from transformers import AutoConfig
+
+    config = AutoConfig.from_pretrained(model_name)
+    labels = [config.id2label[i] for i in range(len(config.id2label))]
+    codes = sorted({normalize_code(label) for label in labels})
+    logger.info(f"Building ICD-9 index for {len(labels)} labels ({len(codes)} codes) of {model_name}")
+
+    descriptions = {}
+    unmatched = []
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for code, description, error in executor.map(_lookup, codes):
+            if error:
+                failed[code] = error
+            elif description:
+                descriptions[code] = description
+            else:
+                unmatched.append(code)
+
+    if unmatched:
+        logger.warning(f"{len(unmatched)} codes have no NLM description: {', '.join(unmatched)}")
+    if failed:
+        logger.error(f"{len(failed)} lookups failed after {NLM_RETRIES} retries, e.g. "
+                     f"{', '.join(f'{code}: {error}' for code, error in list(failed.items())[:5])}")
+        if not allow_failures:
+            raise RuntimeError(f"{len(failed)} ICD-9 lookups failed; not writing {output_path}")
+
+    index = {
+        'model_name': model_name,
+        'built_at': datetime.utcnow().isoformat(),
+        'labels': labels,
+        'descriptions': descriptions,
+        'unmatched': unmatched + sorted(failed)
+    }
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'), sort_keys=True)
+
+    logger.info(f"Wrote {len(descriptions)} descriptions to {output_path} "
+                f"({len(index['unmatched'])} codes without a description)")
+    return index
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the offline ICD-9-CM description index")
+    parser.add_argument('--output', default=DEFAULT_INDEX_PATH, help="Path of the JSON index to write")
+    parser.add_argument('--model', default=MODEL_NAME, help="Model whose labels define the index")
+    parser.add_argument('--allow-failures', action='store_true',
+                        help="Write the index even if some lookups failed after their retries")
+    parser.add_argument('--workers', type=int, default=NLM_WORKERS, help="Concurrent NLM lookups")
+    args = parser.parse_args()
+    try:
+        build_icd9_index(args.output, args.model, args.allow_failures, args.workers)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+    Gunicorn configuration.
+
+    Starts the model-serving process (inference_worker.py) next to the web workers
+    so the diagnosis and PPG2ABP models and the blood pressure streams live in one
+    place instead of inside every web worker. Set INFERENCE_WORKER=0 to keep the
+    previous in-process models instead; blood pressure streaming is then disabled
+    unless there is a single web worker. If the inference worker exits, a supervisor
+    thread in the gunicorn master starts a new one after INFERENCE_RESTART_DELAY seconds.
+"""
+
+import os
+import secrets
+import subprocess
+import sys
+import threading
+
+# Seconds to wait before restarting an inference worker that exited
+INFERENCE_RESTART_DELAY = float(os.environ.get('INFERENCE_RESTART_DELAY', '5'))
+
+_stopping = threading.Event()
+
+
+def _start_inference_worker():
+    return subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inference_worker.py')],
+        env=os.environ.copy()
+    )
+
+
+def _supervise_inference_worker(server):
+    """Restart the inference worker whenever it exits, until gunicorn shuts down."""
+    while True:
+        returncode = server.inference_process.wait()
+        if _stopping.is_set():
+            return
+        server.log.error("Inference worker exited with code %s; restarting in %.0fs",
+                         returncode, INFERENCE_RESTART_DELAY)
+        if _stopping.wait(INFERENCE_RESTART_DELAY):
+            return
+        server.inference_process = _start_inference_worker()
+
+
+def on_starting(server):
+    if os.environ.get('INFERENCE_WORKER', '1') != '1':
+        if server.cfg.workers > 1 and os.environ.get('BP_STREAM_ENABLED', '1') == '1':
+            # Each web worker would buffer only the windows it happened to receive
+            server.log.warning("Disabling blood pressure streaming: %d web workers and no inference worker",
+                               server.cfg.workers)
+            os.environ['BP_STREAM_ENABLED'] = '0'
+        return
+
+    # Exported before the web workers fork so they know how to reach the inference worker
+    os.environ.setdefault('INFERENCE_SOCKET', '/tmp/eon-inference.sock')
+    os.environ.setdefault('INFERENCE_AUTHKEY', secrets.token_hex(16))
+
+    server.log.info("Starting inference worker on %s", os.environ['INFERENCE_SOCKET'])
+    server.inference_process = _start_inference_worker()
+    threading.Thread(target=_supervise_inference_worker, args=(server,), daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    process = getattr(server, 'inference_process', None)
+    if process is None:
+        return
+
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
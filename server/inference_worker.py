@@ -0,0 +1,217 @@
+"""
+    Model-serving process for the clinical diagnosis model and PPG2ABP.
+
+    Web workers send requests over a local Unix socket (see utils/inference_client.py).
+    Requests are served from a bounded priority queue so interactive scoring runs
+    ahead of background and batch work, and a full queue is reported back as busy.
+    Blood pressure estimates and every device's PPG stream (ring buffer, micro-batcher
+    and trend) are served from here too, so all web workers share one stream per device
+    and no web worker loads the PPG2ABP networks.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+
+from dotenv import load_dotenv
+import numpy as np
+import torch
+
+from utils import diagnosis_model
+from utils.inference_client import INFERENCE_AUTHKEY, PRIORITIES
+from utils.metrics import get_metrics, increment, set_gauge
+from utils.ppg2abp.inference import BPModelUnavailableError, get_estimator
+from utils.ppg2abp.stream_buffer import get_stream_registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET', '/tmp/eon-inference.sock')
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', '32'))
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '8'))
+# CPUs the worker is pinned to, e.g. "0-3" or "2,3"; defaults to every core available
+INFERENCE_CPUS = os.getenv('INFERENCE_CPUS')
+
+request_queue = queue.PriorityQueue(maxsize=INFERENCE_QUEUE_SIZE)
+_sequence = itertools.count()
+
+
+class InferenceRequest:
+    """A single text waiting to be scored."""
+
+    def __init__(self, text):
+        self.text = text
+        self.done = threading.Event()
+        self.enqueued_at = time.perf_counter()
+        self.timings = {}
+        self.result = None
+        self.error = None
+
+
+def parse_cpu_list(spec: str) -> set:
+    """
+    Parse a CPU list such as "0-3,6" into a set of CPU ids.
+
+    Args:
+        spec (str): Comma-separated CPU ids and ranges
+
+    Returns:
+        set: CPU ids
+    """
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def pin_threads():
+    """Pin this process to its CPUs and size PyTorch's thread pools to match."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = parse_cpu_list(INFERENCE_CPUS) if INFERENCE_CPUS else os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+        num_threads = len(cpus)
+    else:
+        num_threads = os.cpu_count() or 1
+
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    logger.info(f"Inference worker using {num_threads} intra-op threads")
+
+
+def inference_loop():
+    """Serve queued requests in priority order, batching whatever is already waiting."""
+    while True:
+        batch = [request_queue.get()[2]]
+        while len(batch) < INFERENCE_MAX_BATCH:
+            try:
+                batch.append(request_queue.get_nowait()[2])
+            except queue.Empty:
+                break
+
+        started_at = time.perf_counter()
+        for item in batch:
+            item.timings['queue'] = (started_at - item.enqueued_at) * 1000
+
+        try:
+            batch_timings = {}
+            probabilities = diagnosis_model.predict_probabilities([item.text for item in batch], batch_timings)
+            for item, item_probabilities in zip(batch, probabilities):
+                item.result = np.asarray(item_probabilities, dtype=np.float32)
+                item.timings.update(batch_timings)
+        except Exception as e:
+            logger.error(f"Error running inference batch: {str(e)}", exc_info=True)
+            for item in batch:
+                item.error = str(e)
+        finally:
+            for item in batch:
+                item.done.set()
+            increment('inference_batches')
+            set_gauge('inference_queue_depth', request_queue.qsize())
+
+
+def handle_connection(conn):
+    """Handle one request from a web worker."""
+    with conn:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+
+        op = message.get('op')
+        try:
+            handle_operation(conn, op, message)
+        except Exception as e:
+            # Always answer, so the web worker gets an error instead of a dropped connection
+            logger.error(f"Error handling inference operation {op}: {str(e)}", exc_info=True)
+            increment('inference_internal_errors')
+            try:
+                conn.send({'error': 'internal', 'detail': str(e)})
+            except OSError:
+                pass
+
+
+def handle_operation(conn, op: str, message: dict):
+    """Serve one operation and send its reply."""
+    if op == 'status':
+        conn.send({'status': diagnosis_model.get_model_status(), 'queue_depth': request_queue.qsize()})
+    elif op == 'metrics':
+        # Model load, warm-up and queue metrics are recorded here, not in the web workers
+        conn.send({'metrics': get_metrics()})
+    elif op == 'labels':
+        conn.send({
+            'labels': diagnosis_model.get_labels(),
+            'model_version': diagnosis_model.get_model_version()
+        })
+    elif op == 'predict':
+        if not diagnosis_model.model_ready.is_set():
+            conn.send({'error': 'not_ready'})
+            return
+
+        item = InferenceRequest(message['text'])
+        priority = PRIORITIES.get(message.get('priority'), PRIORITIES['interactive'])
+        try:
+            request_queue.put_nowait((priority, next(_sequence), item))
+        except queue.Full:
+            # Backpressure: let the caller decide whether to retry or fail
+            increment('inference_rejected_busy')
+            conn.send({'error': 'busy'})
+            return
+
+        item.done.wait()
+        if item.error:
+            conn.send({'error': item.error})
+        else:
+            conn.send({'probabilities': item.result, 'timings': item.timings})
+    elif op == 'bp_predict':
+        try:
+            conn.send({'estimates': get_estimator().predict(message['windows'], message['valid_lengths'])})
+        except BPModelUnavailableError as e:
+            conn.send({'error': 'bp_model_unavailable', 'detail': str(e)})
+    elif op == 'stream_window':
+        try:
+            conn.send({'frames_queued': get_stream_registry().add_window(message['device_id'], message['window'])})
+        except ValueError as e:
+            conn.send({'error': 'invalid_input', 'detail': str(e)})
+    elif op == 'stream_trend':
+        conn.send({'trend': get_stream_registry().trend(message['device_id'], message.get('limit'))})
+    else:
+        conn.send({'error': f"Unknown operation: {op}"})
+
+
+def serve(socket_path: str = INFERENCE_SOCKET):
+    """Load the model and serve requests on the given Unix socket."""
+    pin_threads()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = Listener(socket_path, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+    logger.info(f"Inference worker listening on {socket_path}")
+
+    threading.Thread(target=diagnosis_model.load_model, daemon=True).start()
+    threading.Thread(target=inference_loop, daemon=True).start()
+
+    while True:
+        try:
+            conn = listener.accept()
+        except (AuthenticationError, OSError) as e:
+            logger.warning(f"Rejected inference connection: {str(e)}")
+            continue
+        threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,80 @@
+from flask import Blueprint, request, jsonify
+import logging
+from services.errors import ServiceError
+from services.bp_prediction import estimate_blood_pressure, get_blood_pressure_trend, get_blood_pressure_history
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+bp_prediction_bp = Blueprint('bp_prediction', __name__)
+
+@bp_prediction_bp.route('/bp-prediction', methods=['POST'])
+def predict_blood_pressure():
+    """
+    Estimate blood pressure (SBP/DBP/MAP and optionally the ABP waveform) from PPG IR windows.
+    Body: either ppg_ir_windows ([{ir_values, sampling_rate, timestamp?}, ...]) or user_id
+    (and limit) to use the device's most recent stored windows; include_waveforms and min_sqi
+    (signal quality threshold, 0 disables the gate) are optional.
+    """
+    try:
+        data = request.json or {}
+        try:
+            limit = int(data.get('limit', 10))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit must be an integer'}), 400
+        try:
+            min_sqi = float(data['min_sqi']) if data.get('min_sqi') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'min_sqi must be a number'}), 400
+        
+        return jsonify(estimate_blood_pressure(
+            data.get('user_id'),
+            data.get('ppg_ir_windows'),
+            limit,
+            bool(data.get('include_waveforms', False)),
+            min_sqi
+        )), 200
+        
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers
+    except Exception as e:
+        logger.error(f"Error in blood pressure prediction: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@bp_prediction_bp.route('/bp-prediction/<device_id>/trend', methods=['GET'])
+def get_blood_pressure_trend_route(device_id):
+    """Return the in-memory SBP/DBP trend of a streaming device; ?limit=<n> returns the latest n"""
+    try:
+        limit = request.args.get('limit', type=int)
+        return jsonify(get_blood_pressure_trend(device_id, limit)), 200
+        
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers
+    except Exception as e:
+        logger.error(f"Error retrieving blood pressure trend for {device_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@bp_prediction_bp.route('/bp-prediction/<device_id>/history', methods=['GET'])
+def get_blood_pressure_history_route(device_id):
+    """
+    Return a device's stored per-beat SBP/DBP/MAP/HR estimates, oldest first.
+    Query: start and end (ISO timestamps), limit (latest n beats) and min_confidence are optional.
+    """
+    try:
+        limit = request.args.get('limit', 500, type=int)
+        min_confidence = request.args.get('min_confidence', 0.0, type=float)
+        return jsonify(get_blood_pressure_history(
+            device_id,
+            request.args.get('start'),
+            request.args.get('end'),
+            limit,
+            min_confidence
+        )), 200
+        
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers
+    except Exception as e:
+        logger.error(f"Error retrieving blood pressure history for {device_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,57 @@
+from flask import Blueprint, request, jsonify
+import logging
+from services.errors import ServiceError
+from services.jobs import submit_job, get_job
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+jobs_bp = Blueprint('jobs', __name__)
+
+def _submit(kind, data, params):
+    """Queue a job for the request's user_id and answer 202 with where to poll"""
+    try:
+        user_id = data.get('user_id')
+        if not user_id:
+            return jsonify({'error': 'Missing required data. Must provide user_id.'}), 400
+        
+        job, created = submit_job(kind, user_id, params)
+        job['deduplicated'] = not created
+        return jsonify(job), 202, {'Location': f"/api/jobs/{job['job_id']}"}
+        
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers
+    except Exception as e:
+        logger.error(f"Error submitting {kind} job: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/jobs/risk-analysis', methods=['POST'])
+def submit_risk_analysis_job():
+    """Start a risk analysis in the background and return its job id"""
+    data = request.json or {}
+    return _submit('risk_analysis', data, {
+        'prompt': data.get('prompt'),
+        'force': bool(data.get('force', False)),
+        'soap_mode': data.get('soap_mode')
+    })
+
+@jobs_bp.route('/jobs/recommendations', methods=['POST'])
+def submit_recommendations_job():
+    """Start recommendation generation in the background and return its job id"""
+    data = request.json or {}
+    return _submit('recommendations', data, {'soap_mode': data.get('soap_mode'), 'force': bool(data.get('force', False))})
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Return a job's status and result; ?wait=<seconds> long-polls until it finishes"""
+    try:
+        wait = float(request.args.get('wait', 0))
+        return jsonify(get_job(job_id, wait)), 200
+        
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    except ServiceError as e:
+        return jsonify({'error': e.message}), e.status_code, e.headers
+    except Exception as e:
+        logger.error(f"Error retrieving job {job_id}: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
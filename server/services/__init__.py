@@ -0,0 +1,25 @@
+"""
+Services package for server functionality.
+Contains the risk analysis, recommendation and blood pressure pipelines and the
+background jobs that run them, called directly by routes.
+"""
+
+from .errors import ServiceError
+from .risk_analysis import run_risk_analysis, get_stored_risk_analysis
+from .recommendations import create_recommendations, get_device_recommendations, set_recommendation_acceptance
+from .jobs import submit_job, get_job
+from .bp_prediction import estimate_blood_pressure, get_blood_pressure_trend, get_blood_pressure_history
+
+__all__ = [
+    'ServiceError',
+    'run_risk_analysis',
+    'get_stored_risk_analysis',
+    'create_recommendations',
+    'get_device_recommendations',
+    'set_recommendation_acceptance',
+    'submit_job',
+    'get_job',
+    'estimate_blood_pressure',
+    'get_blood_pressure_trend',
+    'get_blood_pressure_history'
+]
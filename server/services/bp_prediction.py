@@ -0,0 +1,276 @@
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import numpy as np
+from utils.bp_estimates import store_beat_estimates
+from utils.ppg2abp.beats import summarize_segments
+from utils.inference_client import InferenceUnavailableError, get_stream_trend, predict_blood_pressure
+from utils.ppg2abp.inference import BPModelUnavailableError
+from utils.ppg2abp.preprocessing import SAMPLING_RATE, preprocess_windows
+from utils.ppg2abp.signal_quality import PPG_SQI_THRESHOLD, score_windows
+from utils.metrics import increment
+from utils.supabase.init_supabase import get_supabase
+from utils.timing import pipeline, stage
+from services.errors import ServiceError
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Most PPG windows estimated per request
+BP_MAX_WINDOWS = int(os.getenv('BP_MAX_WINDOWS', '256'))
+# Most beats returned by one history read
+BP_HISTORY_MAX_BEATS = int(os.getenv('BP_HISTORY_MAX_BEATS', '5000'))
+
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _get_device_internal_id(device_id: str) -> int:
+    device_response = get_supabase().table('devices').select('id').eq('device_id', device_id).execute()
+    if not device_response.data:
+        raise ServiceError('Device not found', 404)
+    return device_response.data[0]['id']
+
+
+def _fetch_stored_windows(device_internal_id: int, limit: int, min_sqi: float) -> list:
+    """
+    Return the device's most recent PPG IR windows scoring at least min_sqi (or not scored yet),
+    oldest first
+    """
+    query = get_supabase().table('ppg_ir_windows')\
+        .select('id, timestamp, sampling_rate, ir_values, min_raw_value, max_raw_value, avg_raw_value, sqi')\
+        .eq('device_id', device_internal_id)
+    if min_sqi > 0:
+        # Windows stored before scoring was added are scored below
+        query = query.or_(f"sqi.gte.{min_sqi},sqi.is.null")
+    response = query.order('timestamp', desc=True).limit(limit).execute()
+    return list(reversed(response.data))
+
+
+def _gate_windows(windows: list, min_sqi: float):
+    """
+    Split windows into those worth running through the model and those below min_sqi,
+    scoring any window that has no stored SQI.
+
+    Returns:
+        tuple: (usable windows, their SQI, skipped windows as {window_id, timestamp, sqi})
+    """
+    scores = [window.get('sqi') for window in windows]
+    unscored = [index for index, sqi in enumerate(scores) if sqi is None]
+    if unscored:
+        try:
+            quality = score_windows([windows[index] for index in unscored])
+        except ValueError as e:
+            raise ServiceError(str(e), 400)
+        for index, window_quality in zip(unscored, quality):
+            scores[index] = window_quality['sqi']
+
+    usable, usable_scores, skipped = [], [], []
+    for window, sqi in zip(windows, scores):
+        if sqi is None or float(sqi) >= min_sqi:
+            usable.append(window)
+            usable_scores.append(sqi)
+        else:
+            skipped.append({'window_id': window.get('id'), 'timestamp': window.get('timestamp'), 'sqi': sqi})
+    return usable, usable_scores, skipped
+
+
+@pipeline('bp_prediction')
+def estimate_blood_pressure(device_id: str = None, ppg_ir_windows: list = None, limit: int = 10,
+                            include_waveforms: bool = False, min_sqi: float = None) -> dict:
+    """
+    Estimate blood pressure from posted PPG IR windows, or from a device's most recent stored ones.
+    Windows whose signal quality index is below min_sqi are skipped; the rest are cleaned,
+    resampled to 125 Hz and cut into overlapping 1024-sample model windows (see
+    utils/ppg2abp/preprocessing.py), which run through both PPG2ABP stages in one batch.
+    The estimated waveforms are cut into beats (see utils/ppg2abp/beats.py); for a device's
+    stored windows, every beat is stored in bp_estimates for history reads.
+
+    Args:
+        device_id (str): The device_id whose stored windows to use (if ppg_ir_windows isn't given)
+        ppg_ir_windows (list): Windows with ir_values and sampling_rate (and optionally timestamp
+            and the raw value statistics used for perfusion)
+        limit (int): Stored windows to use
+        include_waveforms (bool): Include the estimated ABP waveform of each window
+        min_sqi (float): Signal quality threshold (defaults to PPG_SQI_THRESHOLD, 0 disables the gate)
+
+    Returns:
+        dict: Per-window SBP/DBP/MAP (mmHg), HR, beat count and SQI, their medians, the
+        skipped windows, the number of beats stored and the inference throughput
+
+    Raises:
+        ServiceError: If there are no usable windows or the model is unavailable
+    """
+    min_sqi = PPG_SQI_THRESHOLD if min_sqi is None else max(float(min_sqi), 0.0)
+    device_internal_id = None
+    if ppg_ir_windows is None:
+        if not device_id:
+            raise ServiceError('Either user_id or ppg_ir_windows is required', 400)
+        with stage('ppg_fetch'):
+            device_internal_id = _get_device_internal_id(device_id)
+            ppg_ir_windows = _fetch_stored_windows(device_internal_id, min(max(int(limit), 1), BP_MAX_WINDOWS), min_sqi)
+    if not ppg_ir_windows:
+        raise ServiceError('No PPG IR windows available', 404)
+    if len(ppg_ir_windows) > BP_MAX_WINDOWS:
+        raise ServiceError(f"At most {BP_MAX_WINDOWS} windows can be estimated per request", 400)
+
+    # Only windows with usable signal reach the model
+    with stage('ppg_quality'):
+        ppg_ir_windows, scores, skipped = _gate_windows(ppg_ir_windows, min_sqi)
+    if skipped:
+        increment('bp_windows_skipped', len(skipped))
+    if not ppg_ir_windows:
+        raise ServiceError(f"No PPG IR windows passed the signal quality check (min_sqi {min_sqi})", 422)
+
+    # Prepare every window, remembering which model windows belong to which input window
+    with stage('ppg_prepare'):
+        try:
+            model_windows, valid_lengths, owners, offsets = preprocess_windows(ppg_ir_windows)
+        except ValueError as e:
+            raise ServiceError(str(e), 400)
+
+    try:
+        with stage('bp_inference'):
+            estimates = predict_blood_pressure(model_windows, valid_lengths)
+    except (BPModelUnavailableError, InferenceUnavailableError) as e:
+        logger.error(f"Blood pressure model unavailable: {str(e)}")
+        raise ServiceError('Blood pressure model is not available', 503)
+
+    with stage('bp_beats'):
+        window_sqi = np.array([1.0 if sqi is None else float(sqi) for sqi in scores])
+        beats = summarize_segments(estimates['abp'], valid_lengths, offsets, owners, window_sqi[owners])
+
+    results = []
+    for index, window in enumerate(ppg_ir_windows):
+        segments = np.flatnonzero(owners == index)
+        window_beats = beats['window'] == index
+        result = {
+            'window_id': window.get('id'),
+            'timestamp': window.get('timestamp'),
+            'segments': len(segments),
+            'sqi': scores[index],
+            'sbp': round(float(np.median(estimates['sbp'][segments])), 1),
+            'dbp': round(float(np.median(estimates['dbp'][segments])), 1),
+            'map': round(float(np.median(estimates['map'][segments])), 1),
+            'hr': round(float(np.median(beats['hr'][window_beats])), 1) if window_beats.any() else None,
+            'beats': int(window_beats.sum())
+        }
+        if include_waveforms:
+            result['abp'] = np.concatenate([
+                estimates['abp'][segment][:valid_lengths[segment]] for segment in segments
+            ]).round(1).tolist()
+        results.append(result)
+
+    # Stored windows all have timestamps, so their beats can be placed in time
+    beats_stored = 0
+    if device_internal_id is not None and len(beats['window']):
+        with stage('bp_store'):
+            beats_stored = store_beat_estimates(device_internal_id, [{
+                'window_id': ppg_ir_windows[window]['id'],
+                'timestamp': (_parse_time(ppg_ir_windows[window]['timestamp']) + timedelta(seconds=float(seconds))).isoformat(),
+                'sbp': round(float(sbp), 1),
+                'dbp': round(float(dbp), 1),
+                'map': round(float(mean_pressure), 1),
+                'hr': round(float(hr), 1),
+                'confidence': round(float(confidence), 3)
+            } for window, seconds, sbp, dbp, mean_pressure, hr, confidence in zip(
+                beats['window'], beats['seconds'], beats['sbp'], beats['dbp'], beats['map'], beats['hr'], beats['confidence']
+            )])
+        increment('bp_beats_stored', beats_stored)
+
+    return {
+        'user_id': device_id,
+        'sampling_rate': SAMPLING_RATE,
+        'min_sqi': min_sqi,
+        'windows': results,
+        'skipped_windows': skipped,
+        'beats_stored': beats_stored,
+        'summary': {
+            'sbp': round(float(np.median([result['sbp'] for result in results])), 1),
+            'dbp': round(float(np.median([result['dbp'] for result in results])), 1),
+            'map': round(float(np.median([result['map'] for result in results])), 1),
+            'model_windows': len(model_windows)
+        },
+        'windows_per_second': round(estimates['windows_per_second'], 1) if estimates['windows_per_second'] else None
+    }
+
+
+def get_blood_pressure_trend(device_id: str, limit: int = None) -> dict:
+    """
+    Return the blood pressure trend estimated from a device's streamed PPG IR windows,
+    straight from the memory of the process hosting the streams (the inference worker).
+
+    Args:
+        device_id (str): The device_id
+        limit (int): Most recent estimates to return (all kept estimates if not given)
+
+    Returns:
+        dict: Estimates (timestamp, sqi and, for usable frames, sbp/dbp/map) oldest first,
+        and the latest estimate with a pressure
+
+    Raises:
+        ServiceError: If the device has no active stream or the streams can't be reached
+    """
+    try:
+        trend = get_stream_trend(device_id, limit)
+    except InferenceUnavailableError as e:
+        logger.error(f"Blood pressure stream unavailable: {str(e)}")
+        raise ServiceError('Blood pressure streams are not available', 503)
+    if trend is None:
+        raise ServiceError('No active PPG stream for this device', 404)
+
+    estimated = [entry for entry in trend if 'sbp' in entry]
+    return {
+        'user_id': device_id,
+        'trend': trend,
+        'latest': estimated[-1] if estimated else None
+    }
+
+
+def get_blood_pressure_history(device_id: str, start: str = None, end: str = None, limit: int = 500,
+                               min_confidence: float = 0.0) -> dict:
+    """
+    Return a device's stored per-beat blood pressure estimates.
+
+    Args:
+        device_id (str): The device_id
+        start (str): Only beats at or after this ISO timestamp
+        end (str): Only beats before this ISO timestamp
+        limit (int): Most recent beats to return (at most BP_HISTORY_MAX_BEATS)
+        min_confidence (float): Only beats with at least this confidence
+
+    Returns:
+        dict: Beats (timestamp, sbp, dbp, map, hr, confidence) oldest first and their medians
+
+    Raises:
+        ServiceError: If the device doesn't exist or a timestamp is invalid
+    """
+    for value in (start, end):
+        if value is not None:
+            try:
+                _parse_time(value)
+            except ValueError:
+                raise ServiceError(f"Invalid timestamp: {value}", 400)
+
+    query = get_supabase().table('bp_estimates')\
+        .select('timestamp, sbp, dbp, map, hr, confidence')\
+        .eq('device_id', _get_device_internal_id(device_id))
+    if start:
+        query = query.gte('timestamp', start)
+    if end:
+        query = query.lt('timestamp', end)
+    if min_confidence > 0:
+        query = query.gte('confidence', min_confidence)
+    response = query.order('timestamp', desc=True).limit(min(max(int(limit), 1), BP_HISTORY_MAX_BEATS)).execute()
+    beats = list(reversed(response.data))
+
+    return {
+        'user_id': device_id,
+        'beats': beats,
+        'summary': {
+            measure: round(float(np.median([beat[measure] for beat in beats])), 1)
+            for measure in ('sbp', 'dbp', 'map', 'hr')
+        } if beats else None
+    }
@@ -0,0 +1,8 @@
+class ServiceError(Exception):
+    """An expected failure, carrying the HTTP status (and headers) the route should respond with."""
+
+    def __init__(self, message: str, status_code: int = 500, headers: dict = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.headers = headers or {}
@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import logging
+import os
+import threading
+import time
+import uuid
+from utils.metrics import increment
+from utils.supabase.init_supabase import get_supabase
+from services.errors import ServiceError
+from services.risk_analysis import run_risk_analysis
+from services.recommendations import create_recommendations
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Jobs run concurrently in each web worker, and jobs that may be queued or running there at once
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '16'))
+# An active job older than this is assumed lost (e.g. its worker restarted) and no longer blocks new ones
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '900'))
+# Longest a status request may wait for a job to finish
+JOB_MAX_WAIT_SECONDS = 30
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='analysis-job')
+_queue_slots = threading.BoundedSemaphore(JOB_QUEUE_SIZE)
+_finished_events = {}
+_finished_events_lock = threading.Lock()
+
+
+def _run_risk_analysis_job(device_id: str, params: dict) -> dict:
+    return run_risk_analysis(device_id, params.get('prompt'), bool(params.get('force', False)), params.get('soap_mode'))
+
+
+def _run_recommendations_job(device_id: str, params: dict) -> dict:
+    return create_recommendations(device_id, params.get('soap_mode'), bool(params.get('force', False)))
+
+
+JOB_RUNNERS = {
+    'risk_analysis': _run_risk_analysis_job,
+    'recommendations': _run_recommendations_job
+}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _update_job(job_id: str, fields: dict) -> None:
+    get_supabase().table('analysis_jobs').update(fields).eq('id', job_id).execute()
+
+
+def _find_active_job(device_internal_id: int, kind: str):
+    response = get_supabase().table('analysis_jobs')\
+        .select('*')\
+        .eq('device_id', device_internal_id)\
+        .eq('kind', kind)\
+        .in_('status', list(ACTIVE_STATUSES))\
+        .limit(1)\
+        .execute()
+    return response.data[0] if response.data else None
+
+
+def _is_stale(job: dict) -> bool:
+    age = datetime.now(timezone.utc) - _parse_time(job['started_at'] or job['created_at'])
+    return age.total_seconds() > JOB_STALE_SECONDS
+
+
+def _public_job(job: dict, device_id: str = None) -> dict:
+    """Shape a job row for API responses"""
+    public_job = {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at')
+    }
+    if device_id:
+        public_job['user_id'] = device_id
+    if job['status'] == 'succeeded':
+        public_job['result'] = job['result']
+    elif job['status'] == 'failed':
+        public_job['error'] = job['error']
+        public_job['error_status'] = job.get('error_status')
+    return public_job
+
+
+def _run_job(job_id: str, kind: str, device_id: str, params: dict) -> None:
+    """Run one job on the pool and record its outcome"""
+    try:
+        _update_job(job_id, {'status': 'running', 'started_at': _now()})
+        result = JOB_RUNNERS[kind](device_id, params)
+        _update_job(job_id, {'status': 'succeeded', 'result': result, 'finished_at': _now()})
+        increment('jobs_succeeded')
+    except ServiceError as e:
+        logger.warning(f"Job {job_id} ({kind}) failed: {e.message}")
+        _update_job(job_id, {'status': 'failed', 'error': e.message, 'error_status': e.status_code, 'finished_at': _now()})
+        increment('jobs_failed')
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {str(e)}", exc_info=True)
+        try:
+            _update_job(job_id, {'status': 'failed', 'error': str(e), 'error_status': 500, 'finished_at': _now()})
+        except Exception:
+            logger.error(f"Failed to record failure of job {job_id}", exc_info=True)
+        increment('jobs_failed')
+    finally:
+        _queue_slots.release()
+        with _finished_events_lock:
+            event = _finished_events.pop(job_id, None)
+        if event:
+            event.set()
+
+
+def submit_job(kind: str, device_id: str, params: dict = None):
+    """
+    Queue a risk analysis or recommendations job, or return the device's job of that kind
+    that is already queued or running.
+
+    Args:
+        kind (str): 'risk_analysis' or 'recommendations'
+        device_id (str): The device_id of the user
+        params (dict): Job parameters (e.g. prompt and force for risk analysis)
+
+    Returns:
+        tuple: (job dict, True if a new job was created)
+
+    Raises:
+        ServiceError: If the device doesn't exist or this worker's job queue is full
+    """
+    if kind not in JOB_RUNNERS:
+        raise ServiceError(f"Unknown job kind: {kind}", 400)
+    params = params or {}
+    supabase = get_supabase()
+
+    device_response = supabase.table('devices').select('id').eq('device_id', device_id).execute()
+    if not device_response.data:
+        raise ServiceError('Device not found', 404)
+    device_internal_id = device_response.data[0]['id']
+
+    existing_job = _find_active_job(device_internal_id, kind)
+    if existing_job:
+        if not _is_stale(existing_job):
+            increment('jobs_deduplicated')
+            return _public_job(existing_job, device_id), False
+        logger.warning(f"Abandoning stale job {existing_job['id']} ({kind}) for device {device_id}")
+        _update_job(existing_job['id'], {'status': 'failed', 'error': 'Job was abandoned', 'error_status': 500, 'finished_at': _now()})
+
+    if not _queue_slots.acquire(blocking=False):
+        increment('jobs_rejected_busy')
+        raise ServiceError('Too many analyses in progress. Please try again shortly.', 503, {'Retry-After': '10'})
+
+    job_id = str(uuid.uuid4())
+    try:
+        response = supabase.table('analysis_jobs').insert({
+            'id': job_id,
+            'device_id': device_internal_id,
+            'kind': kind,
+            'status': 'queued',
+            'params': params,
+            'created_at': _now()
+        }).execute()
+    except Exception as e:
+        _queue_slots.release()
+        # Lost the race against another request (possibly on another worker) for this device
+        if getattr(e, 'code', None) == '23505':
+            existing_job = _find_active_job(device_internal_id, kind)
+            if existing_job:
+                increment('jobs_deduplicated')
+                return _public_job(existing_job, device_id), False
+        raise
+
+    with _finished_events_lock:
+        _finished_events[job_id] = threading.Event()
+    _executor.submit(_run_job, job_id, kind, device_id, params)
+    increment('jobs_submitted')
+    return _public_job(response.data[0], device_id), True
+
+
+def get_job(job_id: str, wait: float = 0) -> dict:
+    """
+    Return a job's status, and its result once finished.
+
+    Args:
+        job_id (str): Job id returned by submit_job
+        wait (float): Seconds to wait for an active job to finish (capped at JOB_MAX_WAIT_SECONDS)
+
+    Returns:
+        dict: Job status with result or error
+
+    Raises:
+        ServiceError: If the job doesn't exist
+    """
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        raise ServiceError('Job not found', 404)
+
+    def fetch():
+        response = get_supabase().table('analysis_jobs').select('*').eq('id', job_id).execute()
+        if not response.data:
+            raise ServiceError('Job not found', 404)
+        return response.data[0]
+
+    job = fetch()
+    wait = min(max(wait, 0), JOB_MAX_WAIT_SECONDS)
+    if job['status'] in ACTIVE_STATUSES and wait > 0:
+        with _finished_events_lock:
+            event = _finished_events.get(job_id)
+        if event:
+            # The job runs in this worker, so we can be woken the moment it finishes
+            event.wait(wait)
+            job = fetch()
+        else:
+            deadline = time.monotonic() + wait
+            while job['status'] in ACTIVE_STATUSES and time.monotonic() < deadline:
+                time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+                job = fetch()
+
+    return _public_job(job)
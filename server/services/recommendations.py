@@ -0,0 +1,498 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import logging
+from utils.retrieve_user_metrics import retrieve_user_metrics
+from utils.retrieve_user_notes import retrieve_user_notes
+from utils.soap_cache import get_soap_note, soap_version
+from utils.store_recommendations import store_recommendations
+from utils.recommendation_runs import compute_category_digest, get_category_digests, store_category_digests
+from utils.retrive_user_recommendations import retrieve_user_recommendations
+from utils.supabase.init_supabase import get_supabase
+from utils.timing import pipeline, stage
+from utils.metrics import increment
+from utils.prompt_encoder import (
+    ENCODING_VERSION, PROMPT_MAX_NOTES, encode_notes, encode_past_recommendations, encode_risk_clusters, report_prompt_size
+)
+from utils.llm_gateway import config_version, generate_content, make_config, LLMBusyError
+from services.errors import ServiceError
+from services.risk_analysis import build_soap_input, format_metrics_summary, get_stored_risk_analysis, resolve_request_soap_mode
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_CATEGORIES = ('Sleep', 'Steps', 'Heart_Rate')
+
+# Risk cluster name keywords for the category whose recommendations address that cluster
+CATEGORY_CLUSTER_KEYWORDS = {
+    'Sleep': ('sleep',),
+    'Steps': ('activity', 'exercise'),
+    'Heart_Rate': ('heart', 'cardio')
+}
+
+# retrieve_user_metrics key each category is about
+CATEGORY_METRICS = {
+    'Sleep': 'sleep',
+    'Steps': 'steps',
+    'Heart_Rate': 'heart_rate'
+}
+
+# Map risk levels to numeric values for calculating recommendation counts
+RISK_LEVEL_WEIGHTS = {
+    "Low Risk": 1,
+    "Medium Risk": 2,
+    "Moderate Risk": 2,
+    "High Risk": 3
+}
+
+FALLBACK_RECOMMENDATION = {"recommendation": "Unable to generate recommendation", "explanation": "Error in processing", "frequency": "N/A"}
+
+@lru_cache(maxsize=None)
+def _recommendations_config(category_counts: tuple):
+    """
+    Build (once per combination of categories and counts) the generation config for recommendations.
+
+    Args:
+        category_counts (tuple): ((category, count), ...) in the order they should appear
+    """
+    category_names = [category.replace('_', ' ') for category, _ in category_counts]
+    if len(category_names) == 1:
+        focus = f"Focus on one specific category: {category_names[0]}."
+    else:
+        focus = f"Focus on {len(category_names)} specific categories: {', '.join(category_names[:-1])}, and {category_names[-1]}."
+    count_lines = "\n".join(f"   - {name}: {max(2, count)} recommendations" for name, (_, count) in zip(category_names, category_counts))
+    format_entries = ",\n".join(f"""    "{category}": [
+        {{
+            "recommendation": "string",
+            "explanation": "string",
+            "frequency": "string",
+            "risk_cluster": "string"
+        }}
+    ]""" for category, _ in category_counts)
+
+    system_instruction = f"""You are a health recommendations generator. Based on the provided SOAP note, risk analysis, past recommendations (if available), and user notes (if available), generate practical, actionable recommendations that anyone can implement in their daily life. {focus}
+
+Your task is to:
+1. Analyze the SOAP note, risk predictions, and user notes
+2. Generate recommendations according to the specified counts for each category:
+{count_lines}
+
+3. If user notes are provided:
+   - Analyze the notes to understand the user's daily habits, physical/mental feelings, and activities
+   - Adapt recommendations to align with the user's lifestyle and preferences mentioned in their notes
+   - Directly reference specific habits or activities mentioned in the notes when relevant
+
+4. If past recommendations are provided:
+   - Study the accepted recommendations to understand user preferences
+   - Avoid repeating exact recommendations that were previously unaccepted
+   - Generate new recommendations that align with the style and complexity of accepted recommendations
+   
+5. Return ONLY a valid JSON object in exactly this format (no other text before or after):
+
+{{
+{format_entries}
+}}
+
+Guidelines:
+1. Generate EXACTLY the number of recommendations specified for each category, but NEVER less than 2
+2. Ensure all recommendations are UNIQUE and DISTINCT from each other - each recommendation should target a different aspect of health within its category
+3. For each recommendation, specify the risk cluster it addresses from the risk analysis results
+4. Recommendations should be specific and actionable
+5. Focus on lifestyle changes that don't require special equipment
+6. Avoid medical advice or treatment suggestions
+7. Keep recommendations simple and achievable
+8. Include clear frequency guidelines
+9. Explanations should reference the data from the SOAP note, risk analysis, or user notes
+10. If past accepted recommendations exist, maintain a similar style and complexity level
+11. Ensure new recommendations are unique and not duplicates of past ones
+12. Avoid extreme similarity between recommendations - each should offer a different approach or target a different aspect
+13. When user notes mention specific activities, habits, preferences, or physical/mental feelings, tailor recommendations to address or incorporate these personal aspects
+14. Return ONLY the JSON object - no other text, no markdown formatting
+
+IMPORTANT: Your response must be a valid JSON object and nothing else. Do not include any explanatory text, markdown formatting, or code blocks."""
+
+    return make_config(system_instruction, temperature=0.7)
+
+def _cluster_category(cluster_name: str):
+    """Return the category a risk cluster maps to, or None if it maps to none"""
+    cluster_name = (cluster_name or '').lower()
+    for category, keywords in CATEGORY_CLUSTER_KEYWORDS.items():
+        if any(keyword in cluster_name for keyword in keywords):
+            return category
+    return None
+
+def _category_clusters(formatted_predictions: list, categories) -> list:
+    """Clusters relevant to these categories: those mapped to one of them, plus clusters no category claims"""
+    return [
+        prediction for prediction in formatted_predictions
+        if _cluster_category(prediction.get('cluster_name')) in (*categories, None)
+    ]
+
+def recommendation_counts(formatted_predictions: list) -> dict:
+    """
+    Calculate recommended number of recommendations per category based on risk analysis.
+
+    Args:
+        formatted_predictions (list): List of risk predictions and their explanations
+
+    Returns:
+        dict: {category: count}, at least 1 per category
+    """
+    category_recommendation_counts = {category: 0 for category in RECOMMENDATION_CATEGORIES}
+
+    # Analyze predictions to determine recommendation counts
+    for prediction in formatted_predictions:
+        risk_level = prediction.get('risk_level', '').lower()
+        diseases = prediction.get('diseases', [])
+        
+        # Calculate base count from risk level and disease count
+        risk_weight = RISK_LEVEL_WEIGHTS.get(risk_level, 1)
+        disease_count = len(diseases)
+        
+        # Calculate recommendation count: 1-2 for low risk/few diseases, 2-3 for medium, 3-4 for high risk/many diseases
+        rec_count = min(4, max(1, risk_weight + (disease_count // 3)))
+        
+        # Map cluster to health metric categories
+        category = _cluster_category(prediction.get('cluster_name'))
+        if category:
+            category_recommendation_counts[category] = max(category_recommendation_counts[category], rec_count)
+
+    # Ensure at least 1 recommendation per category
+    for category in category_recommendation_counts:
+        if category_recommendation_counts[category] == 0:
+            category_recommendation_counts[category] = 1
+    return category_recommendation_counts
+
+def generate_recommendations(soap_note: str, formatted_predictions: list, past_recommendations: dict = None,
+                             user_notes: list = None, categories: list = None) -> dict:
+    """
+    Generate personalized health recommendations using Gemini model.
+    
+    Args:
+        soap_note (str): The SOAP note containing patient data
+        formatted_predictions (list): List of risk predictions and their explanations
+        past_recommendations (dict): Dictionary of past recommendations categorized by acceptance status
+        user_notes (list): List of user notes with timestamps
+        categories (list): Categories to generate (defaults to all); the prompt only
+            carries the clusters and past recommendations relevant to them
+        
+    Returns:
+        dict: Recommendations by category
+    """
+    categories = [category for category in RECOMMENDATION_CATEGORIES if category in (categories or RECOMMENDATION_CATEGORIES)]
+    all_counts = recommendation_counts(formatted_predictions)
+    category_recommendation_counts = {category: all_counts[category] for category in categories}
+
+    if past_recommendations:
+        past_recommendations = {
+            status: {category: (past_recommendations.get(status) or {}).get(category, []) for category in categories}
+            for status in ('accepted', 'unaccepted')
+        }
+
+    # Prepare compact input for Gemini
+    counts = ", ".join(f"{category}={count}" for category, count in category_recommendation_counts.items())
+    input_text = f"""SOAP Note:
+{soap_note}
+
+Risk Analysis Results:
+{encode_risk_clusters(_category_clusters(formatted_predictions, categories))}
+
+Recommended recommendation counts per category: {counts}"""
+
+    # Add past recommendations (newest of each status and category) to input if available
+    encoded_past_recommendations = encode_past_recommendations(past_recommendations)
+    if encoded_past_recommendations:
+        input_text += f"""
+
+Past Recommendations:
+{encoded_past_recommendations}"""
+
+    # Add user notes to input if available
+    if user_notes and len(user_notes) > 0:
+        input_text += "\n\n" + "\n".join(encode_notes(user_notes, label='User Notes'))
+
+    report_prompt_size('recommendations', input_text)
+
+    generate_content_config = _recommendations_config(tuple(category_recommendation_counts.items()))
+
+    try:
+        # Get the response text and clean it
+        response_text = generate_content(input_text, generate_content_config, name='recommendations').strip()
+        
+        # Try to find JSON content if there's any extra text
+        try:
+            # First try to parse as is
+            recommendations = json.loads(response_text)
+        except json.JSONDecodeError:
+            # If that fails, try to find JSON object in the text
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            
+            if start_idx != -1 and end_idx != 0:
+                json_content = response_text[start_idx:end_idx]
+                try:
+                    recommendations = json.loads(json_content)
+                except json.JSONDecodeError:
+                    logger.error(f"Failed to parse JSON content: {json_content}")
+                    raise
+            else:
+                logger.error(f"No valid JSON found in response: {response_text}")
+                raise ValueError("Generated content is not in valid JSON format")
+        
+        # Validate the structure of the recommendations, keeping only the requested categories
+        required_fields = ["recommendation", "explanation", "frequency"]
+        recommendations = {category: recommendations.get(category) for category in categories}
+        
+        for category in categories:
+            if not isinstance(recommendations[category], list):
+                recommendations[category] = []
+            
+            # Ensure each recommendation has all required fields
+            for rec in recommendations[category]:
+                for field in required_fields:
+                    if field not in rec:
+                        rec[field] = "Not specified"
+        
+        return recommendations
+        
+    except Exception as e:
+        logger.error(f"Error generating recommendations: {str(e)}")
+        # Return a basic structure if generation fails
+        return {category: [dict(FALLBACK_RECOMMENDATION)] for category in categories}
+
+def _is_fallback(category_recommendations: list) -> bool:
+    return category_recommendations == [FALLBACK_RECOMMENDATION]
+
+def _generate_categories(soap_note: str, formatted_predictions: list, past_recommendations: dict,
+                         user_notes: list, categories: list) -> dict:
+    """Generate each category with its own smaller prompt, concurrently when there are several"""
+    if len(categories) == 1:
+        return generate_recommendations(soap_note, formatted_predictions, past_recommendations, user_notes, categories)
+
+    with ThreadPoolExecutor(max_workers=len(categories), thread_name_prefix='recommendations') as executor:
+        futures = {
+            category: executor.submit(
+                generate_recommendations, soap_note, formatted_predictions, past_recommendations, user_notes, [category]
+            )
+            for category in categories
+        }
+        return {category: future.result()[category] for category, future in futures.items()}
+
+def _category_inputs(category: str, formatted_predictions: list, metrics: dict, user_notes: list,
+                     counts: dict, soap_mode: str) -> dict:
+    """Everything a category's recommendations are generated from, for its digest"""
+    metrics = metrics or {}
+    return {
+        # LLM-written explanations vary between analyses, so only the clusters' substance counts
+        'clusters': sorted(
+            (
+                cluster.get('cluster_name'),
+                cluster.get('risk_level'),
+                sorted(str(disease.get('icd9_code')) for disease in cluster.get('diseases', []))
+            )
+            for cluster in _category_clusters(formatted_predictions, [category])
+        ),
+        'metric': metrics.get(CATEGORY_METRICS[category]),
+        'characteristics': metrics.get('characteristics'),
+        'body_measurements': metrics.get('body_measurements'),
+        'notes': (user_notes or [])[:PROMPT_MAX_NOTES],
+        'count': counts[category],
+        'versions': {
+            'prompt': config_version(_recommendations_config(((category, counts[category]),))),
+            'encoding': ENCODING_VERSION,
+            'soap': soap_version(soap_mode)
+        }
+    }
+
+@pipeline('recommendations')
+def create_recommendations(user_id: str, soap_mode: str = None, force: bool = False) -> dict:
+    """
+    Generate and store personalized health recommendations from the user's stored risk analysis.
+    Only categories whose inputs (related risk clusters, metric, notes) changed since they were
+    last generated, or that have no open suggestions left, are regenerated.
+
+    Args:
+        user_id (str): The device_id of the user
+        soap_mode (str): How the SOAP note is produced (llm, template, auto or hybrid; defaults to SOAP_MODE)
+        force (bool): Regenerate every category even if its inputs are unchanged
+
+    Returns:
+        dict: recommendations (every category; unchanged ones are the stored suggestions),
+        regenerated_categories, the source data they were generated from, and user_id
+
+    Raises:
+        ServiceError: If the device or its risk analysis doesn't exist, or the LLM is saturated
+    """
+    soap_mode = resolve_request_soap_mode(soap_mode)
+
+    # Read the stored risk analysis in-process rather than through the public API
+    logger.info(f"Getting stored risk analysis for user {user_id}")
+    with stage('risk_lookup'):
+        risk_analysis_data = get_stored_risk_analysis(user_id)
+
+    # Check if we have any predictions
+    if not risk_analysis_data.get('predictions'):
+        raise ServiceError('No risk analysis predictions available for this user.', 404)
+
+    formatted_predictions = risk_analysis_data['predictions']
+
+    with stage('metrics'):
+        metrics = retrieve_user_metrics(user_id)
+
+    # Get past recommendations for the user
+    with stage('past_recommendations'):
+        past_recommendations = retrieve_user_recommendations(user_id)
+
+    # Get user notes for the user
+    with stage('notes'):
+        user_notes = retrieve_user_notes(user_id)
+    logger.info(f"Retrieved {len(user_notes)} notes for user {user_id}")
+
+    # Work out which categories changed since they were last generated
+    with stage('digests'):
+        # get_stored_risk_analysis has already checked that the device exists
+        device_response = get_supabase().table('devices').select('id').eq('device_id', user_id).execute()
+        device_internal_id = device_response.data[0]['id']
+        counts = recommendation_counts(formatted_predictions)
+        digests = {
+            category: compute_category_digest(_category_inputs(category, formatted_predictions, metrics, user_notes, counts, soap_mode))
+            for category in RECOMMENDATION_CATEGORIES
+        }
+        previous_digests = {} if force else get_category_digests(device_internal_id)
+    open_suggestions = (past_recommendations or {}).get('unaccepted') or {}
+    changed_categories = [
+        category for category in RECOMMENDATION_CATEGORIES
+        if digests[category] != previous_digests.get(category) or not open_suggestions.get(category)
+    ]
+    increment('recommendation_categories_regenerated', len(changed_categories))
+    increment('recommendation_categories_unchanged', len(RECOMMENDATION_CATEGORIES) - len(changed_categories))
+    logger.info(f"Regenerating recommendation categories for user {user_id}: {changed_categories or 'none'}")
+
+    # Unchanged categories keep their stored suggestions
+    recommendations = {category: open_suggestions.get(category, []) for category in RECOMMENDATION_CATEGORIES}
+    soap_note = None
+    soap_source = None
+
+    if changed_categories:
+        try:
+            # Get SOAP note for the user
+            with stage('soap'):
+                # Same cache key as a risk analysis of the same metrics, so a refresh reuses its note
+                if metrics:
+                    soap_note, soap_source = get_soap_note(
+                        {'clinical_text': None, 'metrics': metrics},
+                        build_soap_input(formatted_metrics=format_metrics_summary(metrics)),
+                        soap_mode
+                    )
+                else:
+                    logger.warning(f"No metrics found for user {user_id}, generating SOAP note from predictions only")
+                    # The template renders metrics, so a note from predictions alone always comes from Gemini
+                    soap_note, soap_source = get_soap_note(
+                        {'predictions': formatted_predictions},
+                        encode_risk_clusters(formatted_predictions),
+                        'llm'
+                    )
+        except LLMBusyError as e:
+            logger.warning(f"LLM capacity exhausted: {str(e)}")
+            raise ServiceError('Service is busy. Please try again shortly.', 503, {'Retry-After': '5'})
+
+        # Generate the changed categories using stored predictions, generated SOAP note, past recommendations, and user notes
+        with stage('recommendations'):
+            generated = _generate_categories(soap_note, formatted_predictions, past_recommendations, user_notes, changed_categories)
+        recommendations.update(generated)
+
+        # Store recommendations in database, replacing only the regenerated categories
+        with stage('store'):
+            storage_success = store_recommendations(user_id, generated, changed_categories)
+        if not storage_success:
+            logger.warning("Failed to store recommendations in database")
+        else:
+            # Categories that failed to generate are retried on the next refresh
+            store_category_digests(device_internal_id, {
+                category: digests[category] for category in changed_categories if not _is_fallback(generated[category])
+            })
+
+    return {
+        'recommendations': recommendations,
+        'regenerated_categories': changed_categories,
+        'source_data': {
+            'soap_note': soap_note,
+            'soap_source': soap_source,
+            'formatted_predictions': formatted_predictions,
+            'past_recommendations': past_recommendations,
+            'user_notes': user_notes
+        },
+        'user_id': user_id
+    }
+
+def get_device_recommendations(device_id: str) -> dict:
+    """
+    Retrieve all recommendations for a device, grouped by category.
+
+    Args:
+        device_id (str): The device_id of the user
+
+    Returns:
+        dict: recommendations grouped by category, and user_id
+
+    Raises:
+        ServiceError: If the device doesn't exist
+    """
+    supabase = get_supabase()
+
+    # First verify the device exists and get internal ID
+    device_response = supabase.table('devices').select('id').eq('device_id', device_id).execute()
+    if not device_response.data:
+        raise ServiceError('Device not found', 404)
+
+    device_internal_id = device_response.data[0]['id']
+    logger.info(f"Found device with internal ID: {device_internal_id}")
+
+    # Get all recommendations for this device
+    recommendations_response = supabase.table('recommendations')\
+        .select('*')\
+        .eq('device_id', device_internal_id)\
+        .order('created_at', desc=True)\
+        .execute()
+
+    # Group recommendations by category
+    categorized_recommendations = {
+        'Sleep': [],
+        'Steps': [],
+        'Heart_Rate': []
+    }
+
+    for rec in recommendations_response.data:
+        category = rec['category']
+        if category in categorized_recommendations:
+            categorized_recommendations[category].append({
+                'id': rec['id'],
+                'recommendation': rec['recommendation'],
+                'explanation': rec['explanation'],
+                'frequency': rec['frequency'],
+                'accepted': rec['accepted']
+            })
+
+    return {
+        'recommendations': categorized_recommendations,
+        'user_id': device_id
+    }
+
+def set_recommendation_acceptance(recommendation_id: int, accepted: bool) -> None:
+    """
+    Update the acceptance status of a recommendation.
+
+    Args:
+        recommendation_id (int): Recommendation row id
+        accepted (bool): New acceptance status
+
+    Raises:
+        ServiceError: If the recommendation doesn't exist
+    """
+    result = get_supabase().table('recommendations')\
+        .update({'accepted': accepted})\
+        .eq('id', recommendation_id)\
+        .execute()
+
+    if not result.data:
+        raise ServiceError('Recommendation not found', 404)
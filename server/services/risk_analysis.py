@@ -0,0 +1,333 @@
+import json
+import logging
+import time
+from utils.retrieve_user_metrics import retrieve_user_metrics
+from utils.soap_cache import get_soap_note, iter_soap_note, soap_version
+from utils.soap_template import resolve_soap_mode
+from utils.analysis_snapshots import compute_analysis_fingerprint, get_matching_snapshot, store_snapshot
+from utils.format_predictions import PROMPT_VERSION as FORMAT_PROMPT_VERSION, format_predictions
+from utils.store_risk_analysis import store_risk_analysis
+from utils.inference_client import (
+    wait_for_model, get_model_status, get_labels, get_model_version, predict_probabilities,
+    InferenceBusyError, InferenceUnavailableError
+)
+from utils.probability_vectors import RISK_THRESHOLD, select_predictions, store_probability_vector
+from utils.llm_gateway import LLMBusyError
+from utils.metrics import increment, set_gauge_once
+from utils.prompt_encoder import ENCODING_VERSION, encode_metrics
+from utils.supabase.init_supabase import get_supabase
+from utils.timing import pipeline, stage
+from services.errors import ServiceError
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+def format_metrics_summary(metrics: dict) -> str:
+    """Serialize retrieved metrics the way they are shown to the SOAP generator (compact encoding)"""
+    return encode_metrics(metrics)
+
+def build_soap_input(clinical_text: str = None, formatted_metrics: str = None) -> str:
+    """
+    Build the SOAP generator input from clinical text and/or formatted metrics.
+    Every pipeline uses this so the same inputs always produce the same prompt.
+
+    Args:
+        clinical_text (str): Free-text clinical notes
+        formatted_metrics (str): Metrics serialized with format_metrics_summary
+
+    Returns:
+        str: Input text for generate_soap_note (empty if there is no data)
+    """
+    input_text = ""
+    if clinical_text:
+        input_text += clinical_text
+    if formatted_metrics:
+        if input_text:
+            input_text += "\n\n"
+        input_text += f"Health Metrics from the last 30 days:\n{formatted_metrics}"
+    return input_text
+
+def _current_model_version() -> str:
+    """Return the diagnosis model version, or None while the model isn't available"""
+    try:
+        return get_model_version()
+    except (InferenceUnavailableError, RuntimeError):
+        return None
+
+def _get_device_internal_id(device_id: str):
+    """Return the internal devices.id for a device_id, or None if the device doesn't exist"""
+    device_response = get_supabase().table('devices').select('id').eq('device_id', device_id).execute()
+    return device_response.data[0]['id'] if device_response.data else None
+
+def resolve_request_soap_mode(soap_mode: str = None) -> str:
+    """Resolve a request's soap_mode, rejecting unknown modes as a bad request"""
+    try:
+        return resolve_soap_mode(soap_mode)
+    except ValueError as e:
+        raise ServiceError(str(e), 400)
+
+@pipeline('risk_analysis')
+def run_risk_analysis(user_id: str = None, clinical_text: str = None, force: bool = False, soap_mode: str = None) -> dict:
+    """
+    Analyze clinical text and/or health metrics for potential diagnoses.
+    For a known device, the previous analysis is returned as-is when none of its inputs changed.
+
+    Args:
+        user_id (str): The device_id of the user (metrics are retrieved and results stored if given)
+        clinical_text (str): Free-text clinical notes
+        force (bool): Run the full pipeline even if the inputs are unchanged
+        soap_mode (str): How the SOAP note is produced (llm, template, auto or hybrid; defaults to SOAP_MODE)
+
+    Returns:
+        dict: Predictions, SOAP note and how it was produced ('soap_source'), metrics summary,
+        formatted predictions and whether the result was reused ('cached')
+
+    Raises:
+        ServiceError: If there is nothing to analyze or the model/LLM is unavailable
+    """
+    for event, data in iter_risk_analysis(user_id, clinical_text, force, soap_mode=soap_mode):
+        if event == 'result':
+            return data
+
+def iter_risk_analysis(user_id: str = None, clinical_text: str = None, force: bool = False, stream_soap: bool = False,
+                       soap_mode: str = None):
+    """
+    Run the risk analysis pipeline, yielding each stage's output as soon as it is ready.
+
+    Args:
+        user_id (str): The device_id of the user (metrics are retrieved and results stored if given)
+        clinical_text (str): Free-text clinical notes
+        force (bool): Run the full pipeline even if the inputs are unchanged
+        stream_soap (bool): Stream the SOAP note from Gemini as 'soap_chunk' events
+        soap_mode (str): How the SOAP note is produced (llm, template, auto or hybrid; defaults to SOAP_MODE)
+
+    Yields:
+        tuple: (event, data) with events 'metrics', 'soap_chunk', 'soap', 'predictions',
+        'formatted' and finally 'result' (the same dict run_risk_analysis returns)
+
+    Raises:
+        ServiceError: If there is nothing to analyze or the model/LLM is unavailable
+    """
+    soap_mode = resolve_request_soap_mode(soap_mode)
+    metrics = None
+    formatted_metrics = None
+    soap_note = None
+    soap_source = None
+    device_internal_id = None
+    fingerprint = None
+    snapshot = None
+
+    if user_id:
+        with stage('fingerprint'):
+            device_internal_id = _get_device_internal_id(user_id)
+            if device_internal_id is not None:
+                fingerprint = compute_analysis_fingerprint(device_internal_id, clinical_text, {
+                    'soap_mode': soap_mode,
+                    'soap': soap_version(soap_mode),
+                    'format_prompt': FORMAT_PROMPT_VERSION,
+                    'encoding': ENCODING_VERSION,
+                    'threshold': RISK_THRESHOLD
+                })
+                # The model version is only known once the model is up; without it we can't reuse
+                current_model_version = _current_model_version()
+                if not force and current_model_version:
+                    snapshot = get_matching_snapshot(device_internal_id, fingerprint, current_model_version)
+        if snapshot:
+            logger.info(f"Inputs unchanged for user {user_id}, returning previous analysis")
+            increment('risk_analysis_unchanged')
+            yield 'result', {**snapshot, 'cached': True}
+            return
+
+        logger.info(f"Retrieving metrics for user {user_id}")
+        with stage('metrics'):
+            metrics = retrieve_user_metrics(user_id)
+        if metrics:
+            # Format and log the metrics
+            formatted_metrics = format_metrics_summary(metrics)
+            logger.info("\nUser Health Metrics Summary:\n" + formatted_metrics)
+        else:
+            logger.warning(f"No metrics found for user {user_id}")
+        yield 'metrics', {'metrics_summary': formatted_metrics}
+
+    # Generate SOAP note if we have either metrics or clinical text
+    input_text = build_soap_input(clinical_text, formatted_metrics)
+    if input_text:
+        logger.info("Generating SOAP note")
+        soap_inputs = {'clinical_text': clinical_text, 'metrics': metrics}
+        try:
+            with stage('soap'):
+                if stream_soap:
+                    chunks = []
+                    for chunk, soap_source in iter_soap_note(soap_inputs, input_text, soap_mode):
+                        chunks.append(chunk)
+                        yield 'soap_chunk', {'text': chunk}
+                    soap_note = "".join(chunks)
+                else:
+                    soap_note, soap_source = get_soap_note(soap_inputs, input_text, soap_mode)
+        except LLMBusyError as e:
+            logger.warning(f"LLM capacity exhausted: {str(e)}")
+            raise ServiceError('Service is busy. Please try again shortly.', 503, {'Retry-After': '5'})
+        logger.info(f"\nGenerated SOAP Note ({soap_source}):\n" + soap_note)
+        yield 'soap', {'soap_note': soap_note, 'soap_source': soap_source}
+
+    # Check if we have enough data for analysis
+    if not soap_note and not clinical_text:
+        logger.warning("No clinical text or SOAP note available for analysis")
+        raise ServiceError('Either clinical text or health metrics are required', 400)
+
+    model_start = time.monotonic()
+    try:
+        # Check if model is loaded for risk analysis, waiting for it if it is still loading
+        with stage('model_wait'):
+            model_available = wait_for_model()
+        if not model_available:
+            logger.error(f"Model not ready (state: {get_model_status()['state']})")
+            raise ServiceError('Model not initialized. Please try again later.', 503, {'Retry-After': '10'})
+
+        logger.info("Generating diagnosis predictions")
+
+        # Use SOAP note for prediction if available, otherwise use clinical text
+        prediction_text = soap_note if soap_note else clinical_text
+
+        # Score the text on the inference worker (or in-process when no worker is configured)
+        try:
+            predictions = predict_probabilities(prediction_text, priority='interactive')
+        except InferenceBusyError:
+            logger.warning("Inference queue is full")
+            raise ServiceError('Model is busy. Please try again shortly.', 503, {'Retry-After': '5'})
+        except InferenceUnavailableError as e:
+            logger.error(f"Inference unavailable: {str(e)}")
+            raise ServiceError('Model not initialized. Please try again later.', 503, {'Retry-After': '10'})
+    finally:
+        # Model wait and inference of the first request to reach the model, whatever its outcome
+        # (cold-start cost, without the metrics, SOAP and formatting stages around it)
+        set_gauge_once('risk_analysis_first_inference_seconds', time.monotonic() - model_start)
+    labels = get_labels()
+    model_version = get_model_version()
+
+    # Keep the full probability vector so thresholds can be re-applied without re-inference
+    if user_id:
+        with stage('store_vector'):
+            vector_stored = store_probability_vector(user_id, predictions, model_version)
+        if not vector_stored:
+            logger.warning("Failed to store probability vector")
+
+    # Apply the threshold and 3-digit code filter, sorted by probability
+    with stage('icd_lookup'):
+        results = select_predictions(predictions, labels, RISK_THRESHOLD)
+    yield 'predictions', {'predictions': results, 'model_version': model_version}
+
+    # Create response data
+    response_data = {
+        "predictions": results,
+        "input_text": clinical_text if clinical_text else None,
+        "soap_note": soap_note,
+        "soap_source": soap_source,
+        "metrics_summary": formatted_metrics if formatted_metrics else None,
+        "analysis_text_used": "SOAP Note" if soap_note else "Clinical Text"
+    }
+
+    # Format predictions using Gemini
+    logger.info("Formatting predictions with Gemini")
+    with stage('format'):
+        formatted_predictions = format_predictions(response_data)
+    if isinstance(formatted_predictions, dict) and "error" in formatted_predictions:
+        logger.error(f"Error formatting predictions: {formatted_predictions['error']}")
+        if "raw_response" in formatted_predictions:
+            logger.debug(f"Raw response: {formatted_predictions['raw_response']}")
+    else:
+        yield 'formatted', {'formatted_predictions': formatted_predictions}
+        logger.info(f"\nFormatted Predictions:\n{json.dumps(formatted_predictions, indent=2)}")
+
+        # Store predictions in Supabase if we have a user_id
+        if user_id:
+            logger.info("Storing risk analysis predictions")
+            with stage('store'):
+                storage_success = store_risk_analysis(
+                    device_id=user_id,
+                    analysis_text_used=response_data["analysis_text_used"],
+                    formatted_predictions=formatted_predictions
+                )
+            if not storage_success:
+                logger.warning("Failed to store risk analysis predictions")
+
+    # Add formatted predictions to response
+    response_data["formatted_predictions"] = formatted_predictions
+    response_data["cached"] = False
+
+    # Remember the result with its input fingerprint, unless formatting failed or the SOAP note
+    # fell back to the template, so that the next request retries Gemini
+    degraded = soap_mode == 'auto' and soap_source == 'template'
+    if fingerprint and not degraded and not (isinstance(formatted_predictions, dict) and "error" in formatted_predictions):
+        with stage('store_snapshot'):
+            if not store_snapshot(device_internal_id, fingerprint, model_version, response_data):
+                logger.warning("Failed to store risk analysis snapshot")
+
+    yield 'result', response_data
+
+def get_stored_risk_analysis(device_id: str) -> dict:
+    """
+    Retrieve the latest stored risk prediction per cluster for a device.
+
+    Args:
+        device_id (str): The device_id of the user
+
+    Returns:
+        dict: device_id, predictions (one per cluster, with recommendation_count)
+        and recommendation_counts per cluster
+
+    Raises:
+        ServiceError: If the device doesn't exist
+    """
+    supabase = get_supabase()
+
+    # First verify the device exists and get internal ID
+    device_response = supabase.table('devices').select('id').eq('device_id', device_id).execute()
+    if not device_response.data:
+        logger.warning(f"Device not found: {device_id}")
+        raise ServiceError('Device not found', 404)
+
+    device_internal_id = device_response.data[0]['id']
+    logger.info(f"Found device with internal ID: {device_internal_id}")
+
+    # Get all risk predictions for this device
+    predictions_response = supabase.table('risk_analysis_predictions')\
+        .select('*')\
+        .eq('device_id', device_internal_id)\
+        .order('created_at', desc=True)\
+        .execute()
+
+    if not predictions_response.data:
+        logger.info(f"No risk predictions found for device: {device_id}")
+        return {
+            'device_id': device_id,
+            'predictions': []
+        }
+
+    # Get all recommendations for this device
+    recommendations_response = supabase.table('recommendations')\
+        .select('*')\
+        .eq('device_id', device_internal_id)\
+        .execute()
+
+    # Count recommendations per cluster
+    cluster_recommendation_counts = {}
+    for rec in recommendations_response.data:
+        if rec['risk_cluster']:
+            cluster_recommendation_counts[rec['risk_cluster']] = cluster_recommendation_counts.get(rec['risk_cluster'], 0) + 1
+
+    # Group predictions by cluster, keeping the most recent entry for each cluster
+    clusters = {}
+    for prediction in predictions_response.data:
+        cluster_name = prediction['cluster_name']
+        # Always take the most recent prediction for each cluster
+        if cluster_name not in clusters:
+            clusters[cluster_name] = prediction
+            # Add recommendation count to the prediction data
+            clusters[cluster_name]['recommendation_count'] = cluster_recommendation_counts.get(cluster_name, 0)
+
+    return {
+        'device_id': device_id,
+        'predictions': list(clusters.values()),
+        'recommendation_counts': cluster_recommendation_counts  # Include total counts in response
+    }
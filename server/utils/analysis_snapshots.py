@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import json
+import logging
+from utils.supabase.init_supabase import get_supabase
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Synced metric types that feed the analysis; PPG windows arrive continuously but aren't analyzed
+FINGERPRINT_METRIC_TYPES = ('heart_rate', 'steps', 'sleep', 'characteristics', 'body_measurements')
+
+# Matches the notes window used by retrieve_user_metrics
+NOTES_WINDOW_DAYS = 30
+
+
+def compute_analysis_fingerprint(device_internal_id: int, clinical_text: str = None, versions: dict = None) -> str:
+    """
+    Hash everything a risk analysis depends on, using only cheap reads: per-metric sync times,
+    the ids of notes inside the notes window, the characteristics version, the clinical text,
+    and the prompt/threshold versions. The model version is matched separately, since it
+    may only be known once the model is loaded.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+        clinical_text (str): Free-text clinical notes sent with the request
+        versions (dict): Prompt versions and threshold
+
+    Returns:
+        str: sha256 hex digest
+    """
+    supabase = get_supabase()
+
+    sync_response = supabase.table('sync_status')\
+        .select('metric_type, last_sync_time')\
+        .eq('device_id', device_internal_id)\
+        .in_('metric_type', list(FINGERPRINT_METRIC_TYPES))\
+        .execute()
+
+    notes_start_date = datetime.utcnow() - timedelta(days=NOTES_WINDOW_DAYS)
+    notes_response = supabase.table('user_notes')\
+        .select('id')\
+        .eq('device_id', device_internal_id)\
+        .gte('created_at', notes_start_date.isoformat())\
+        .execute()
+
+    characteristics_response = supabase.table('user_characteristics')\
+        .select('updated_at')\
+        .eq('device_id', device_internal_id)\
+        .execute()
+
+    inputs = {
+        'sync': sorted((row['metric_type'], row['last_sync_time']) for row in sync_response.data),
+        'notes': sorted(row['id'] for row in notes_response.data),
+        'characteristics': [row['updated_at'] for row in characteristics_response.data],
+        'clinical_text': clinical_text,
+        'versions': versions or {}
+    }
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get_matching_snapshot(device_internal_id: int, fingerprint: str, model_version: str):
+    """
+    Return the stored analysis for a device if it was produced from the same inputs and model.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+        fingerprint (str): Fingerprint of the current inputs
+        model_version (str): Current diagnosis model version
+
+    Returns:
+        dict: The stored analysis response plus 'analyzed_at', or None if there is no match
+    """
+    response = get_supabase().table('risk_analysis_snapshots')\
+        .select('fingerprint, model_version, result, updated_at')\
+        .eq('device_id', device_internal_id)\
+        .limit(1)\
+        .execute()
+
+    if not response.data:
+        return None
+
+    snapshot = response.data[0]
+    if snapshot['fingerprint'] != fingerprint or snapshot['model_version'] != model_version:
+        return None
+    return {**snapshot['result'], 'analyzed_at': snapshot['updated_at']}
+
+
+def store_snapshot(device_internal_id: int, fingerprint: str, model_version: str, result: dict) -> bool:
+    """
+    Store (replacing any previous one) the latest analysis of a device with its input fingerprint.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+        fingerprint (str): Fingerprint of the inputs the analysis was produced from
+        model_version (str): Diagnosis model version that produced it
+        result (dict): Analysis response
+
+    Returns:
+        bool: True if storage was successful, False otherwise
+    """
+    try:
+        response = get_supabase().table('risk_analysis_snapshots').upsert({
+            'device_id': device_internal_id,
+            'fingerprint': fingerprint,
+            'model_version': model_version,
+            'result': result,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }, on_conflict='device_id').execute()
+        return bool(response.data)
+    except Exception as e:
+        logger.error(f"Error storing risk analysis snapshot: {str(e)}", exc_info=True)
+        return False
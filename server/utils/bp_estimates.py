@@ -0,0 +1,30 @@
+import logging
+from utils.supabase.init_supabase import get_supabase
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+
+def store_beat_estimates(device_internal_id: int, beats: list) -> int:
+    """
+    Store per-beat blood pressure estimates. A beat already stored for the same device
+    and time is replaced, so re-estimating a window doesn't duplicate its beats.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+        beats (list): Dicts with window_id, timestamp, sbp, dbp, map, hr and confidence
+
+    Returns:
+        int: Number of beats stored (0 on error)
+    """
+    if not beats:
+        return 0
+
+    try:
+        response = get_supabase().table('bp_estimates').upsert([
+            {'device_id': device_internal_id, **beat} for beat in beats
+        ], on_conflict='device_id,timestamp').execute()
+        return len(response.data or [])
+    except Exception as e:
+        logger.error(f"Error storing blood pressure estimates: {str(e)}", exc_info=True)
+        return 0
@@ -0,0 +1,152 @@
+from datetime import datetime
+import logging
+import os
+import threading
+import time
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+import torch
+from utils.icd9_index import MODEL_NAME, load_icd9_index
+from utils.metrics import PROCESS_START_TIME, set_gauge
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Global variables for model management
+model = None
+tokenizer = None
+labels = None
+model_version = None
+model_lock = threading.Lock()
+model_ready = threading.Event()
+model_status = {'state': 'loading', 'error': None}
+
+# Sequence lengths used to warm up the model before it is marked ready
+WARMUP_SEQUENCE_LENGTHS = (64, 256, 512)
+
+def load_model():
+    """Load the CORe clinical diagnosis prediction model and warm it up."""
+    global model, tokenizer, labels, model_version
+
+    with model_lock:
+        if model is not None and tokenizer is not None:
+            logger.info("Model already loaded")
+            return
+
+        try:
+            logger.info("Starting to load CORe clinical diagnosis prediction model...")
+            start_time = datetime.now()
+
+            cache_dir = os.getenv('TRANSFORMERS_CACHE', '/app/.cache/huggingface')
+            logger.info(f"Using cache directory: {cache_dir}")
+
+            model_name = MODEL_NAME
+            loaded_tokenizer = AutoTokenizer.from_pretrained(model_name)
+            loaded_model = AutoModelForSequenceClassification.from_pretrained(model_name)
+            loaded_model.eval()
+
+            # Load the ICD-9 description index alongside the model so lookups are free
+            load_icd9_index()
+
+            end_time = datetime.now()
+            load_duration = (end_time - start_time).total_seconds()
+            logger.info(f"Model loaded successfully! Loading took {load_duration:.2f} seconds")
+            set_gauge('model_load_seconds', load_duration)
+
+            warm_up_model(loaded_model, loaded_tokenizer)
+
+            labels = [loaded_model.config.id2label[i] for i in range(len(loaded_model.config.id2label))]
+            model_version = f"{model_name}@{getattr(loaded_model.config, '_commit_hash', None) or 'main'}"
+            tokenizer = loaded_tokenizer
+            model = loaded_model
+            model_status['state'] = 'ready'
+            model_ready.set()
+            set_gauge('model_time_to_ready_seconds', time.monotonic() - PROCESS_START_TIME)
+
+        except Exception as e:
+            model_status['state'] = 'failed'
+            model_status['error'] = str(e)
+            logger.error(f"Error during model loading: {str(e)}", exc_info=True)
+            raise
+
+def warm_up_model(warm_model, warm_tokenizer):
+    """
+    Run forward passes over representative sequence lengths so the first real
+    request doesn't pay for one-time allocation and tokenizer initialization.
+
+    Args:
+        warm_model: Loaded sequence classification model
+        warm_tokenizer: Tokenizer matching the model
+    """
+    model_status['state'] = 'warming_up'
+    start_time = time.monotonic()
+    sample_text = "Subjective: No subjective data provided. Objective: Heart Rate: 72 BPM. "
+
+    for length in WARMUP_SEQUENCE_LENGTHS:
+        tokenized_input = warm_tokenizer(
+            sample_text * length,
+            return_tensors="pt",
+            truncation=True,
+            max_length=length,
+            padding="max_length"
+        )
+        with torch.no_grad():
+            warm_model(**tokenized_input)
+
+    warmup_duration = time.monotonic() - start_time
+    logger.info(f"Model warm-up over lengths {WARMUP_SEQUENCE_LENGTHS} took {warmup_duration:.2f} seconds")
+    set_gauge('model_warmup_seconds', warmup_duration)
+
+def predict_probabilities(texts: list, timings: dict = None):
+    """
+    Run the diagnosis model over a batch of texts.
+
+    Args:
+        texts (list): Clinical texts (e.g. SOAP notes)
+        timings (dict): If given, filled with 'tokenize' and 'model' durations in milliseconds
+
+    Returns:
+        numpy.ndarray: float32 array of shape (len(texts), number of labels) with sigmoid probabilities
+    """
+    if not model_ready.is_set():
+        raise RuntimeError("Model not initialized")
+
+    start_time = time.perf_counter()
+
+    # Tokenize input with truncation
+    tokenized_input = tokenizer(
+        texts,
+        return_tensors="pt",
+        truncation=True,
+        max_length=512,
+        padding=True
+    )
+
+    tokenized_time = time.perf_counter()
+
+    # Get model predictions
+    with torch.no_grad():
+        output = model(**tokenized_input)
+
+    # Apply sigmoid to get probabilities
+    probabilities = torch.sigmoid(output.logits).numpy()
+
+    if timings is not None:
+        timings['tokenize'] = (tokenized_time - start_time) * 1000
+        timings['model'] = (time.perf_counter() - tokenized_time) * 1000
+    return probabilities
+
+def get_labels() -> list:
+    """Return the model's labels in output order (empty until the model is loaded)."""
+    return labels or []
+
+def get_model_version() -> str:
+    """Return the model name and revision, used to tag stored probability vectors."""
+    return model_version
+
+def get_model_status() -> dict:
+    """Return the model readiness state."""
+    return {
+        'ready': model_ready.is_set(),
+        'state': model_status['state'],
+        'error': model_status['error']
+    }
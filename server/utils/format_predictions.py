@@ -1,34 +1,13 @@
-from google import genai
-from google.genai import types
 import json
 import logging
 import sys
+from utils.llm_gateway import config_version, generate_content_stream, make_config
+from utils.prompt_encoder import encode_json, encode_predictions, report_prompt_size
 
 # Simple logger without custom configuration
 logger = logging.getLogger(__name__)
 
-def format_predictions(data: dict) -> dict:
-    """
-    Format prediction data using Gemini AI to create a more usable summary.
-    Filters out uncategorized and unrecognized predictions.
-    
-    Args:
-        data (dict): Dictionary containing predictions, metrics, and SOAP note
-        
-    Returns:
-        dict: Formatted dictionary containing the model's interpretation
-    """
-    try:
-        client = genai.Client(
-            vertexai=True,
-            project="eon-health-450706",
-            location="us-central1",
-        )
-
-        # Convert input data to JSON string
-        text_part = types.Part.from_text(text=json.dumps(data))
-        
-        system_instruction = """You are an expert clinical risk interpreter. Your task is to transform the raw output of a predictive disease model into a concise, interpretable summary for a mobile app frontend, with a focus on preventive health awareness rather than definitive diagnoses. You will receive input as a JSON object that includes:
+SYSTEM_INSTRUCTION = """You are an expert clinical risk interpreter. Your task is to transform the raw output of a predictive disease model into a concise, interpretable summary for a mobile app frontend, with a focus on preventive health awareness rather than definitive diagnoses. You will receive input as a JSON object that includes:
 analysis_text_used (e.g. "SOAP Note")
 input_text (patient's self-report)
 metrics_summary (aggregated wearable/lifestyle metrics)
@@ -75,48 +54,30 @@ If no valid predictions remain after filtering, return an empty array.
 
 IMPORTANT: Return ONLY the JSON array, with no additional text or formatting."""
 
-        model = "gemini-2.0-flash-001"
-        contents = [
-            types.Content(
-                role="user",
-                parts=[text_part]
-            )
-        ]
-        
-        generate_content_config = types.GenerateContentConfig(
-            temperature=1,
-            top_p=0.95,
-            max_output_tokens=8192,
-            response_modalities=["TEXT"],
-            safety_settings=[
-                types.SafetySetting(
-                    category="HARM_CATEGORY_HATE_SPEECH",
-                    threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                    threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    threshold="OFF"
-                ),
-                types.SafetySetting(
-                    category="HARM_CATEGORY_HARASSMENT",
-                    threshold="OFF"
-                )
-            ],
-            system_instruction=[types.Part.from_text(text=system_instruction)],
-        )
+# Prebuilt so each request reuses the same config
+GENERATE_CONTENT_CONFIG = make_config(SYSTEM_INSTRUCTION, temperature=1)
+PROMPT_VERSION = config_version(GENERATE_CONTENT_CONFIG)
 
+def format_predictions(data: dict) -> dict:
+    """
+    Format prediction data using Gemini AI to create a more usable summary.
+    Filters out uncategorized and unrecognized predictions.
+    
+    Args:
+        data (dict): Dictionary containing predictions, metrics, and SOAP note
+        
+    Returns:
+        dict: Formatted dictionary containing the model's interpretation
+    """
+    try:
+        # Convert input data to compact JSON with the predictions sorted by probability
+        input_text = encode_json({**data, 'predictions': encode_predictions(data.get('predictions'))})
+        report_prompt_size('format_predictions', input_text)
+        
         # Collect the complete response
         response_text = ""
-        for chunk in client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            response_text += chunk.text
+        for chunk in generate_content_stream(input_text, GENERATE_CONTENT_CONFIG, name='format_predictions'):
+            response_text += chunk
             
         # Clean up the response text
         response_text = response_text.strip()
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+from functools import lru_cache
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "DATEXIS/CORe-clinical-diagnosis-prediction"
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'icd9_index.json')
+ICD9_INDEX_PATH = os.getenv('ICD9_INDEX_PATH', DEFAULT_INDEX_PATH)
+# Look codes up with the NLM API when the bundled index is missing (off by default so
+# serving never depends on the network; useful in a dev checkout without the index)
+ICD9_NLM_FALLBACK = os.getenv('ICD9_NLM_FALLBACK', '0') == '1'
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def normalize_code(code: str) -> str:
+    """Strip the dot from an ICD-9 code so "414.0" and "4140" share one key."""
+    return code.replace('.', '').strip()
+
+
+def load_icd9_index(path: str = None) -> dict:
+    """
+    Load the bundled ICD-9-CM index into memory. Safe to call repeatedly.
+
+    Args:
+        path (str): Path of the JSON index (defaults to ICD9_INDEX_PATH)
+
+    Returns:
+        dict: The loaded index with 'labels' and 'descriptions', empty if the file is missing
+    """
+    global _index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+
+        path = path or ICD9_INDEX_PATH
+        try:
+            with open(path) as f:
+                _index = json.load(f)
+            logger.info(f"Loaded {len(_index.get('descriptions', {}))} ICD-9 descriptions from {path}")
+        except FileNotFoundError:
+            if ICD9_NLM_FALLBACK:
+                logger.warning(f"ICD-9 index not found at {path}; looking descriptions up with the NLM API")
+            else:
+                logger.error(f"ICD-9 index not found at {path}: every prediction will be reported as "
+                             "'Description not found'. Run `python build_icd9_index.py` to build it, "
+                             "or set ICD9_NLM_FALLBACK=1 to look codes up online")
+            _index = {'labels': [], 'descriptions': {}, 'missing': True}
+        return _index
+
+
+def get_icd9_description(code: str) -> str:
+    """
+    Get the description for an ICD-9 code from the local index.
+
+    Args:
+        code (str): ICD-9 code, with or without a dot
+
+    Returns:
+        str: Description of the code, or None if it isn't in the index
+    """
+    index = load_icd9_index()
+    if index.get('missing'):
+        if not ICD9_NLM_FALLBACK:
+            return None
+        # No bundled index (e.g. a dev checkout that hasn't built it): fall back to the NLM API
+        return _get_remote_icd9_description(normalize_code(code))
+    return index['descriptions'].get(normalize_code(code))
+
+
+@lru_cache(maxsize=1000)
+def _get_remote_icd9_description(code: str) -> str:
+    """Look up a single code with the NLM API when the local index is unavailable."""
+    import requests
+    from build_icd9_index import fetch_icd9_description
+
+    try:
+        with requests.Session() as session:
+            # No retries: a request is waiting on this lookup
+            return fetch_icd9_description(session, code, retries=0)
+    except Exception as e:
+        logger.error(f"Error fetching ICD-9 description for code {code}: {str(e)}")
+        return None
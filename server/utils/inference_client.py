@@ -0,0 +1,284 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import Client
+import numpy as np
+from utils.metrics import increment
+from utils.ppg2abp.inference import BPModelUnavailableError
+from utils.timing import record_stage
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Unix socket of the dedicated inference worker (see inference_worker.py), which also hosts the
+# PPG2ABP model and blood pressure streams. When unset, both run inside this process.
+INFERENCE_SOCKET = os.getenv('INFERENCE_SOCKET')
+INFERENCE_AUTHKEY = os.getenv('INFERENCE_AUTHKEY', 'eon-inference').encode()
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '60'))
+
+# Lower values are served first by the inference worker
+PRIORITIES = {
+    'interactive': 0,
+    'background': 5,
+    'batch': 10
+}
+
+# Requests arriving while the model loads may wait for it instead of failing.
+# MODEL_WAIT_TIMEOUT=0 disables waiting; MODEL_WAIT_QUEUE_SIZE bounds the waiters.
+MODEL_WAIT_TIMEOUT = float(os.getenv('MODEL_WAIT_TIMEOUT', '30'))
+MODEL_WAIT_QUEUE_SIZE = int(os.getenv('MODEL_WAIT_QUEUE_SIZE', '8'))
+model_wait_slots = threading.BoundedSemaphore(MODEL_WAIT_QUEUE_SIZE)
+
+_labels = None
+_model_version = None
+
+
+class InferenceBusyError(Exception):
+    """Raised when the inference worker's queue is full."""
+
+
+class InferenceUnavailableError(Exception):
+    """Raised when the inference worker can't be reached or isn't ready."""
+
+
+def use_inference_worker() -> bool:
+    """Return True if inference runs in the dedicated worker process."""
+    return bool(INFERENCE_SOCKET)
+
+
+def _request(message: dict, timeout: float) -> dict:
+    """Send one request to the inference worker and wait for its reply."""
+    try:
+        conn = Client(INFERENCE_SOCKET, family='AF_UNIX', authkey=INFERENCE_AUTHKEY)
+    except OSError as e:
+        raise InferenceUnavailableError(f"Inference worker unavailable: {str(e)}")
+
+    with conn:
+        try:
+            conn.send(message)
+            if not conn.poll(timeout):
+                raise InferenceUnavailableError("Timed out waiting for the inference worker")
+            reply = conn.recv()
+        except (EOFError, OSError) as e:
+            # The worker died or dropped the connection mid-request
+            raise InferenceUnavailableError(f"Lost connection to the inference worker: {str(e) or type(e).__name__}")
+
+    error = reply.get('error')
+    if error == 'busy':
+        raise InferenceBusyError("Inference queue is full")
+    if error == 'not_ready':
+        raise InferenceUnavailableError("Model not initialized")
+    if error == 'invalid_input':
+        raise ValueError(reply.get('detail'))
+    if error == 'bp_model_unavailable':
+        raise BPModelUnavailableError(reply.get('detail'))
+    if error == 'internal':
+        raise InferenceUnavailableError(f"Inference worker failed: {reply.get('detail')}")
+    if error:
+        raise RuntimeError(error)
+    return reply
+
+
+def get_model_status() -> dict:
+    """Return the readiness state of the model, wherever it is served."""
+    if not use_inference_worker():
+        from utils.diagnosis_model import get_model_status as get_local_model_status
+        return get_local_model_status()
+
+    try:
+        return _request({'op': 'status'}, timeout=2)['status']
+    except (InferenceUnavailableError, RuntimeError) as e:
+        return {'ready': False, 'state': 'unavailable', 'error': str(e)}
+
+
+def get_worker_metrics():
+    """
+    Return the inference worker's own metrics (model load and warm-up, batches, queue depth).
+
+    Returns:
+        dict: The worker's metrics snapshot, or None if inference runs in this process
+        or the worker can't be reached
+    """
+    if not use_inference_worker():
+        return None
+
+    try:
+        return _request({'op': 'metrics'}, timeout=2)['metrics']
+    except (InferenceUnavailableError, RuntimeError) as e:
+        logger.warning(f"Could not read inference worker metrics: {str(e)}")
+        return None
+
+
+def wait_for_model(timeout: float = None) -> bool:
+    """
+    Wait for the model to become ready, holding one of a bounded number of wait slots.
+
+    Args:
+        timeout (float): Maximum seconds to wait (defaults to MODEL_WAIT_TIMEOUT)
+
+    Returns:
+        bool: True if the model is ready, False if it isn't ready in time,
+        loading failed, or the wait queue is full
+    """
+    status = get_model_status()
+    if status['ready']:
+        return True
+
+    timeout = MODEL_WAIT_TIMEOUT if timeout is None else timeout
+    if timeout <= 0 or status['state'] == 'failed':
+        return False
+
+    if not model_wait_slots.acquire(blocking=False):
+        logger.warning("Model wait queue is full, rejecting request")
+        increment('model_wait_rejected')
+        return False
+
+    try:
+        increment('model_wait_queued')
+        if not use_inference_worker():
+            from utils.diagnosis_model import model_ready
+            return model_ready.wait(timeout)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(min(0.5, max(0.0, deadline - time.monotonic())))
+            status = get_model_status()
+            if status['ready']:
+                return True
+            if status['state'] == 'failed':
+                return False
+        return False
+    finally:
+        model_wait_slots.release()
+
+
+def _load_remote_labels():
+    """Fetch and cache the label list and model version from the inference worker."""
+    global _labels, _model_version
+
+    if _labels is None:
+        reply = _request({'op': 'labels'}, timeout=5)
+        _labels = reply['labels']
+        _model_version = reply['model_version']
+
+
+def get_labels() -> list:
+    """Return the model's labels in output order."""
+    if not use_inference_worker():
+        from utils.diagnosis_model import get_labels as get_local_labels
+        return get_local_labels()
+
+    _load_remote_labels()
+    return _labels
+
+
+def get_model_version() -> str:
+    """Return the model name and revision that produced the probabilities."""
+    if not use_inference_worker():
+        from utils.diagnosis_model import get_model_version as get_local_model_version
+        return get_local_model_version()
+
+    _load_remote_labels()
+    return _model_version
+
+
+def predict_probabilities(text: str, priority: str = 'interactive', timeout: float = None):
+    """
+    Get the label probability vector for a clinical text.
+
+    Args:
+        text (str): Clinical text (e.g. a SOAP note)
+        priority (str): 'interactive', 'background' or 'batch'
+        timeout (float): Seconds to wait for the worker (defaults to INFERENCE_TIMEOUT)
+
+    Returns:
+        numpy.ndarray: float32 vector of sigmoid probabilities, one per label
+
+    Raises:
+        InferenceBusyError: If the worker's queue is full
+        InferenceUnavailableError: If the worker can't be reached or the model isn't ready
+    """
+    if not use_inference_worker():
+        from utils.diagnosis_model import predict_probabilities as predict_local
+        timings = {}
+        probabilities = predict_local([text], timings)[0]
+    else:
+        reply = _request({
+            'op': 'predict',
+            'text': text,
+            'priority': priority
+        }, timeout=INFERENCE_TIMEOUT if timeout is None else timeout)
+        timings = reply.get('timings', {})
+        probabilities = reply['probabilities']
+
+    # Queue wait, tokenization and forward pass show up as separate stages
+    for name, duration_ms in timings.items():
+        record_stage(name, duration_ms)
+    return probabilities
+
+
+def predict_blood_pressure(windows: np.ndarray, valid_lengths: np.ndarray) -> dict:
+    """
+    Run prepared PPG windows through the PPG2ABP cascade, wherever it is served.
+
+    Args:
+        windows (np.ndarray): Shape (n, 1024), cleaned PPG at 125 Hz
+        valid_lengths (np.ndarray): Real (unpadded) samples per window
+
+    Returns:
+        dict: abp, sbp, dbp, map and windows_per_second (see BPEstimator.predict)
+
+    Raises:
+        BPModelUnavailableError: If the PPG2ABP model can't be loaded
+        InferenceUnavailableError: If the worker can't be reached
+    """
+    if not use_inference_worker():
+        from utils.ppg2abp.inference import get_estimator
+        return get_estimator().predict(windows, valid_lengths)
+
+    reply = _request({
+        'op': 'bp_predict',
+        'windows': np.asarray(windows, dtype=np.float32),
+        'valid_lengths': np.asarray(valid_lengths)
+    }, timeout=INFERENCE_TIMEOUT)
+    return reply['estimates']
+
+
+def add_stream_window(device_id: str, window: dict) -> int:
+    """
+    Feed a PPG IR window into its device's blood pressure stream. Streams live in one
+    process (the inference worker when there is one), so every window of a device
+    reaches the same buffer whichever web worker received it.
+
+    Args:
+        device_id (str): The device's device_id
+        window (dict): ir_values, sampling_rate and optionally timestamp and sqi
+
+    Returns:
+        int: Frames queued for estimation
+
+    Raises:
+        ValueError: If the window has no usable ir_values or sampling_rate
+        InferenceUnavailableError: If the worker can't be reached
+    """
+    if not use_inference_worker():
+        from utils.ppg2abp.stream_buffer import get_stream_registry
+        return get_stream_registry().add_window(device_id, window)
+
+    return _request({'op': 'stream_window', 'device_id': device_id, 'window': window}, timeout=2)['frames_queued']
+
+
+def get_stream_trend(device_id: str, limit: int = None):
+    """
+    Return a device's most recent streamed blood pressure estimates, oldest first,
+    or None if it has no active stream.
+
+    Raises:
+        InferenceUnavailableError: If the worker can't be reached
+    """
+    if not use_inference_worker():
+        from utils.ppg2abp.stream_buffer import get_stream_registry
+        return get_stream_registry().trend(device_id, limit)
+
+    return _request({'op': 'stream_trend', 'device_id': device_id, 'limit': limit}, timeout=2)['trend']
@@ -0,0 +1,308 @@
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from google import genai
+from google.genai import types
+from utils.metrics import increment, observe
+from utils import llm_transport
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms only get the per-process limit
+    fcntl = None
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+GEMINI_PROJECT = os.getenv('GEMINI_PROJECT', 'eon-health-450706')
+GEMINI_LOCATION = os.getenv('GEMINI_LOCATION', 'us-central1')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-001')
+
+# Concurrent LLM calls allowed in this process, and across all gunicorn workers on the host
+# (shared through lock files in LLM_LOCK_DIR; 0 disables the cross-worker limit)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '4'))
+LLM_GLOBAL_CONCURRENCY = int(os.getenv('LLM_GLOBAL_CONCURRENCY', '8'))
+LLM_LOCK_DIR = os.getenv('LLM_LOCK_DIR', '/tmp/eon-llm-slots')
+
+# Token bucket: sustained requests per second and burst size for this process
+LLM_RATE_PER_SECOND = float(os.getenv('LLM_RATE_PER_SECOND', '5'))
+LLM_BURST = int(os.getenv('LLM_BURST', '10'))
+
+# Seconds a call may wait for a concurrency slot or rate token before giving up
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+
+# Retries on quota (429) and overload (503) errors, with full-jitter exponential backoff
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '4'))
+LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_RETRY_MAX_DELAY = float(os.getenv('LLM_RETRY_MAX_DELAY', '8'))
+RETRYABLE_STATUS_CODES = (429, 503)
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
+    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF")
+]
+
+_client = None
+_client_lock = threading.Lock()
+_local_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+
+class LLMBusyError(Exception):
+    """Raised when no LLM slot or rate token frees up within LLM_QUEUE_TIMEOUT."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> bool:
+        """
+        Take one token, waiting for the bucket to refill if needed.
+
+        Args:
+            deadline (float): time.monotonic() value after which to give up
+
+        Returns:
+            bool: True if a token was taken, False if the deadline passed first
+        """
+        if self.rate <= 0:
+            return True
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_rate_limiter = TokenBucket(LLM_RATE_PER_SECOND, LLM_BURST)
+
+
+def get_client() -> genai.Client:
+    """Return the process-wide Gemini client, creating it on first use."""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(
+                    vertexai=True,
+                    project=GEMINI_PROJECT,
+                    location=GEMINI_LOCATION,
+                )
+    return _client
+
+
+def make_config(system_instruction: str, temperature: float, top_p: float = 0.95,
+                max_output_tokens: int = 8192) -> types.GenerateContentConfig:
+    """
+    Build a generation config with the shared safety settings. Callers build
+    theirs once at import time and reuse it for every call.
+
+    Args:
+        system_instruction (str): System prompt
+        temperature (float): Sampling temperature
+        top_p (float): Nucleus sampling parameter
+        max_output_tokens (int): Output token limit
+
+    Returns:
+        types.GenerateContentConfig: Reusable config
+    """
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        top_p=top_p,
+        max_output_tokens=max_output_tokens,
+        response_modalities=["TEXT"],
+        safety_settings=SAFETY_SETTINGS,
+        system_instruction=[types.Part.from_text(text=system_instruction)],
+    )
+
+
+def config_version(config: types.GenerateContentConfig, model: str = GEMINI_MODEL) -> str:
+    """
+    Short hash of everything that shapes a response besides the user prompt
+    (model, sampling parameters and system instruction). Used to version cached outputs.
+
+    Args:
+        config (types.GenerateContentConfig): Config built with make_config
+        model (str): Gemini model name
+
+    Returns:
+        str: 16-character hex digest
+    """
+    system_instruction = "".join(part.text or "" for part in config.system_instruction or [])
+    fingerprint = f"{model}\n{config.temperature}\n{config.top_p}\n{config.max_output_tokens}\n{system_instruction}"
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+
+
+def _acquire_global_slot(deadline: float):
+    """Lock one of LLM_GLOBAL_CONCURRENCY slot files shared by every worker on the host."""
+    if fcntl is None or LLM_GLOBAL_CONCURRENCY <= 0:
+        return None
+
+    os.makedirs(LLM_LOCK_DIR, exist_ok=True)
+    delay = 0.01
+    while True:
+        for slot in range(LLM_GLOBAL_CONCURRENCY):
+            fd = os.open(os.path.join(LLM_LOCK_DIR, f"slot-{slot}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                # The kernel drops the lock if this process dies, so slots can't leak
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMBusyError("All LLM slots are in use")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.25)
+
+
+def _release_global_slot(fd) -> None:
+    if fd is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+@contextmanager
+def _governed():
+    """Hold a per-process slot, a cross-worker slot and a rate token for one LLM call."""
+    start_time = time.monotonic()
+    deadline = start_time + LLM_QUEUE_TIMEOUT
+
+    if not _local_slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+        increment('llm_busy_rejected')
+        raise LLMBusyError("All LLM slots in this worker are in use")
+    try:
+        try:
+            global_slot = _acquire_global_slot(deadline)
+        except LLMBusyError:
+            increment('llm_busy_rejected')
+            raise
+        try:
+            if not _rate_limiter.acquire(deadline):
+                increment('llm_rate_limited')
+                raise LLMBusyError("LLM rate limit reached")
+
+            observe('llm.queue_wait', (time.monotonic() - start_time) * 1000)
+            increment('llm_calls')
+            yield
+        finally:
+            _release_global_slot(global_slot)
+    finally:
+        _local_slots.release()
+
+
+def _is_retryable(error: Exception) -> bool:
+    return getattr(error, 'code', None) in RETRYABLE_STATUS_CODES
+
+
+def _backoff(attempt: int, error: Exception) -> None:
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    increment('llm_retries')
+    logger.warning(f"LLM call failed with {getattr(error, 'code', None)}, retrying in {delay:.2f}s "
+                   f"(attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+    time.sleep(delay)
+
+
+def _contents(text: str) -> list:
+    return [types.Content(role="user", parts=[types.Part.from_text(text=text)])]
+
+
+def _transport_version(config: types.GenerateContentConfig, model: str):
+    # Only recorded/replayed calls are keyed by config version, so live calls skip the hashing
+    return None if llm_transport.LLM_MODE == 'live' else config_version(config, model)
+
+
+def generate_content(text: str, config: types.GenerateContentConfig, model: str = GEMINI_MODEL,
+                     name: str = 'default') -> str:
+    """
+    Generate a response, subject to the concurrency and rate limits.
+    Served by the transport selected with LLM_MODE (see utils.llm_transport).
+
+    Args:
+        text (str): User prompt
+        config (types.GenerateContentConfig): Config built with make_config
+        model (str): Gemini model name
+        name (str): Call name for metrics, recordings and simulated responses
+
+    Returns:
+        str: Response text
+
+    Raises:
+        LLMBusyError: If no slot or rate token is available within LLM_QUEUE_TIMEOUT
+    """
+    contents = _contents(text)
+    version = _transport_version(config, model)
+
+    def live_call():
+        return get_client().models.generate_content(model=model, contents=contents, config=config).text
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with _governed():
+                return llm_transport.complete(name, text, model, version, live_call)
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            _backoff(attempt, e)
+
+
+def generate_content_stream(text: str, config: types.GenerateContentConfig, model: str = GEMINI_MODEL,
+                            name: str = 'default'):
+    """
+    Stream a response, subject to the concurrency and rate limits. The slot is
+    held until the stream is exhausted; a call is only retried if it failed
+    before any text was produced.
+
+    Args:
+        text (str): User prompt
+        config (types.GenerateContentConfig): Config built with make_config
+        model (str): Gemini model name
+        name (str): Call name for metrics, recordings and simulated responses
+
+    Yields:
+        str: Response text chunks
+    """
+    contents = _contents(text)
+    version = _transport_version(config, model)
+
+    def live_stream():
+        for chunk in get_client().models.generate_content_stream(model=model, contents=contents, config=config):
+            if chunk.text:
+                yield chunk.text
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        yielded = False
+        try:
+            with _governed():
+                for chunk in llm_transport.stream(name, text, model, version, live_stream):
+                    if chunk:
+                        yielded = True
+                        yield chunk
+            return
+        except Exception as e:
+            if yielded or attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            _backoff(attempt, e)
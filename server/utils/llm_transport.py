@@ -0,0 +1,289 @@
+"""
+Pluggable transport under the LLM gateway, so the Gemini pipelines can be
+benchmarked without network access.
+
+LLM_MODE selects what happens when the gateway makes a call:
+    live      - call Vertex AI (default)
+    record    - call Vertex AI and save each response to LLM_RECORD_DIR, keyed by prompt hash
+    replay    - answer from LLM_RECORD_DIR only; a prompt that wasn't recorded is an error
+    simulate  - answer from LLM_RECORD_DIR when recorded, otherwise with a synthetic response
+
+Replayed and simulated calls still go through the gateway's concurrency and rate
+limits, and wait for a latency drawn from LLM_SIM_LATENCY:
+    recorded                 - the latency measured when the response was recorded (default)
+    none                     - no delay
+    fixed:MS                 - always MS milliseconds
+    uniform:LOW:HIGH         - uniform between LOW and HIGH milliseconds
+    normal:MEAN:SD           - normal, clipped at zero
+    lognormal:MEDIAN:SIGMA   - log-normal with the given median and shape
+"""
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+from utils.metrics import increment, observe
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+LLM_MODES = ('live', 'record', 'replay', 'simulate')
+LLM_MODE = os.getenv('LLM_MODE', 'live').lower()
+LLM_RECORD_DIR = os.getenv('LLM_RECORD_DIR', 'llm_recordings')
+LLM_SIM_LATENCY = os.getenv('LLM_SIM_LATENCY', 'recorded')
+
+# Replayed streams are cut into chunks of this many characters
+LLM_SIM_CHUNK_CHARS = int(os.getenv('LLM_SIM_CHUNK_CHARS', '64'))
+# Share of a replayed stream's latency spent before the first chunk
+FIRST_CHUNK_LATENCY_FRACTION = 0.3
+
+if LLM_MODE not in LLM_MODES:
+    raise ValueError(f"LLM_MODE must be one of {', '.join(LLM_MODES)}")
+
+
+class LLMReplayMissError(Exception):
+    """Raised in replay mode when a prompt has no recorded response."""
+
+
+def prompt_key(text: str, model: str, version: str) -> str:
+    """
+    Key of a recorded response: sha256 of the model, the config version and the prompt.
+
+    Args:
+        text (str): User prompt
+        model (str): Gemini model name
+        version (str): config_version of the generation config
+
+    Returns:
+        str: 64-character hex digest
+    """
+    return hashlib.sha256(f"{model}\n{version}\n{text}".encode()).hexdigest()
+
+
+def parse_latency_spec(spec: str):
+    """
+    Parse an LLM_SIM_LATENCY value into a sampler.
+
+    Args:
+        spec (str): Latency distribution (see module docstring)
+
+    Returns:
+        callable: sampler(recorded_ms) returning a latency in milliseconds
+
+    Raises:
+        ValueError: If the spec is malformed
+    """
+    kind, _, params = spec.strip().lower().partition(':')
+    try:
+        values = [float(value) for value in params.split(':')] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid LLM_SIM_LATENCY: {spec}")
+
+    if kind == 'recorded' and not values:
+        return lambda recorded_ms: recorded_ms or 0.0
+    if kind == 'none' and not values:
+        return lambda recorded_ms: 0.0
+    if kind == 'fixed' and len(values) == 1:
+        return lambda recorded_ms: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda recorded_ms: random.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda recorded_ms: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda recorded_ms: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Invalid LLM_SIM_LATENCY: {spec}")
+
+
+_sample_latency = parse_latency_spec(LLM_SIM_LATENCY)
+
+
+def _recording_path(key: str) -> str:
+    return os.path.join(LLM_RECORD_DIR, key[:2], f"{key}.json")
+
+
+def load_recording(key: str):
+    """Return a recorded response ({'response', 'latency_ms', ...}), or None if there is none."""
+    try:
+        with open(_recording_path(key)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_recording(key: str, name: str, text: str, model: str, version: str, response: str, latency_ms: float) -> None:
+    """Save a live response for later replay (written atomically, last write wins)."""
+    path = _recording_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({
+            'name': name,
+            'model': model,
+            'version': version,
+            'prompt': text,
+            'response': response,
+            'latency_ms': round(latency_ms, 1),
+            'recorded_at': datetime.now(timezone.utc).isoformat()
+        }, f, indent=2, ensure_ascii=False)
+    os.replace(temp_path, path)
+    increment('llm_recorded')
+
+
+# ICD-9 ranges (3-digit codes) for the clusters format_predictions may return
+SYNTHETIC_CLUSTER_RANGES = (
+    ('Sleep', 327, 327),
+    ('Metabolic', 240, 279),
+    ('Neurological', 320, 359),
+    ('Cardiovascular', 390, 459),
+    ('Respiratory', 460, 519),
+    ('Musculoskeletal', 710, 739)
+)
+
+
+def _synthetic_soap(text: str) -> str:
+    return (
+        "Subjective (S):\n- No subjective data provided\n\n"
+        f"Objective (O):\n{text}\n\n"
+        "Assessment (A):\n- Limited data available for assessment\n\n"
+        "Plan (P):\n- Continued monitoring of health metrics"
+    )
+
+
+def _synthetic_assessment(text: str) -> str:
+    return "- Limited data available for assessment"
+
+
+def _synthetic_clusters(text: str) -> str:
+    try:
+        predictions = json.loads(text).get('predictions') or []
+    except (ValueError, AttributeError):
+        predictions = []
+
+    clusters = {}
+    for prediction in predictions:
+        code = str(prediction.get('icd9_code', ''))
+        if not code[:3].isdigit():
+            continue
+        for cluster_name, low, high in SYNTHETIC_CLUSTER_RANGES:
+            if low <= int(code[:3]) <= high:
+                clusters.setdefault(cluster_name, []).append({
+                    'description': prediction.get('description'),
+                    'icd9_code': code
+                })
+                break
+
+    return json.dumps([{
+        'cluster_name': cluster_name,
+        'diseases': diseases,
+        'risk_level': 'Low Risk',
+        'explanation': 'Your metrics are normal. These conditions are listed for awareness and prevention.'
+    } for cluster_name, diseases in clusters.items()])
+
+
+def _synthetic_recommendations(text: str) -> str:
+    counts = dict(re.findall(r'(Sleep|Steps|Heart_Rate)=(\d+)', text))
+    cluster = re.search(r'^(\w+) \[', text, re.MULTILINE)
+    return json.dumps({
+        category: [{
+            'recommendation': f"Simulated {category.replace('_', ' ').lower()} recommendation {index + 1}",
+            'explanation': 'Synthetic response generated in LLM simulate mode.',
+            'frequency': 'Daily',
+            'risk_cluster': cluster.group(1) if cluster else 'General'
+        } for index in range(max(2, int(counts.get(category, 2))))]
+        for category in ('Sleep', 'Steps', 'Heart_Rate')
+    })
+
+
+# Synthetic responses by gateway call name, shaped like what each caller parses
+SYNTHESIZERS = {
+    'soap': _synthetic_soap,
+    'soap_assessment': _synthetic_assessment,
+    'format_predictions': _synthetic_clusters,
+    'recommendations': _synthetic_recommendations
+}
+
+
+def _offline_response(name: str, text: str, model: str, version: str):
+    """Return (response, recorded latency) from a recording, or a synthetic one in simulate mode."""
+    recording = load_recording(prompt_key(text, model, version))
+    if recording is not None:
+        increment('llm_replayed')
+        return recording['response'], recording.get('latency_ms')
+
+    if LLM_MODE == 'replay':
+        raise LLMReplayMissError(f"No recorded response for '{name}' prompt in {LLM_RECORD_DIR}")
+
+    increment('llm_simulated')
+    return SYNTHESIZERS.get(name, _synthetic_assessment)(text), None
+
+
+def complete(name: str, text: str, model: str, version: str, live_call) -> str:
+    """
+    Answer one prompt according to LLM_MODE.
+
+    Args:
+        name (str): Call name (e.g. 'soap'), used for synthetic responses and metrics
+        text (str): User prompt
+        model (str): Gemini model name
+        version (str): config_version of the generation config
+        live_call (callable): Makes the real call and returns the response text
+
+    Returns:
+        str: Response text
+    """
+    start_time = time.monotonic()
+    if LLM_MODE in ('live', 'record'):
+        response = live_call()
+        latency_ms = (time.monotonic() - start_time) * 1000
+        if LLM_MODE == 'record':
+            save_recording(prompt_key(text, model, version), name, text, model, version, response, latency_ms)
+    else:
+        response, recorded_ms = _offline_response(name, text, model, version)
+        time.sleep(_sample_latency(recorded_ms) / 1000)
+        latency_ms = (time.monotonic() - start_time) * 1000
+
+    observe(f"llm.{name}", latency_ms)
+    return response
+
+
+def stream(name: str, text: str, model: str, version: str, live_stream):
+    """
+    Streaming counterpart of complete(). Offline responses are cut into
+    LLM_SIM_CHUNK_CHARS chunks spread over the sampled latency.
+
+    Args:
+        name (str): Call name (e.g. 'soap'), used for synthetic responses and metrics
+        text (str): User prompt
+        model (str): Gemini model name
+        version (str): config_version of the generation config
+        live_stream (callable): Starts the real call and returns an iterator of text chunks
+
+    Yields:
+        str: Response text chunks
+    """
+    start_time = time.monotonic()
+    if LLM_MODE in ('live', 'record'):
+        chunks = []
+        for chunk in live_stream():
+            chunks.append(chunk)
+            yield chunk
+        latency_ms = (time.monotonic() - start_time) * 1000
+        if LLM_MODE == 'record':
+            save_recording(prompt_key(text, model, version), name, text, model, version, "".join(chunks), latency_ms)
+    else:
+        response, recorded_ms = _offline_response(name, text, model, version)
+        latency_s = _sample_latency(recorded_ms) / 1000
+        chunks = [response[i:i + LLM_SIM_CHUNK_CHARS] for i in range(0, len(response), LLM_SIM_CHUNK_CHARS)] or [""]
+        time.sleep(latency_s * FIRST_CHUNK_LATENCY_FRACTION)
+        for index, chunk in enumerate(chunks):
+            if index:
+                time.sleep(latency_s * (1 - FIRST_CHUNK_LATENCY_FRACTION) / (len(chunks) - 1))
+            yield chunk
+        latency_ms = (time.monotonic() - start_time) * 1000
+
+    observe(f"llm.{name}", latency_ms)
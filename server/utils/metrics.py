@@ -0,0 +1,122 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Process start time, used to report time-to-ready for startup work
+PROCESS_START_TIME = time.monotonic()
+
+# Histogram bucket upper bounds in milliseconds
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Recent observations kept per histogram for percentile estimates
+HISTOGRAM_SAMPLE_SIZE = 1024
+
+_lock = threading.Lock()
+_gauges = {}
+_counters = {}
+_histograms = {}
+
+
+def set_gauge(name: str, value: float) -> None:
+    """
+    Set a gauge to the given value, replacing any previous value.
+
+    Args:
+        name (str): Metric name
+        value (float): Value to record
+    """
+    with _lock:
+        _gauges[name] = float(value)
+
+
+def set_gauge_once(name: str, value: float) -> bool:
+    """
+    Set a gauge only if it has not been recorded yet (e.g. first-request latency).
+
+    Args:
+        name (str): Metric name
+        value (float): Value to record
+
+    Returns:
+        bool: True if the value was recorded, False if the gauge already existed
+    """
+    with _lock:
+        if name in _gauges:
+            return False
+        _gauges[name] = float(value)
+        return True
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """
+    Increment a counter.
+
+    Args:
+        name (str): Metric name
+        amount (int): Amount to add
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, value_ms: float) -> None:
+    """
+    Record a duration in a histogram.
+
+    Args:
+        name (str): Metric name
+        value_ms (float): Duration in milliseconds
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = {
+                'count': 0,
+                'sum': 0.0,
+                'buckets': [0] * (len(HISTOGRAM_BUCKETS_MS) + 1),
+                'samples': deque(maxlen=HISTOGRAM_SAMPLE_SIZE)
+            }
+            _histograms[name] = histogram
+        histogram['count'] += 1
+        histogram['sum'] += value_ms
+        histogram['buckets'][bisect_left(HISTOGRAM_BUCKETS_MS, value_ms)] += 1
+        histogram['samples'].append(value_ms)
+
+
+def percentile(sorted_samples: list, q: float) -> float:
+    """Nearest-rank percentile of already sorted samples (None if there are none)."""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(q / 100 * (len(sorted_samples) - 1))))
+    return round(sorted_samples[index], 3)
+
+
+def _summarize_histogram(histogram: dict) -> dict:
+    """Turn a histogram into counts per bucket and percentile estimates."""
+    samples = sorted(histogram['samples'])
+    bucket_labels = [f"le_{bound}" for bound in HISTOGRAM_BUCKETS_MS] + ['le_inf']
+    return {
+        'count': histogram['count'],
+        'sum_ms': round(histogram['sum'], 3),
+        'mean_ms': round(histogram['sum'] / histogram['count'], 3) if histogram['count'] else None,
+        'p50_ms': percentile(samples, 50),
+        'p95_ms': percentile(samples, 95),
+        'p99_ms': percentile(samples, 99),
+        'buckets': dict(zip(bucket_labels, histogram['buckets']))
+    }
+
+
+def get_metrics() -> dict:
+    """
+    Return a snapshot of all metrics recorded in this process.
+
+    Returns:
+        dict: Dictionary with gauges, counters and histogram summaries
+    """
+    with _lock:
+        return {
+            'uptime_seconds': round(time.monotonic() - PROCESS_START_TIME, 3),
+            'gauges': dict(_gauges),
+            'counters': dict(_counters),
+            'histograms': {name: _summarize_histogram(histogram) for name, histogram in _histograms.items()}
+        }
@@ -0,0 +1,242 @@
+"""
+	Chunked, resumable PPG2ABP inference over a whole dataset.
+
+	Input windows are read chunk by chunk from a memory-mapped .npy array or
+	sharded dataset (see dataset.py), and the approximation (level 1 only) and
+	refinement outputs are written straight into preallocated .npy memmaps, so
+	memory stays at one chunk per worker. Finished
+	chunks are recorded in a checkpoint; rerunning the same command resumes after
+	the last finished chunk. Chunks can be spread over a pool of processes, each
+	loading the networks once.
+
+	Run from this directory, e.g.:
+		python batch_inference.py --input data/test.p --output-dir outputs --workers 4
+
+	A .p input (pickle with X_test) is converted to a sharded dataset next to it
+	(data/test.p -> data/test) on the first run.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from dataset import ShardedDataset, convert_pickle, dataset_path, is_dataset
+
+logger = logging.getLogger(__name__)
+
+length = 1024               # length of signal
+
+APPROXIMATE_OUTPUT = 'test_output_approximate.npy'
+REFINED_OUTPUT = 'test_output.npy'
+CHECKPOINT_FILE = 'checkpoint.json'
+
+# Set in each worker process by _init_worker
+_worker = {}
+
+
+def chunk_bounds(records, chunk_size):
+	"""
+		Returns the (start, stop) record range of every chunk
+	"""
+
+	return [(start, min(start + chunk_size, records)) for start in range(0, records, chunk_size)]
+
+
+def load_checkpoint(output_dir):
+	"""
+		Returns the saved checkpoint, or None if there is none
+	"""
+
+	try:
+		with open(os.path.join(output_dir, CHECKPOINT_FILE)) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return None
+
+
+def save_checkpoint(output_dir, checkpoint):
+	"""
+		Saves the checkpoint atomically, so a crash never leaves it half-written
+	"""
+
+	path = os.path.join(output_dir, CHECKPOINT_FILE)
+	temp_path = f"{path}.tmp"
+	with open(temp_path, 'w') as f:
+		json.dump(checkpoint, f, indent=2)
+	os.replace(temp_path, path)
+
+
+def resolve_input(input_path):
+	"""
+		Returns the .npy or dataset directory to read windows from, converting a
+		pickle (e.g. data/test.p) to a sharded dataset next to it on first use
+	"""
+
+	if input_path.endswith('.npy') or is_dataset(input_path):
+		return input_path
+
+	sharded_path = dataset_path(input_path)
+	if not is_dataset(sharded_path):
+		meta_path = os.path.join(os.path.dirname(input_path), 'meta9.p')
+		logger.info(f"Converting {input_path} to {sharded_path}")
+		convert_pickle(input_path, sharded_path, meta_path if os.path.exists(meta_path) else None)
+	return sharded_path
+
+
+def open_input(input_path):
+	"""
+		Memory-maps the input windows (a .npy array or a dataset's X_test)
+	"""
+
+	if input_path.endswith('.npy'):
+		return np.load(input_path, mmap_mode='r')
+	return ShardedDataset(input_path)['X_test']
+
+
+def outputs_resumable(output_dir, records):
+	"""
+		Returns True if both output memmaps exist with the expected shape
+	"""
+
+	for name in (APPROXIMATE_OUTPUT, REFINED_OUTPUT):
+		path = os.path.join(output_dir, name)
+		if not os.path.exists(path):
+			logger.warning(f"{path} is missing")
+			return False
+		output = np.load(path, mmap_mode='r')
+		if output.shape != (records, length, 1):
+			logger.warning(f"{path} has shape {output.shape}, expected {(records, length, 1)}")
+			return False
+	return True
+
+
+def create_outputs(output_dir, records):
+	"""
+		Preallocates the output memmaps
+	"""
+
+	for name in (APPROXIMATE_OUTPUT, REFINED_OUTPUT):
+		path = os.path.join(output_dir, name)
+		np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(records, length, 1)).flush()
+
+
+def _init_worker(input_path, output_dir, model_dir, batch_size):
+	"""
+		Loads both networks and opens the memmaps once per process
+	"""
+
+	from models import UNetDS64, MultiResUNet1D     # imported here so the parent process never loads Keras
+
+	mdl1 = UNetDS64(length)                                                 # creating approximation network
+	mdl1.load_weights(os.path.join(model_dir, 'ApproximateNetwork.h5'))     # loading weights
+	mdl2 = MultiResUNet1D(length)                                           # creating refinement network
+	mdl2.load_weights(os.path.join(model_dir, 'RefinementNetwork.h5'))      # loading weights
+
+	_worker.update({
+		'mdl1': mdl1,
+		'mdl2': mdl2,
+		'batch_size': batch_size,
+		'X': open_input(input_path),
+		'approximate': np.load(os.path.join(output_dir, APPROXIMATE_OUTPUT), mmap_mode='r+'),
+		'refined': np.load(os.path.join(output_dir, REFINED_OUTPUT), mmap_mode='r+')
+	})
+
+
+def _run_chunk(bounds):
+	"""
+		Runs both networks on one chunk and writes the outputs in place
+	"""
+
+	start, stop = bounds
+	X = np.asarray(_worker['X'][start:stop], dtype=np.float32).reshape(-1, length, 1)
+
+	# only the full resolution output of the deeply supervised network is kept
+	approximate = _worker['mdl1'].predict(X, batch_size=_worker['batch_size'])[0]
+	_worker['approximate'][start:stop] = approximate
+	_worker['approximate'].flush()
+
+	_worker['refined'][start:stop] = _worker['mdl2'].predict(approximate, batch_size=_worker['batch_size'])
+	_worker['refined'].flush()
+	return bounds
+
+
+def run_batch_inference(input_path, output_dir, model_dir='models', chunk_size=1024, batch_size=256, workers=1):
+	"""
+		Runs the PPG2ABP cascade over every window of input_path, resuming from
+		the checkpoint in output_dir if there is one
+
+		Returns the number of chunks computed in this run
+	"""
+
+	os.makedirs(output_dir, exist_ok=True)
+	input_path = resolve_input(input_path)
+	records = len(open_input(input_path))
+
+	checkpoint = load_checkpoint(output_dir)
+	resume = checkpoint is not None and checkpoint['input'] == os.path.abspath(input_path) \
+		and checkpoint['records'] == records and checkpoint['chunk_size'] == chunk_size
+	if checkpoint is not None and not resume:
+		logger.warning("Checkpoint does not match this input or chunk size, starting over")
+	elif resume and not outputs_resumable(output_dir, records):
+		logger.warning("Checkpoint found but its outputs can't be reused, starting over")
+		resume = False
+	if not resume:
+		checkpoint = {
+			'input': os.path.abspath(input_path),
+			'records': records,
+			'chunk_size': chunk_size,
+			'completed_chunks': []
+		}
+		create_outputs(output_dir, records)
+
+	completed = set(checkpoint['completed_chunks'])
+	pending = [bounds for index, bounds in enumerate(chunk_bounds(records, chunk_size)) if index not in completed]
+	logger.info(f"{len(completed)} chunks already done, {len(pending)} to go ({records} records)")
+	if not pending:
+		return 0
+
+	def record_done(bounds):
+		completed.add(bounds[0] // chunk_size)
+		checkpoint['completed_chunks'] = sorted(completed)
+		save_checkpoint(output_dir, checkpoint)
+
+	start_time = time.monotonic()
+	init_args = (input_path, output_dir, model_dir, batch_size)
+	if workers > 1:
+		# spawn, as TensorFlow doesn't survive a fork after it has been initialized
+		context = multiprocessing.get_context('spawn')
+		with context.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+			for bounds in pool.imap_unordered(_run_chunk, pending):
+				record_done(bounds)
+	else:
+		_init_worker(*init_args)
+		for bounds in pending:
+			record_done(_run_chunk(bounds))
+
+	elapsed = time.monotonic() - start_time
+	computed = sum(stop - start for start, stop in pending)
+	logger.info(f"Computed {computed} windows in {elapsed:.1f}s ({computed / elapsed:.1f} windows/s)")
+	return len(pending)
+
+
+def main():
+	logging.basicConfig(level=logging.INFO)
+	parser = argparse.ArgumentParser(description="Run PPG2ABP over a dataset in resumable chunks")
+	parser.add_argument('--input', default=os.path.join('data', 'test.p'), help="X_test as .npy, a sharded dataset directory, or a pickle with X_test")
+	parser.add_argument('--output-dir', default='.', help="Where the output memmaps and checkpoint are written")
+	parser.add_argument('--model-dir', default='models', help="Directory with ApproximateNetwork.h5 and RefinementNetwork.h5")
+	parser.add_argument('--chunk-size', type=int, default=1024, help="Windows per chunk (the unit of checkpointing)")
+	parser.add_argument('--batch-size', type=int, default=256, help="Windows per forward pass")
+	parser.add_argument('--workers', type=int, default=1, help="Processes to spread chunks over")
+	args = parser.parse_args()
+
+	run_batch_inference(args.input, args.output_dir, args.model_dir, args.chunk_size, args.batch_size, args.workers)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,169 @@
+"""
+    Vectorized beat segmentation of predicted ABP waveforms.
+
+    Systolic peaks are found in a whole batch at once (a sliding maximum over the
+    shortest plausible beat), and each beat, from one systolic peak to the next, is
+    reduced to a compact record: SBP at the peak, DBP as the minimum before the next
+    peak, MAP as the mean over the beat, HR from the peak-to-peak interval and a
+    confidence from how regular the beat is and the window's signal quality. These
+    records replace the 1024-sample waveforms for storage and history reads.
+"""
+
+import numpy as np
+
+from utils.ppg2abp.preprocessing import SAMPLING_RATE, WINDOW_LENGTH
+
+# Plausible beat lengths (200 to 30 bpm) and the smallest pulse pressure counted as a beat
+MIN_BEAT_SECONDS = 0.3
+MAX_BEAT_SECONDS = 2.0
+MIN_PULSE_PRESSURE = 10.0
+
+# Peaks must rise above this fraction of their window's pressure range
+PEAK_HEIGHT = 0.5
+
+
+def _rolling_max(batch: np.ndarray, width: int) -> np.ndarray:
+    """Maximum of every width-sample run of each row (shape (n, m - width + 1)), via a sparse table."""
+    span, table = 1, batch
+    while span * 2 <= width:
+        table = np.maximum(table[:, :-span], table[:, span:])
+        span *= 2
+    return np.maximum(table[:, :batch.shape[1] - width + 1], table[:, width - span:])
+
+
+def detect_peaks(abp: np.ndarray, valid_lengths: np.ndarray, sampling_rate: float = SAMPLING_RATE) -> np.ndarray:
+    """
+    Find the systolic peaks of every waveform: samples that are the maximum of the
+    MIN_BEAT_SECONDS around them and lie in the upper part of their window's range.
+    Peaks too close to either end of the valid samples to confirm are ignored.
+
+    Args:
+        abp (np.ndarray): Shape (n, m) waveforms in mmHg
+        valid_lengths (np.ndarray): Real (unpadded) samples per waveform
+        sampling_rate (float): Sampling rate in Hz
+
+    Returns:
+        np.ndarray: Boolean mask of shape (n, m)
+    """
+    radius = max(1, int(round(MIN_BEAT_SECONDS * sampling_rate / 2)))
+    columns = np.arange(abp.shape[1])[None, :]
+    valid = columns < np.asarray(valid_lengths)[:, None]
+
+    masked = np.where(valid, abp, -np.inf)
+    padded = np.pad(masked, ((0, 0), (radius, radius)), constant_values=-np.inf)
+    neighbourhood_max = _rolling_max(padded, 2 * radius + 1)
+
+    low = np.where(valid, abp, np.inf).min(axis=1, keepdims=True)
+    high = masked.max(axis=1, keepdims=True)
+    # Rising into the sample keeps only the first of a flat top
+    rising = np.concatenate([np.zeros((len(abp), 1), dtype=bool), masked[:, 1:] > masked[:, :-1]], axis=1)
+    confirmed = (columns >= radius) & (columns < np.asarray(valid_lengths)[:, None] - radius)
+    return (masked == neighbourhood_max) & rising & confirmed & (masked >= low + PEAK_HEIGHT * (high - low))
+
+
+def extract_beats(abp: np.ndarray, valid_lengths: np.ndarray = None, sampling_rate: float = SAMPLING_RATE,
+                  sqi: np.ndarray = None) -> dict:
+    """
+    Cut every waveform into beats (systolic peak to systolic peak) and reduce each one
+    to its pressures and heart rate. Beats of implausible length or pulse pressure are dropped.
+
+    Args:
+        abp (np.ndarray): Shape (n, m) waveforms in mmHg
+        valid_lengths (np.ndarray): Real (unpadded) samples per waveform (defaults to all)
+        sampling_rate (float): Sampling rate in Hz
+        sqi (np.ndarray): Signal quality (0 to 1) per waveform, folded into the confidence
+
+    Returns:
+        dict: Per beat: row (waveform index), sample (systolic peak), sbp, dbp, map (mmHg),
+        hr (bpm) and confidence (0 to 1)
+    """
+    abp = np.asarray(abp, dtype=np.float64)
+    if valid_lengths is None:
+        valid_lengths = np.full(len(abp), abp.shape[1])
+    rows, peaks = np.nonzero(detect_peaks(abp, valid_lengths, sampling_rate))
+
+    # Consecutive peaks of the same waveform bound one beat
+    pairs = np.flatnonzero(rows[:-1] == rows[1:])
+    rows, starts, ends = rows[pairs], peaks[pairs], peaks[pairs + 1]
+    if len(rows) == 0:
+        return {key: np.empty(0) for key in ('row', 'sample', 'sbp', 'dbp', 'map', 'hr', 'confidence')}
+
+    flat = abp.ravel()
+    bounds = np.column_stack([rows * abp.shape[1] + starts, rows * abp.shape[1] + ends]).ravel()
+    dbp = np.minimum.reduceat(flat, bounds)[::2]
+    cumulative = np.concatenate([np.zeros((len(abp), 1)), np.cumsum(abp, axis=1)], axis=1)
+    intervals = ends - starts
+    mean_pressure = (cumulative[rows, ends] - cumulative[rows, starts]) / intervals
+    sbp = abp[rows, starts]
+
+    seconds = intervals / float(sampling_rate)
+    plausible = (seconds >= MIN_BEAT_SECONDS) & (seconds <= MAX_BEAT_SECONDS) & (sbp - dbp >= MIN_PULSE_PRESSURE)
+    rows, starts, intervals, sbp, dbp, mean_pressure = (
+        values[plausible] for values in (rows, starts, intervals, sbp, dbp, mean_pressure)
+    )
+
+    # Regularity: how close each beat is to its waveform's mean beat length
+    counts = np.bincount(rows, minlength=len(abp))
+    mean_interval = np.bincount(rows, weights=intervals, minlength=len(abp))[rows] / counts[rows]
+    confidence = np.exp(-np.abs(intervals - mean_interval) / mean_interval)
+    if sqi is not None:
+        confidence = confidence * np.clip(np.asarray(sqi, dtype=np.float64), 0, 1)[rows]
+
+    return {
+        'row': rows,
+        'sample': starts,
+        'sbp': sbp,
+        'dbp': dbp,
+        'map': mean_pressure,
+        'hr': 60.0 * sampling_rate / intervals,
+        'confidence': confidence
+    }
+
+
+def owned_ranges(offsets: np.ndarray, owners: np.ndarray, window_length: int = WINDOW_LENGTH):
+    """
+    Split each source window among its overlapping segments at the middle of every overlap,
+    so a beat seen by two segments is kept once.
+
+    Args:
+        offsets (np.ndarray): Start sample of each segment in its source window
+        owners (np.ndarray): Source window of each segment, with a window's segments adjacent
+
+    Returns:
+        tuple: (first, last) source sample owned by each segment, last exclusive
+    """
+    offsets = np.asarray(offsets, dtype=np.float64)
+    boundaries = (offsets[1:] + offsets[:-1] + window_length) / 2
+    shared = owners[1:] == owners[:-1]
+    first = np.concatenate([[-np.inf], np.where(shared, boundaries, -np.inf)])
+    last = np.concatenate([np.where(shared, boundaries, np.inf), [np.inf]])
+    return first, last
+
+
+def summarize_segments(abp: np.ndarray, valid_lengths: np.ndarray, offsets: np.ndarray, owners: np.ndarray,
+                       sqi: np.ndarray = None) -> dict:
+    """
+    Extract the beats of model segments cut from longer source windows, each beat once,
+    positioned in its source window.
+
+    Args:
+        abp (np.ndarray): Shape (k, 1024) estimated waveforms in mmHg
+        valid_lengths (np.ndarray): Real (unpadded) samples per segment
+        offsets (np.ndarray): Start sample of each segment in its source window (at 125 Hz)
+        owners (np.ndarray): Source window of each segment
+        sqi (np.ndarray): Signal quality per segment
+
+    Returns:
+        dict: As extract_beats, with window (source window index) and seconds (time of
+        the systolic peak from the start of its source window) instead of row and sample
+    """
+    beats = extract_beats(abp, valid_lengths, SAMPLING_RATE, sqi)
+    rows = beats.pop('row').astype(np.int64)
+    position = np.asarray(offsets)[rows] + beats.pop('sample')
+    first, last = owned_ranges(offsets, np.asarray(owners))
+    keep = (position >= first[rows]) & (position < last[rows])
+
+    summary = {key: values[keep] for key, values in beats.items()}
+    summary['window'] = np.asarray(owners)[rows[keep]]
+    summary['seconds'] = position[keep] / float(SAMPLING_RATE)
+    return summary
@@ -0,0 +1,98 @@
+"""
+	Streaming training data for the two-stage PPG2ABP training.
+
+	PPG2ABPSequence feeds Keras batches straight from memory-mapped arrays (a .npy
+	memmap or a sharded dataset from dataset.py), so splits larger than RAM can be
+	trained on. The deep supervision labels are pooled per batch with a reshape-mean,
+	and for the refinement stage the approximation network's output is computed on
+	the fly per batch instead of for the whole split up front.
+
+	Use with fit_generator, which prefetches batches on worker threads, e.g.:
+
+		train = PPG2ABPSequence(dataset['X_train'], dataset['Y_train'], batch_size=256)
+		mdl1.fit_generator(train, epochs=100, workers=4, max_queue_size=16)
+
+		train2 = PPG2ABPSequence(dataset['X_train'], dataset['Y_train'], batch_size=192,
+								 stage1_model=mdl1, deep_supervision=False)
+		mdl2.fit_generator(train2, epochs=100, workers=2, max_queue_size=16)
+"""
+
+import math
+
+import numpy as np
+from keras.utils import Sequence
+
+length = 1024               # length of signal
+LEVELS = 4                  # deep supervision levels below the full resolution output
+
+
+def pool_labels(Y, levels=LEVELS):
+	"""
+		Computes the ground truth of every deep supervision output: level k is the
+		signal mean-pooled over windows of 2**k samples
+
+		Arguments:
+			Y {array} -- ABP waveforms, shape (n, length) or (n, length, 1)
+
+		Returns:
+			dictionary -- 'out' and 'level1'..'level<levels>', each of shape (n, length // 2**k, 1)
+	"""
+
+	Y = np.asarray(Y, dtype=np.float32).reshape(-1, length)
+	labels = {'out': Y.reshape(-1, length, 1)}
+	for level in range(1, levels + 1):
+		window = 2 ** level
+		labels['level{}'.format(level)] = Y.reshape(-1, length // window, window).mean(axis=2)[..., np.newaxis]
+	return labels
+
+
+class PPG2ABPSequence(Sequence):
+	"""
+		Keras Sequence over memory-mapped PPG (X) and ABP (Y) records
+
+		Batches are contiguous runs of records, read with one slice each, and their
+		order is shuffled every epoch. With stage1_model, the inputs are the
+		approximation network's output for the batch (for training the refinement
+		network); keep use_multiprocessing off then, as the model lives in this process.
+	"""
+
+	def __init__(self, X, Y, batch_size=256, shuffle=True, deep_supervision=True, stage1_model=None, seed=None):
+		if len(X) != len(Y):
+			raise ValueError("X has {} records but Y has {}".format(len(X), len(Y)))
+		self.X = X
+		self.Y = Y
+		self.batch_size = batch_size
+		self.shuffle = shuffle
+		self.deep_supervision = deep_supervision
+		self.stage1_model = stage1_model
+		self.random = np.random.RandomState(seed)
+		self.order = np.arange(len(self))
+
+		self.graph = None
+		if stage1_model is not None:
+			# TensorFlow 1 graphs are per thread, and fit_generator calls this from worker threads
+			import tensorflow as tf
+			self.graph = tf.get_default_graph()
+
+		self.on_epoch_end()
+
+	def __len__(self):
+		return int(math.ceil(len(self.X) / float(self.batch_size)))
+
+	def __getitem__(self, index):
+		start = self.order[index] * self.batch_size
+		stop = min(start + self.batch_size, len(self.X))
+
+		X = np.asarray(self.X[start:stop], dtype=np.float32).reshape(-1, length, 1)
+		if self.stage1_model is not None:
+			with self.graph.as_default():
+				X = self.stage1_model.predict_on_batch(X)[0]        # full resolution output of the approximation network
+
+		Y = self.Y[start:stop]
+		if self.deep_supervision:
+			return X, pool_labels(Y)
+		return X, np.asarray(Y, dtype=np.float32).reshape(-1, length, 1)
+
+	def on_epoch_end(self):
+		if self.shuffle:
+			self.random.shuffle(self.order)
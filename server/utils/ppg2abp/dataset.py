@@ -0,0 +1,285 @@
+"""
+	Sharded, memory-mappable on-disk format for the PPG2ABP datasets.
+
+	A dataset is a directory holding one set of .npy shards per array (X_test,
+	Y_test, ...) and a manifest.json with the record count, shard size, array
+	shapes and the normalization metadata otherwise kept in meta9.p:
+
+		data/test/
+			manifest.json
+			X_test-00000.npy, X_test-00001.npy, ...
+			Y_test-00000.npy, Y_test-00001.npy, ...
+
+	Opening a dataset only reads the manifest; shards are memory-mapped on first
+	access, slices within a shard are zero-copy views, and any record can be read
+	by index without loading the rest.
+
+	Convert the pickles once, from this directory:
+		python dataset.py --input data/test.p --meta data/meta9.p --output data/test
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+META_KEYS = ('max_ppg', 'min_ppg', 'max_abp', 'min_abp')
+
+
+def shard_name(array_name, shard_index):
+	return f"{array_name}-{shard_index:05d}.npy"
+
+
+def convert_pickle(pickle_path, output_dir, meta_path=None, shard_size=4096):
+	"""
+		Converts a pickled dataset (a dict of equally long arrays, e.g. test.p)
+		and its meta9.p into a sharded dataset in output_dir
+
+		Returns the manifest
+	"""
+
+	with open(pickle_path, 'rb') as f:
+		data = pickle.load(f)
+	meta = {}
+	if meta_path:
+		with open(meta_path, 'rb') as f:
+			meta = {key: float(value) for key, value in pickle.load(f).items() if key in META_KEYS}
+
+	arrays = {name: np.asarray(values) for name, values in data.items()}
+	records = {len(values) for values in arrays.values()}
+	if len(records) != 1:
+		raise ValueError(f"Arrays in {pickle_path} have different lengths: {sorted(records)}")
+	records = records.pop()
+
+	os.makedirs(output_dir, exist_ok=True)
+	manifest = {
+		'format_version': FORMAT_VERSION,
+		'records': records,
+		'shard_size': shard_size,
+		'arrays': {},
+		'meta': meta
+	}
+	for name, values in arrays.items():
+		shards = []
+		for shard_index, start in enumerate(range(0, records, shard_size)):
+			shards.append(shard_name(name, shard_index))
+			np.save(os.path.join(output_dir, shards[-1]), values[start:start + shard_size])
+		manifest['arrays'][name] = {'dtype': values.dtype.str, 'shape': list(values.shape[1:]), 'shards': shards}
+
+	# written last, so a directory with a manifest is always complete
+	with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+		json.dump(manifest, f, indent=2)
+	logger.info(f"Wrote {records} records of {', '.join(arrays)} to {output_dir}")
+	return manifest
+
+
+class ShardedArray(NDArrayOperatorsMixin):
+	"""
+		Read-only array backed by memory-mapped shards
+
+		Indexing with an int or a slice inside one shard returns a view of the
+		memmap; slices across shards and index arrays gather into a new array.
+		Arithmetic and numpy functions see the whole array.
+	"""
+
+	def __init__(self, directory, shards, shard_size, records, shape, dtype):
+		self.directory = directory
+		self.shard_files = shards
+		self.shard_size = shard_size
+		self.shape = (records,) + tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self._shards = [None] * len(shards)
+
+	def __len__(self):
+		return self.shape[0]
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	def shard(self, shard_index):
+		"""
+			Returns one shard, memory-mapping it on first use
+		"""
+
+		if self._shards[shard_index] is None:
+			self._shards[shard_index] = np.load(
+				os.path.join(self.directory, self.shard_files[shard_index]), mmap_mode='r')
+		return self._shards[shard_index]
+
+	def _take(self, indices):
+		indices = np.asarray(indices)
+		if indices.dtype == bool:
+			indices = np.flatnonzero(indices)
+		indices = np.where(indices < 0, indices + len(self), indices)
+		if np.any((indices < 0) | (indices >= len(self))):
+			raise IndexError("record index out of range")
+
+		output = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+		shard_indices = indices // self.shard_size
+		for shard_index in np.unique(shard_indices):
+			selected = shard_indices == shard_index
+			output[selected] = self.shard(shard_index)[indices[selected] % self.shard_size]
+		return output
+
+	def __getitem__(self, key):
+		if isinstance(key, tuple):
+			if not key:
+				return self[:]
+			records = self[key[0]]
+			rest = key[1:]
+			if isinstance(key[0], (int, np.integer)):
+				return records[rest]
+			return records[(slice(None),) + rest]
+
+		if isinstance(key, (int, np.integer)):
+			index = int(key) + len(self) if key < 0 else int(key)
+			if not 0 <= index < len(self):
+				raise IndexError("record index out of range")
+			return self.shard(index // self.shard_size)[index % self.shard_size]
+
+		if isinstance(key, slice):
+			start, stop, step = key.indices(len(self))
+			if step == 1 and stop > start and start // self.shard_size == (stop - 1) // self.shard_size:
+				offset = (start // self.shard_size) * self.shard_size
+				return self.shard(start // self.shard_size)[start - offset:stop - offset]
+			if step == 1 and stop <= start:
+				return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+			if step == 1:
+				first, last = start // self.shard_size, (stop - 1) // self.shard_size
+				return np.concatenate([
+					self.shard(shard_index)[
+						max(start - shard_index * self.shard_size, 0):min(stop - shard_index * self.shard_size, self.shard_size)
+					] for shard_index in range(first, last + 1)
+				])
+			return self._take(np.arange(start, stop, step))
+
+		return self._take(key)
+
+	def __iter__(self):
+		for shard_index in range(len(self.shard_files)):
+			for record in self.shard(shard_index):
+				yield record
+
+	def __array__(self, dtype=None, copy=None):
+		if not self.shard_files:
+			# An empty dataset has no shards to concatenate
+			array = np.empty(self.shape, dtype=self.dtype)
+		else:
+			array = np.concatenate([self.shard(shard_index) for shard_index in range(len(self.shard_files))])
+		return array.astype(dtype, copy=False) if dtype is not None else array
+
+	def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+		inputs = tuple(np.asarray(value) if isinstance(value, ShardedArray) else value for value in inputs)
+		return getattr(ufunc, method)(*inputs, **kwargs)
+
+
+class ShardedDataset:
+	"""
+		A sharded dataset opened from its manifest; dataset['X_test'] returns a ShardedArray
+	"""
+
+	def __init__(self, directory):
+		self.directory = directory
+		with open(os.path.join(directory, MANIFEST_FILE)) as f:
+			self.manifest = json.load(f)
+		if self.manifest.get('format_version') != FORMAT_VERSION:
+			raise ValueError(f"Unsupported dataset format version {self.manifest.get('format_version')} in {directory}")
+		self.records = self.manifest['records']
+		self.meta = self.manifest.get('meta', {})
+		self._arrays = {}
+
+	def keys(self):
+		return self.manifest['arrays'].keys()
+
+	def __contains__(self, name):
+		return name in self.manifest['arrays']
+
+	def __len__(self):
+		return self.records
+
+	def __getitem__(self, name):
+		if name not in self._arrays:
+			spec = self.manifest['arrays'][name]
+			self._arrays[name] = ShardedArray(
+				self.directory, spec['shards'], self.manifest['shard_size'], self.records, spec['shape'], spec['dtype']
+			)
+		return self._arrays[name]
+
+	def record(self, index):
+		"""
+			Returns every array's value at one record index
+		"""
+
+		return {name: self[name][index] for name in self.keys()}
+
+
+def is_dataset(path):
+	return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def dataset_path(pickle_path):
+	"""
+		Returns where the sharded version of a pickled dataset lives (data/test.p -> data/test)
+	"""
+
+	return os.path.splitext(pickle_path)[0]
+
+
+def load_test_data(path=os.path.join('data', 'test')):
+	"""
+		Opens the test set: the sharded dataset if it has been converted, otherwise the
+		pickle (data/test.p), which is loaded completely
+	"""
+
+	if is_dataset(path):
+		return ShardedDataset(path)
+	pickle_path = path if path.endswith('.p') else path + '.p'
+	if is_dataset(dataset_path(pickle_path)):
+		return ShardedDataset(dataset_path(pickle_path))
+	logger.warning(f"Loading {pickle_path}; convert it with dataset.py for memory-mapped access")
+	with open(pickle_path, 'rb') as f:
+		return pickle.load(f)
+
+
+def load_meta(path=os.path.join('data', 'test')):
+	"""
+		Returns the normalization metadata (max_ppg, min_ppg, max_abp, min_abp) from a
+		dataset manifest (its directory or manifest.json), or from a meta9.p pickle
+	"""
+
+	if os.path.basename(path) == MANIFEST_FILE:
+		path = os.path.dirname(path)
+	if is_dataset(path):
+		meta = ShardedDataset(path).meta
+		if all(key in meta for key in META_KEYS):
+			return meta
+	if not os.path.isfile(path):
+		# a dataset without metadata (or not converted yet) uses the meta9.p next to it
+		path = os.path.join(os.path.dirname(path.rstrip(os.sep)) or '.', 'meta9.p')
+	with open(path, 'rb') as f:
+		return pickle.load(f)
+
+
+def main():
+	logging.basicConfig(level=logging.INFO)
+	parser = argparse.ArgumentParser(description="Convert a pickled PPG2ABP dataset into memory-mappable shards")
+	parser.add_argument('--input', default=os.path.join('data', 'test.p'), help="Pickled dict of arrays, e.g. data/test.p")
+	parser.add_argument('--meta', default=os.path.join('data', 'meta9.p'), help="Pickled normalization metadata")
+	parser.add_argument('--output', help="Dataset directory (default: the input path without .p)")
+	parser.add_argument('--shard-size', type=int, default=4096, help="Records per shard")
+	args = parser.parse_args()
+
+	convert_pickle(args.input, args.output or dataset_path(args.input), args.meta, args.shard_size)
+
+
+if __name__ == '__main__':
+	main()
@@ -10,11 +10,23 @@ import scipy.stats
 import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
 import seaborn as sns
+from dataset import load_test_data, load_meta
+from evaluation import CLASSES, get_evaluation
 sns.set()
 
 
+def load_output(name):
+	"""
+		Loads precomputed network outputs, memory-mapped from the .npy written by
+		batch_inference.py if present, otherwise from the pickle written by predict_test.py
+	"""
+
+	if os.path.exists(name + '.npy'):
+		return np.load(name + '.npy', mmap_mode='r')
+	return pickle.load(open(name + '.p', 'rb'))
+
+
 def predicting_ABP_waveform():
 	"""
 		An interactive way to predict the ABP waveform from PPG signal
@@ -23,20 +35,21 @@ def predicting_ABP_waveform():
 		are presented, and a comparison is also demonstrated
 	"""
 
-	dt = pickle.load(open(os.path.join('data', 'test.p'), 'rb'))			# loading test data
+	dt = load_test_data()			# loading test data
 	X_test = dt['X_test']
 	Y_test = dt['Y_test']
 
-	dt = pickle.load(open(os.path.join('data', 'meta9.p'), 'rb'))			# loading metadata
+	dt = load_meta()			# loading metadata
 	max_ppg = dt['max_ppg']
 	min_ppg = dt['min_ppg']
 	max_abp = dt['max_abp']
 	min_abp = dt['min_abp']
 
-	Y_test_pred_approximate = pickle.load(open('test_output_approximate.p', 'rb'))	# loading precomputed output from approximation network
-	Y_test_pred_approximate = Y_test_pred_approximate[0]		# taking the actual output, the rest are intermediate ones
+	Y_test_pred_approximate = load_output('test_output_approximate')	# loading precomputed output from approximation network
+	if isinstance(Y_test_pred_approximate, list):
+		Y_test_pred_approximate = Y_test_pred_approximate[0]		# taking the actual output, the rest are intermediate ones
 
-	Y_test_pred = pickle.load(open('test_output.p', 'rb'))	# loading precomputed output from refinement network
+	Y_test_pred = load_output('test_output')	# loading precomputed output from refinement network
 
 	while(True):			# interactive cli
 
@@ -51,10 +64,10 @@ def predicting_ABP_waveform():
 
 		indix -= 1
 
-		ppg_signal = X_test[indix] * max_ppg + min_ppg											# input ppg signal
-		abp_signal_pred_approximate = Y_test_pred_approximate[indix] * max_abp + min_abp		# abp waveform approx.
-		abp_signal_pred = Y_test_pred[indix] * max_abp + min_abp								# abp waveform predicted
-		abp_signal_ground_truth = Y_test[indix] * max_abp + min_abp								# abp waveform ground truth
+		ppg_signal = X_test[indix] * (max_ppg - min_ppg) + min_ppg											# input ppg signal
+		abp_signal_pred_approximate = Y_test_pred_approximate[indix] * (max_abp - min_abp) + min_abp		# abp waveform approx.
+		abp_signal_pred = Y_test_pred[indix] * (max_abp - min_abp) + min_abp								# abp waveform predicted
+		abp_signal_ground_truth = Y_test[indix] * (max_abp - min_abp) + min_abp								# abp waveform ground truth
 
 		time_scale = np.arange(0, 8.192, 8.192/len(ppg_signal))									# series for time axis
 
@@ -92,7 +105,7 @@ def predicting_ABP_waveform():
 		plt.show()
 
 
-def evaluate_BHS_Standard():
+def evaluate_BHS_Standard(evaluation=None):
 	"""
 		Evaluates PPG2ABP based on
 		BHS Standard Metric
@@ -123,88 +136,16 @@ def evaluate_BHS_Standard():
 		ax.add_line(l)
 		return l
 
-	def BHS_metric(err):
-		"""
-		Computes the BHS Standard metric
-		
-		Arguments:
-			err {array} -- array of absolute error
-		
-		Returns:
-			tuple -- tuple of percentage of samples with <=5 mmHg, <=10 mmHg and <=15 mmHg error
-		"""
-
-		leq5 = 0
-		leq10 = 0
-		leq15 = 0
-
-		for i in range(len(err)):
-
-			if(abs(err[i]) <= 5):
-				leq5 += 1
-				leq10 += 1
-				leq15 += 1
-
-			elif(abs(err[i]) <= 10):
-				leq10 += 1
-				leq15 += 1
-
-			elif(abs(err[i]) <= 15):
-				leq15 += 1
-
-		return (leq5*100.0/len(err), leq10*100.0/len(err), leq15*100.0/len(err))
-
-	def calcError(Ytrue, Ypred, max_abp, min_abp, max_ppg, min_ppg):
-		"""
-		Calculates the absolute error of sbp,dbp,map etc.
-		
-		Arguments:
-			Ytrue {array} -- ground truth
-			Ypred {array} -- predicted
-			max_abp {float} -- max value of abp signal
-			min_abp {float} -- min value of abp signal
-			max_ppg {float} -- max value of ppg signal
-			min_ppg {float} -- min value of ppg signal
-		
-		Returns:
-			tuple -- tuple of abs. errors of sbp, dbp and map calculation
-		"""
-
-		sbps = []
-		dbps = []
-		maps = []
-		maes = []
-		gt = []
-
-		hist = []
+	evaluation = evaluation or get_evaluation()				# per-record pressures, reduced once
+	errors = evaluation.absolute_errors()
+	sbps = errors['sbp']
+	dbps = errors['dbp']
+	maps = errors['map']
 
-		for i in (range(len(Ytrue))):
-			y_t = Ytrue[i].ravel()
-			y_p = Ypred[i].ravel()
-
-			dbps.append(max_abp*abs(min(y_t)-min(y_p)))
-			sbps.append(max_abp*abs(max(y_t)-max(y_p)))
-			maps.append(max_abp*abs(np.mean(y_t)-np.mean(y_p)))
-
-		return (sbps, dbps, maps)
-
-	dt = pickle.load(open(os.path.join('data', 'test.p'), 'rb'))				# loading test data
-	X_test = dt['X_test']
-	Y_test = dt['Y_test']
-
-	dt = pickle.load(open(os.path.join('data', 'meta9.p'), 'rb'))				# loading meta data
-	max_ppg = dt['max_ppg']
-	min_ppg = dt['min_ppg']
-	max_abp = dt['max_abp']
-	min_abp = dt['min_abp']
-
-	Y_pred = pickle.load(open('test_output.p', 'rb'))							# loading prediction
-
-	(sbps, dbps, maps) = calcError(Y_test, Y_pred, max_abp, min_abp, max_ppg, min_ppg)   # compute errors
-
-	sbp_percent = BHS_metric(sbps)											# compute BHS metric for sbp
-	dbp_percent = BHS_metric(dbps)											# compute BHS metric for dbp
-	map_percent = BHS_metric(maps)											# compute BHS metric for map
+	bhs = evaluation.bhs()
+	sbp_percent = (bhs['sbp']['leq_5'], bhs['sbp']['leq_10'], bhs['sbp']['leq_15'])	# BHS metric for sbp
+	dbp_percent = (bhs['dbp']['leq_5'], bhs['dbp']['leq_10'], bhs['dbp']['leq_15'])	# BHS metric for dbp
+	map_percent = (bhs['map']['leq_5'], bhs['map']['leq_10'], bhs['map']['leq_15'])	# BHS metric for map
 
 	print('----------------------------')
 	print('|        BHS-Metric        |')
@@ -303,54 +244,16 @@ def evaluate_BHS_Standard():
 	plt.show()
 
 
-def evaluate_AAMI_Standard():
+def evaluate_AAMI_Standard(evaluation=None):
 	"""
 		Evaluate PPG2ABP using AAMI Standard metric	
 	"""
 
-	def calcErrorAAMI(Ypred, Ytrue, max_abp, min_abp, max_ppg, min_ppg):
-		"""
-		Calculates error of sbp,dbp,map for AAMI standard computation
-		
-		Arguments:
-			Ytrue {array} -- ground truth
-			Ypred {array} -- predicted
-			max_abp {float} -- max value of abp signal
-			min_abp {float} -- min value of abp signal
-			max_ppg {float} -- max value of ppg signal
-			min_ppg {float} -- min value of ppg signal
-		
-		Returns:
-			tuple -- tuple of errors of sbp, dbp and map calculation
-		"""
-
-		sbps = []
-		dbps = []
-		maps = []
-
-		for i in (range(len(Ytrue))):
-			y_t = Ytrue[i].ravel()
-			y_p = Ypred[i].ravel()
-
-			dbps.append(max_abp*(min(y_p)-min(y_t)))
-			sbps.append(max_abp*(max(y_p)-max(y_t)))
-			maps.append(max_abp*(np.mean(y_p)-np.mean(y_t)))
-
-		return (sbps, dbps, maps)
-
-	dt = pickle.load(open(os.path.join('data', 'test.p'), 'rb'))			# loading test data
-	X_test = dt['X_test']
-	Y_test = dt['Y_test']
-
-	dt = pickle.load(open(os.path.join('data', 'meta9.p'), 'rb'))			# loading metadata
-	max_ppg = dt['max_ppg']
-	min_ppg = dt['min_ppg']
-	max_abp = dt['max_abp']
-	min_abp = dt['min_abp']
-
-	Y_pred = pickle.load(open('test_output.p', 'rb'))						# loading prediction
-
-	(sbps, dbps, maps) = calcErrorAAMI(Y_test, Y_pred, max_abp, min_abp, max_ppg, min_ppg)		# compute error
+	evaluation = evaluation or get_evaluation()			# per-record pressures, reduced once
+	errors = evaluation.errors()
+	sbps = errors['sbp']
+	dbps = errors['dbp']
+	maps = errors['map']
 
 	print('---------------------')
 	print('|   AAMI Standard   |')
@@ -421,62 +324,34 @@ def evaluate_AAMI_Standard():
 	plt.show()
 
 
-def evaluate_BP_Classification():
+def print_classification_report(report):
 	"""
-		Evaluates PPG2ABP for BP Classification
+		Prints per-class precision, recall and F1 from Evaluation.classification()
 	"""
 
-	dt = pickle.load(open(os.path.join('data', 'test.p'), 'rb'))		# loading test data
-	Ytrue = dt['Y_test']
+	print('{:>16} {:>10} {:>10} {:>10} {:>10}'.format('', 'precision', 'recall', 'f1-score', 'support'))
+	for name in report['classes']:
+		row = report['per_class'][name]
+		print('{:>16} {:>10.5f} {:>10.5f} {:>10.5f} {:>10}'.format(name, row['precision'], row['recall'], row['f1'], row['support']))
+	print('{:>16} {:>32.5f}'.format('accuracy', report['accuracy']))
 
 
-	dt = pickle.load(open(os.path.join('data', 'meta9.p'), 'rb'))		# loading meta data
-	max_ppg = dt['max_ppg']
-	min_ppg = dt['min_ppg']
-	max_abp = dt['max_abp']
-	min_abp = dt['min_abp']
+def evaluate_BP_Classification(evaluation=None):
+	"""
+		Evaluates PPG2ABP for BP Classification
+	"""
 
-	Ypred = pickle.load(open('test_output.p', 'rb'))					# loading prediction
-	
+	evaluation = evaluation or get_evaluation()		# per-record pressures, reduced once
+	report = evaluation.classification()
 
 	### DBPS ####
 
-	cls_gt = []
-	cls_pred = []
-
-	for i in (range(len(Ytrue))):
-		y_t = Ytrue[i].ravel()
-		y_p = Ypred[i].ravel()
-
-		dbp_gt = max_abp*min(y_t)+min_abp
-		dbp_pred = max_abp*min(y_p)+min_abp
-
-		if(dbp_gt <= 80):
-			cls_gt.append('Normotension')
-		elif((dbp_gt > 80)and(dbp_gt <= 90)):
-			cls_gt.append('Pre-hypertension')
-		elif(dbp_gt > 90):
-			cls_gt.append('Hypertension')
-		else:
-			print('bump')				# this will never happen, check for error
-
-		if(dbp_pred <= 80):
-			cls_pred.append('Normotension')
-		elif((dbp_pred > 80)and(dbp_pred <= 90)):
-			cls_pred.append('Pre-hypertension')
-		elif(dbp_pred > 90):
-			cls_pred.append('Hypertension')
-		else:
-			print('bump')				# this will never happen, check for error
-
 	print('DBPS Classification Accuracy')
-	print(classification_report(cls_gt, cls_pred, digits=5))
-	# print('-'*25)
-	# print(accuracy_score(cls_gt,cls_pred))
+	print_classification_report(report['dbp'])
 
-	cm = confusion_matrix(cls_gt, cls_pred)
-	classes = ['Hypertension', 'Normotension', 'Prehypertension']
-	cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
+	cm = np.array(report['dbp']['confusion_matrix'], dtype=float)
+	classes = list(CLASSES)
+	cm = cm / np.maximum(cm.sum(axis=1), 1)[:, np.newaxis]
 	fig = plt.figure(figsize=(16, 6), dpi=120)
 	ax = plt.subplot(1,2,1)
 	im = ax.imshow(cm, interpolation='nearest', cmap='GnBu')			# draw confusion matrix
@@ -513,42 +388,12 @@ def evaluate_BP_Classification():
 
 	### SBPS ####
 
-	cls_gt = []
-	cls_pred = []
-
-	for i in (range(len(Ytrue))):
-		y_t = Ytrue[i].ravel()
-		y_p = Ypred[i].ravel()
-
-		sbp_gt = max_abp*max(y_t)+min_abp
-		sbp_pred = max_abp*max(y_p)+min_abp
-
-		if(sbp_gt <= 120):
-			cls_gt.append('Normotension')
-		elif((sbp_gt > 120)and(sbp_gt <= 140)):
-			cls_gt.append('Prehypertension')
-		elif(sbp_gt > 140):
-			cls_gt.append('Hypertension')
-		else:
-			print('bump')				# this will never happen, check for error
-
-		if(sbp_pred <= 120):
-			cls_pred.append('Normotension')
-		elif((sbp_pred > 120)and(sbp_pred <= 140)):
-			cls_pred.append('Prehypertension')
-		elif(sbp_pred > 140):
-			cls_pred.append('Hypertension')
-		else:
-			print('bump')				# this will never happen, check for error
-
 	print('SBPS Classification Accuracy')
-	print(classification_report(cls_gt, cls_pred, digits=5))
-	# print('-'*25)
-	# print(accuracy_score(cls_gt,cls_pred))
+	print_classification_report(report['sbp'])
 
-	cm = confusion_matrix(cls_gt, cls_pred)
-	classes = ['Hypertension', 'Normotension', 'Prehypertension']
-	cm = cm.astype('float') / cm.sum(axis=1)[:, np.newaxis]
+	cm = np.array(report['sbp']['confusion_matrix'], dtype=float)
+	classes = list(CLASSES)
+	cm = cm / np.maximum(cm.sum(axis=1), 1)[:, np.newaxis]
 	
 	ax = plt.subplot(1,2,2)
 	im = ax.imshow(cm, interpolation='nearest', cmap='GnBu')		# draw confusion matrix
@@ -585,7 +430,7 @@ def evaluate_BP_Classification():
 	plt.show()
 
 
-def bland_altman_plot():
+def bland_altman_plot(evaluation=None):
 	"""
 		Draws the Bland Altman plot
 	"""
@@ -617,42 +462,16 @@ def bland_altman_plot():
 
 
 
-	dt = pickle.load(open(os.path.join('data','test.p'),'rb'))			# loading test data
-		
-	Ytrue = dt['Y_test']
-
-	dt = pickle.load(open(os.path.join('data','meta9.p'),'rb'))			# loading meta data
-	max_ppg = dt['max_ppg']
-	min_ppg = dt['min_ppg']
-	max_abp = dt['max_abp']
-	min_abp = dt['min_abp']
-
-	Ypred = pickle.load(open('test_output.p','rb'))						# loading prediction
-
-	Ytrue = Ytrue * max_abp + min_abp
-	Ypred = Ypred * max_abp + min_abp
-
-	sbpTrues = []
-	sbpPreds = []
-
-	dbpTrues = []
-	dbpPreds = []
-
-	mapTrues = []
-	mapPreds = []
+	evaluation = evaluation or get_evaluation()		# per-record pressures, reduced once
 
-	for i in (range(len(Ytrue))):
-		y_t = Ytrue[i].ravel()
-		y_p = Ypred[i].ravel()
+	sbpTrues = evaluation.true['sbp']
+	sbpPreds = evaluation.pred['sbp']
 
-		sbpTrues.append(max(y_t))
-		sbpPreds.append(max(y_p))
+	dbpTrues = evaluation.true['dbp']
+	dbpPreds = evaluation.pred['dbp']
 
-		dbpTrues.append(min(y_t))
-		dbpPreds.append(min(y_p))
-
-		mapTrues.append(np.mean(y_t))
-		mapPreds.append(np.mean(y_p))
+	mapTrues = evaluation.true['map']
+	mapPreds = evaluation.pred['map']
 
 	'''
 		Plots the Bland Altman plot
@@ -677,47 +496,21 @@ def bland_altman_plot():
 	plt.show()
 	
 
-def regression_plot():
+def regression_plot(evaluation=None):
 	"""
 		Draws the Regression Plots
 	"""
 
-	dt = pickle.load(open(os.path.join('data','test.p'),'rb'))		# loading the test data
-		
-	Ytrue = dt['Y_test']
-	
-	dt = pickle.load(open(os.path.join('data','meta9.p'),'rb'))		# loading the meta data
-	max_ppg = dt['max_ppg']
-	min_ppg = dt['min_ppg']
-	max_abp = dt['max_abp']
-	min_abp = dt['min_abp']
-
-	Ypred = pickle.load(open('test_output.p','rb'))					# loading the prediction
-
-	Ytrue = Ytrue * max_abp + min_abp
-	Ypred = Ypred * max_abp + min_abp
-
-	sbpTrues = []
-	sbpPreds = []
-
-	dbpTrues = []
-	dbpPreds = []
-
-	mapTrues = []
-	mapPreds = []
-
-	for i in (range(len(Ytrue))):
-		y_t = Ytrue[i].ravel()
-		y_p = Ypred[i].ravel()
+	evaluation = evaluation or get_evaluation()		# per-record pressures, reduced once
 
-		sbpTrues.append(max(y_t))
-		sbpPreds.append(max(y_p))
+	sbpTrues = evaluation.true['sbp']
+	sbpPreds = evaluation.pred['sbp']
 
-		dbpTrues.append(min(y_t))
-		dbpPreds.append(min(y_p))
+	dbpTrues = evaluation.true['dbp']
+	dbpPreds = evaluation.pred['dbp']
 
-		mapTrues.append(np.mean(y_t))
-		mapPreds.append(np.mean(y_p))
+	mapTrues = evaluation.true['map']
+	mapPreds = evaluation.pred['map']
 
 	'''
 		Drawing the regression plots
@@ -0,0 +1,279 @@
+"""
+	Vectorized evaluation of PPG2ABP predictions.
+
+	SBP, DBP and MAP are reduced from the ground truth and predicted waveforms once,
+	with NumPy axis operations over chunks of records, and cached; the BHS and AAMI
+	standards, hypertension classification, Bland-Altman limits and regression
+	statistics are all computed from those per-record pressures.
+
+	Run from this directory, e.g.:
+		python evaluation.py --output report.json
+		python evaluation.py --plots        # also draws the figures from evaluate.py
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from dataset import load_meta, load_test_data
+
+logger = logging.getLogger(__name__)
+
+MEASURES = ('sbp', 'dbp', 'map')
+
+# Share of records within 5, 10 and 15 mmHg needed for each BHS grade
+BHS_THRESHOLDS = (5, 10, 15)
+BHS_GRADES = (('A', (60, 85, 95)), ('B', (50, 75, 90)), ('C', (40, 65, 85)))
+
+# AAMI: mean error within 5 mmHg with a standard deviation of at most 8 mmHg
+AAMI_MAX_MEAN_ERROR = 5
+AAMI_MAX_STD = 8
+
+# Upper bounds (inclusive) of normotension and prehypertension for each measure
+CLASSIFICATION_BOUNDS = {'dbp': (80, 90), 'sbp': (120, 140)}
+CLASSES = ('Normotension', 'Prehypertension', 'Hypertension')
+
+
+def reduce_pressures(Y, max_abp, min_abp, chunk_size=4096):
+	"""
+		Computes the SBP, DBP and MAP (mmHg) of every normalized ABP waveform in Y,
+		a chunk of records at a time so memory-mapped inputs are never loaded whole
+	"""
+
+	pressures = {measure: np.empty(len(Y)) for measure in MEASURES}
+	for start in range(0, len(Y), chunk_size):
+		chunk = np.asarray(Y[start:start + chunk_size], dtype=np.float64).reshape(-1, np.prod(Y.shape[1:], dtype=int))
+		stop = start + len(chunk)
+		pressures['sbp'][start:stop] = chunk.max(axis=1)
+		pressures['dbp'][start:stop] = chunk.min(axis=1)
+		pressures['map'][start:stop] = chunk.mean(axis=1)
+	# meta9 holds the true bounds; the waveforms were scaled with (x - min) / (max - min)
+	return {measure: values * (max_abp - min_abp) + min_abp for measure, values in pressures.items()}
+
+
+def classify(values, bounds):
+	"""
+		Returns the class index (into CLASSES) of every pressure
+	"""
+
+	return np.searchsorted(np.asarray(bounds), values, side='left')
+
+
+class Evaluation:
+	"""
+		Per-record pressures of the ground truth and the predictions, and every metric derived from them
+	"""
+
+	def __init__(self, true_pressures, pred_pressures):
+		self.true = true_pressures
+		self.pred = pred_pressures
+		self.records = len(true_pressures['sbp'])
+		self._errors = None
+
+	@classmethod
+	def from_arrays(cls, Ytrue, Ypred, meta):
+		if len(Ytrue) != len(Ypred):
+			raise ValueError(f"{len(Ytrue)} ground truth records but {len(Ypred)} predictions")
+		return cls(
+			reduce_pressures(Ytrue, meta['max_abp'], meta['min_abp']),
+			reduce_pressures(Ypred, meta['max_abp'], meta['min_abp'])
+		)
+
+	@classmethod
+	def load(cls, data_path=os.path.join('data', 'test'), output='test_output', cache_path=None):
+		"""
+			Loads the test set and a prediction output (.npy written by batch_inference.py
+			or the older pickle), reusing the pressures cached in cache_path while it is
+			newer than the prediction
+		"""
+
+		output_path = output + '.npy' if os.path.exists(output + '.npy') else output + '.p'
+		if cache_path and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(output_path):
+			cached = np.load(cache_path)
+			return cls(
+				{measure: cached['true_' + measure] for measure in MEASURES},
+				{measure: cached['pred_' + measure] for measure in MEASURES}
+			)
+
+		if output_path.endswith('.npy'):
+			Ypred = np.load(output_path, mmap_mode='r')
+		else:
+			import pickle
+			with open(output_path, 'rb') as f:
+				Ypred = pickle.load(f)
+		evaluation = cls.from_arrays(load_test_data(data_path)['Y_test'], Ypred, load_meta(data_path))
+
+		if cache_path:
+			np.savez(cache_path, **{'true_' + measure: values for measure, values in evaluation.true.items()},
+					 **{'pred_' + measure: values for measure, values in evaluation.pred.items()})
+		return evaluation
+
+	def errors(self):
+		"""
+			Signed errors (prediction - ground truth) per measure
+		"""
+
+		if self._errors is None:
+			self._errors = {measure: self.pred[measure] - self.true[measure] for measure in MEASURES}
+		return self._errors
+
+	def absolute_errors(self):
+		return {measure: np.abs(values) for measure, values in self.errors().items()}
+
+	def bhs(self):
+		"""
+			Percentage of records within 5, 10 and 15 mmHg, and the BHS grade, per measure
+		"""
+
+		report = {}
+		for measure, values in self.absolute_errors().items():
+			percentages = [float(np.mean(values <= threshold) * 100) for threshold in BHS_THRESHOLDS]
+			grade = next((name for name, minimums in BHS_GRADES
+						  if all(p >= minimum for p, minimum in zip(percentages, minimums))), 'D')
+			report[measure] = {
+				'leq_5': round(percentages[0], 3),
+				'leq_10': round(percentages[1], 3),
+				'leq_15': round(percentages[2], 3),
+				'grade': grade
+			}
+		return report
+
+	def aami(self):
+		"""
+			Mean error and its standard deviation per measure, and whether they meet AAMI
+		"""
+
+		report = {}
+		for measure, values in self.errors().items():
+			mean_error, std = float(np.mean(values)), float(np.std(values))
+			report[measure] = {
+				'mean_error': round(mean_error, 3),
+				'std': round(std, 3),
+				'passes': abs(mean_error) <= AAMI_MAX_MEAN_ERROR and std <= AAMI_MAX_STD
+			}
+		return report
+
+	def classification(self):
+		"""
+			Hypertension classification from DBP and from SBP: confusion matrix
+			(rows are the true class), per-class precision/recall/F1 and accuracy
+		"""
+
+		report = {}
+		for measure, bounds in CLASSIFICATION_BOUNDS.items():
+			true_class = classify(self.true[measure], bounds)
+			pred_class = classify(self.pred[measure], bounds)
+			matrix = np.bincount(true_class * len(CLASSES) + pred_class, minlength=len(CLASSES) ** 2)\
+				.reshape(len(CLASSES), len(CLASSES))
+
+			hits = np.diag(matrix).astype(float)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				precision = np.nan_to_num(hits / matrix.sum(axis=0))
+				recall = np.nan_to_num(hits / matrix.sum(axis=1))
+				f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+
+			report[measure] = {
+				'classes': list(CLASSES),
+				'confusion_matrix': matrix.tolist(),
+				'accuracy': round(float(hits.sum() / max(matrix.sum(), 1)), 5),
+				'per_class': {
+					name: {
+						'precision': round(float(precision[index]), 5),
+						'recall': round(float(recall[index]), 5),
+						'f1': round(float(f1[index]), 5),
+						'support': int(matrix[index].sum())
+					} for index, name in enumerate(CLASSES)
+				}
+			}
+		return report
+
+	def bland_altman(self):
+		"""
+			Mean difference (ground truth - prediction) and the 95% limits of agreement per measure
+		"""
+
+		report = {}
+		for measure, values in self.errors().items():
+			difference = -values
+			mean, std = float(np.mean(difference)), float(np.std(difference))
+			report[measure] = {
+				'mean_difference': round(mean, 3),
+				'upper_limit': round(mean + 1.96 * std, 3),
+				'lower_limit': round(mean - 1.96 * std, 3)
+			}
+		return report
+
+	def regression(self):
+		"""
+			Least-squares fit of the predictions on the ground truth per measure
+		"""
+
+		report = {}
+		for measure in MEASURES:
+			slope, intercept = np.polyfit(self.true[measure], self.pred[measure], 1)
+			r = float(np.corrcoef(self.true[measure], self.pred[measure])[0, 1])
+			report[measure] = {'slope': round(float(slope), 5), 'intercept': round(float(intercept), 5), 'r': round(r, 5)}
+		return report
+
+	def report(self):
+		return {
+			'records': self.records,
+			'bhs': self.bhs(),
+			'aami': self.aami(),
+			'classification': self.classification(),
+			'bland_altman': self.bland_altman(),
+			'regression': self.regression()
+		}
+
+
+_evaluation = None
+
+
+def get_evaluation():
+	"""
+		Returns the evaluation of test_output against the test set, loaded once per process
+	"""
+
+	global _evaluation
+	if _evaluation is None:
+		_evaluation = Evaluation.load()
+	return _evaluation
+
+
+def main():
+	logging.basicConfig(level=logging.INFO)
+	parser = argparse.ArgumentParser(description="Evaluate PPG2ABP predictions against the test set")
+	parser.add_argument('--data', default=os.path.join('data', 'test'), help="Test set (dataset directory or pickle path without .p)")
+	parser.add_argument('--predictions', default='test_output', help="Prediction output without extension (.npy or .p)")
+	parser.add_argument('--cache', help="Cache the per-record pressures in this .npz")
+	parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+	parser.add_argument('--plots', action='store_true', help="Also draw the figures from evaluate.py")
+	args = parser.parse_args()
+
+	start_time = time.monotonic()
+	evaluation = Evaluation.load(args.data, args.predictions, args.cache)
+	report = evaluation.report()
+	logger.info(f"Evaluated {report['records']} records in {time.monotonic() - start_time:.2f} seconds")
+
+	output = json.dumps(report, indent=2)
+	if args.output:
+		with open(args.output, 'w') as f:
+			f.write(output)
+	else:
+		print(output)
+
+	if args.plots:
+		import evaluate     # matplotlib and seaborn are only needed for plotting
+		evaluate.evaluate_BHS_Standard(evaluation)
+		evaluate.evaluate_AAMI_Standard(evaluation)
+		evaluate.evaluate_BP_Classification(evaluation)
+		evaluate.bland_altman_plot(evaluation)
+		evaluate.regression_plot(evaluation)
+
+
+if __name__ == '__main__':
+	main()
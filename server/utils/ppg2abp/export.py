@@ -0,0 +1,210 @@
+"""
+	Exports the PPG2ABP networks to ONNX for CPU inference in the server.
+
+	Both architectures are rebuilt from models.py, the .h5 weights are loaded and
+	each network is converted with a fixed 1024-sample input (any batch size) to
+	ApproximateNetwork.onnx and RefinementNetwork.onnx. The server runs these with
+	onnxruntime (see inference.py), so it needs neither Keras nor TensorFlow.
+
+	Exporting needs TensorFlow 2 (before 2.16, whose Keras 3 can't load these
+	models), tf2onnx and onnxruntime, not the pinned requirements.txt. Run from this
+	directory:
+		python export.py export --model-dir models --output-dir models
+		python export.py verify --onnx-dir models --reference test_output.npy
+		python export.py benchmark --onnx-dir models --batch-sizes 1 8 32 128
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+length = 1024               # length of signal
+
+NETWORKS = (('ApproximateNetwork', 'UNetDS64'), ('RefinementNetwork', 'MultiResUNet1D'))
+
+
+def build_models(model_dir):
+	"""
+		Rebuilds both networks from models.py and loads their weights
+	"""
+
+	import models
+
+	built = {}
+	for name, architecture in NETWORKS:
+		mdl = getattr(models, architecture)(length)
+		mdl.load_weights(os.path.join(model_dir, name + '.h5'))
+		built[name] = mdl
+	return built
+
+
+def export_onnx(model_dir, output_dir, opset=13):
+	"""
+		Converts both networks to ONNX with input shape (batch, 1024, 1)
+
+		Returns the paths of the written models
+	"""
+
+	import tensorflow as tf
+	import tf2onnx
+
+	os.makedirs(output_dir, exist_ok=True)
+	paths = []
+	for name, mdl in build_models(model_dir).items():
+		path = os.path.join(output_dir, name + '.onnx')
+		signature = (tf.TensorSpec((None, length, 1), tf.float32, name='ppg'),)
+		tf2onnx.convert.from_keras(mdl, input_signature=signature, opset=opset, output_path=path)
+		logger.info(f"Exported {name} to {path}")
+		paths.append(path)
+	return paths
+
+
+def load_sessions(onnx_dir, threads=0):
+	"""
+		Opens both ONNX networks with onnxruntime on the CPU
+	"""
+
+	import onnxruntime
+
+	options = onnxruntime.SessionOptions()
+	if threads:
+		options.intra_op_num_threads = threads
+	return {
+		name: onnxruntime.InferenceSession(os.path.join(onnx_dir, name + '.onnx'), options, providers=['CPUExecutionProvider'])
+		for name, _ in NETWORKS
+	}
+
+
+def run_cascade(sessions, X):
+	"""
+		Runs the approximation and refinement networks, returning both outputs
+	"""
+
+	approximate_session = sessions['ApproximateNetwork']
+	refinement_session = sessions['RefinementNetwork']
+	approximate = approximate_session.run(None, {approximate_session.get_inputs()[0].name: X})
+	refined = refinement_session.run(None, {refinement_session.get_inputs()[0].name: approximate[0]})[0]
+	return approximate, refined
+
+
+def sample_windows(data_path, samples):
+	"""
+		Returns the first test windows, or random ones if the test set isn't available
+	"""
+
+	from dataset import load_test_data
+
+	try:
+		return np.asarray(load_test_data(data_path)['X_test'][:samples], dtype=np.float32).reshape(-1, length, 1)
+	except (IOError, OSError):
+		logger.warning(f"No test set at {data_path}, verifying on random windows")
+		return np.random.RandomState(0).rand(samples, length, 1).astype(np.float32)
+
+
+def verify(model_dir, onnx_dir, data_path, samples=256, tolerance=1e-4, reference=None):
+	"""
+		Compares the ONNX networks with the Keras ones (and, if given, with reference
+		outputs from batch_inference.py) on the same windows
+
+		Returns a report with the largest absolute differences and whether they are within tolerance
+	"""
+
+	X = sample_windows(data_path, samples)
+	sessions = load_sessions(onnx_dir)
+	approximate, refined = run_cascade(sessions, X)
+
+	keras_models = build_models(model_dir)
+	keras_approximate = keras_models['ApproximateNetwork'].predict(X)
+	keras_refined = keras_models['RefinementNetwork'].predict(keras_approximate[0])
+
+	differences = {
+		'approximate_' + name: float(np.max(np.abs(onnx_output - keras_output)))
+		for name, onnx_output, keras_output in zip(('out', 'level1', 'level2', 'level3', 'level4'), approximate, keras_approximate)
+	}
+	differences['refined'] = float(np.max(np.abs(refined - keras_refined)))
+	if reference:
+		expected = np.load(reference, mmap_mode='r')[:len(X)]
+		differences['refined_vs_reference'] = float(np.max(np.abs(refined - np.asarray(expected).reshape(refined.shape))))
+
+	return {
+		'samples': len(X),
+		'tolerance': tolerance,
+		'max_abs_difference': differences,
+		'passes': all(value <= tolerance for value in differences.values())
+	}
+
+
+def benchmark(onnx_dir, batch_sizes=(1, 8, 32, 128), repeats=20, threads=0):
+	"""
+		Measures latency and throughput of the whole cascade at several batch sizes
+	"""
+
+	sessions = load_sessions(onnx_dir, threads)
+	random = np.random.RandomState(0)
+	results = []
+	for batch_size in batch_sizes:
+		X = random.rand(batch_size, length, 1).astype(np.float32)
+		run_cascade(sessions, X)                                # warm-up
+		latencies = []
+		for _ in range(repeats):
+			start_time = time.perf_counter()
+			run_cascade(sessions, X)
+			latencies.append((time.perf_counter() - start_time) * 1000)
+		latencies.sort()
+		median = latencies[len(latencies) // 2]
+		results.append({
+			'batch_size': batch_size,
+			'latency_ms_p50': round(median, 2),
+			'latency_ms_max': round(latencies[-1], 2),
+			'windows_per_second': round(batch_size * 1000 / median, 1)
+		})
+	return results
+
+
+def main():
+	logging.basicConfig(level=logging.INFO)
+	parser = argparse.ArgumentParser(description="Export PPG2ABP to ONNX and check the exported models")
+	subparsers = parser.add_subparsers(dest='command')
+
+	export_parser = subparsers.add_parser('export', help="Convert the .h5 models to ONNX")
+	export_parser.add_argument('--model-dir', default='models', help="Directory with ApproximateNetwork.h5 and RefinementNetwork.h5")
+	export_parser.add_argument('--output-dir', default='models', help="Where the .onnx files are written")
+	export_parser.add_argument('--opset', type=int, default=13, help="ONNX opset")
+
+	verify_parser = subparsers.add_parser('verify', help="Check the ONNX outputs against Keras")
+	verify_parser.add_argument('--model-dir', default='models', help="Directory with the .h5 models")
+	verify_parser.add_argument('--onnx-dir', default='models', help="Directory with the .onnx models")
+	verify_parser.add_argument('--data', default=os.path.join('data', 'test'), help="Test set to take windows from")
+	verify_parser.add_argument('--samples', type=int, default=256, help="Windows to compare")
+	verify_parser.add_argument('--tolerance', type=float, default=1e-4, help="Largest allowed absolute difference (normalized units)")
+	verify_parser.add_argument('--reference', help="Refinement outputs from batch_inference.py (.npy) to compare as well")
+
+	benchmark_parser = subparsers.add_parser('benchmark', help="Measure ONNX latency and throughput")
+	benchmark_parser.add_argument('--onnx-dir', default='models', help="Directory with the .onnx models")
+	benchmark_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32, 128], help="Batch sizes to measure")
+	benchmark_parser.add_argument('--repeats', type=int, default=20, help="Timed runs per batch size")
+	benchmark_parser.add_argument('--threads', type=int, default=0, help="onnxruntime intra-op threads (0 lets it decide)")
+	args = parser.parse_args()
+
+	if args.command == 'export':
+		export_onnx(args.model_dir, args.output_dir, args.opset)
+	elif args.command == 'verify':
+		report = verify(args.model_dir, args.onnx_dir, args.data, args.samples, args.tolerance, args.reference)
+		print(json.dumps(report, indent=2))
+		if not report['passes']:
+			sys.exit(1)
+	elif args.command == 'benchmark':
+		print(json.dumps(benchmark(args.onnx_dir, args.batch_sizes, args.repeats, args.threads), indent=2))
+	else:
+		parser.print_help()
+
+
+if __name__ == '__main__':
+	main()
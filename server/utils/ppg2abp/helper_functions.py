@@ -2,10 +2,10 @@
 	Miscellaneous helper functions
 """
 
-from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
 import pickle
+from data_pipeline import pool_labels
 from keras.metrics import *
 import seaborn as sns
 sns.set()
@@ -29,41 +29,11 @@ def prepareData(mdl, X_train, X_val, X_test, Y_train, Y_val, Y_test):
 		tuple -- tuple of X_train, X_val and X_test for 2nd stage training
 	"""
 	
-	X2_train = []
+	X2_train = np.asarray(mdl.predict(X_train))		# predictions are already arrays, no per-sample copies
 
-	X2_val = []
+	X2_val = np.asarray(mdl.predict(X_val))
 
-	X2_test = []
-
-
-	YPs = mdl.predict(X_train)
-
-	for i in tqdm(range(len(X_train))):
-
-		X2_train.append(np.array(YPs[i]))
-
-
-
-	YPs = mdl.predict(X_val)
-
-	for i in tqdm(range(len(X_val))):
-
-		X2_val.append(np.array(YPs[i]))
-
-
-
-	YPs = mdl.predict(X_test)
-
-	for i in tqdm(range(len(X_test))):
-
-		X2_test.append(np.array(YPs[i]))
-
-
-	X2_train = np.array(X2_train)
-
-	X2_val = np.array(X2_val)
-
-	X2_test = np.array(X2_test)
+	X2_test = np.asarray(mdl.predict(X_test))
 
 	return (X2_train, X2_val, X2_test)
 
@@ -80,16 +50,7 @@ def prepareDataDS(mdl, X):
 		X {array} -- suitable X for 2nd stage training
 	"""
 	
-	X2 = []
-
-
-	YPs = mdl.predict(X)
-	
-	for i in tqdm(range(len(X)),desc='Preparing Data for DS'):
-		
-	   X2.append(np.array(YPs[0][i]))
-
-	X2 = np.array(X2)
+	X2 = np.asarray(mdl.predict(X)[0])		# the first output is the full resolution one
 
 
 	return X2
@@ -104,59 +65,7 @@ def prepareLabel(Y):
 		dictionary -- dictionary containing the 5 level ground truth outputs of the network
 	"""
 	
-	def approximate(inp,w_len):
-		"""
-		Downsamples using taking mean over window
-		
-		Arguments:
-			inp {array} -- signal
-			w_len {int} -- length of window
-		
-		Returns:
-			array -- downsampled signal
-		"""
-		
-		op = []
-		
-		for i in range(0,len(inp),w_len):
-		
-			op.append(np.mean(inp[i:i+w_len]))
-			
-		return np.array(op)
-	
-	out = {}
-	out['out'] = []
-	out['level1'] = []
-	out['level2'] = []
-	out['level3'] = []
-	out['level4'] = []
-	
-	
-	for y in tqdm(Y,desc='Preparing Label for DS'):
-	
-																	# computing approximations
-		cA1 = approximate(np.array(y).reshape(length), 2)
-		
-		cA2 = approximate(np.array(y).reshape(length), 4)
-		
-		cA3 = approximate(np.array(y).reshape(length), 8)
-		
-		cA4 = approximate(np.array(y).reshape(length), 16)
-		
-		
-		
-																	# populating the labels for different labels
-		out['out'].append(np.array(y.reshape(length,1)))
-		out['level1'].append(np.array(cA1.reshape(length//2,1)))
-		out['level2'].append(np.array(cA2.reshape(length//4,1)))
-		out['level3'].append(np.array(cA3.reshape(length//8,1)))
-		out['level4'].append(np.array(cA4.reshape(length//16,1)))
-		
-	out['out'] = np.array(out['out'])                                # converting to numpy array
-	out['level1'] = np.array(out['level1'])
-	out['level2'] = np.array(out['level2'])
-	out['level3'] = np.array(out['level3'])
-	out['level4'] = np.array(out['level4'])
+	out = pool_labels(Y)			# mean-pools every level with one reshape each, see data_pipeline.py
 	
 	
 	return out
@@ -0,0 +1,235 @@
+"""
+    Batched PPG -> ABP inference for the server: UNetDS64 approximates the ABP
+    waveform and MultiResUNet1D refines it, with both networks loaded once per process.
+    The networks run with onnxruntime when their ONNX exports (see export.py) are
+    present, otherwise with Keras.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.metrics import increment, observe, set_gauge
+from utils.ppg2abp.dataset import load_meta
+from utils.ppg2abp.preprocessing import WINDOW_LENGTH, normalize
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+PPG2ABP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Trained weights (ApproximateNetwork.h5, RefinementNetwork.h5) and the scaling metadata
+# (meta9.p, or a sharded dataset's manifest.json)
+PPG2ABP_MODEL_DIR = os.getenv('PPG2ABP_MODEL_DIR', os.path.join(PPG2ABP_DIR, 'models'))
+PPG2ABP_META_PATH = os.getenv('PPG2ABP_META_PATH', os.path.join(PPG2ABP_DIR, 'data', 'meta9.p'))
+# Windows per forward pass
+PPG2ABP_BATCH_SIZE = int(os.getenv('PPG2ABP_BATCH_SIZE', '32'))
+# 'onnx', 'keras', or 'auto' (ONNX when ApproximateNetwork.onnx and RefinementNetwork.onnx exist)
+PPG2ABP_BACKEND = os.getenv('PPG2ABP_BACKEND', 'auto').lower()
+# onnxruntime intra-op threads per network (0 lets onnxruntime decide)
+PPG2ABP_ONNX_THREADS = int(os.getenv('PPG2ABP_ONNX_THREADS', '0'))
+# How PPG is scaled to the networks' input range: 'meta' applies the training scaling
+# (x - min_ppg) / (max_ppg - min_ppg) with meta9's dataset-wide bounds, and suits PPG in the
+# training set's units. 'window' scales each window to [0, 1] and is the default because
+# watch windows arrive as MAX30105 raw counts (or device-normalized values), whose offset and
+# amplitude depend on the sensor, skin and contact; in those units meta9's bounds would put
+# every sample far outside the range the networks were trained on. Per-window scaling
+# discards the PPG amplitude, so in 'window' mode the waveform shape and trends are
+# meaningful but absolute SBP/DBP values are uncalibrated.
+PPG2ABP_PPG_SCALING = os.getenv('PPG2ABP_PPG_SCALING', 'window').lower()
+
+NETWORK_NAMES = ('ApproximateNetwork', 'RefinementNetwork')
+
+
+class BPModelUnavailableError(Exception):
+    """Raised when the PPG2ABP weights or their dependencies can't be loaded."""
+
+
+class OnnxModel:
+    """ONNX export of one network, with the same predict() interface as a Keras model."""
+
+    def __init__(self, path: str, threads: int = PPG2ABP_ONNX_THREADS):
+        try:
+            # onnxruntime is only needed by processes that serve blood pressure estimates
+            import onnxruntime
+        except ImportError as e:
+            raise BPModelUnavailableError(f"onnxruntime is not installed: {str(e)}")
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, windows: np.ndarray, batch_size: int = PPG2ABP_BATCH_SIZE):
+        """
+        Run the network over windows in batches.
+
+        Returns:
+            np.ndarray or list: The output, or a list of outputs for multi-output networks
+        """
+        batches = [self.session.run(None, {self.input_name: windows[start:start + batch_size]})
+                   for start in range(0, len(windows), batch_size)]
+        outputs = [np.concatenate(output) for output in zip(*batches)]
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+class BPEstimator:
+    """Two-stage PPG2ABP cascade with lazily loaded weights."""
+
+    def __init__(self, model_dir: str = PPG2ABP_MODEL_DIR, meta_path: str = PPG2ABP_META_PATH,
+                 batch_size: int = PPG2ABP_BATCH_SIZE, backend: str = PPG2ABP_BACKEND,
+                 scaling: str = PPG2ABP_PPG_SCALING):
+        if scaling not in ('meta', 'window'):
+            raise ValueError(f"Unknown PPG2ABP scaling: {scaling}")
+        self.model_dir = model_dir
+        self.meta_path = meta_path
+        self.batch_size = batch_size
+        self.backend = backend
+        self.scaling = scaling
+        self.approximate_model = None
+        self.refinement_model = None
+        self.meta = None
+        self._load_lock = threading.Lock()
+        # Keras models aren't safe to call from several request threads at once (onnxruntime sessions are)
+        self._predict_lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self.refinement_model is not None
+
+    def _resolve_backend(self) -> str:
+        if self.backend == 'auto':
+            exported = all(os.path.exists(os.path.join(self.model_dir, f"{name}.onnx")) for name in NETWORK_NAMES)
+            return 'onnx' if exported else 'keras'
+        if self.backend not in ('onnx', 'keras'):
+            raise BPModelUnavailableError(f"Unknown PPG2ABP backend: {self.backend}")
+        return self.backend
+
+    def _load_onnx(self) -> tuple:
+        try:
+            return tuple(OnnxModel(os.path.join(self.model_dir, f"{name}.onnx")) for name in NETWORK_NAMES)
+        except BPModelUnavailableError:
+            raise
+        except Exception as e:
+            # onnxruntime reports missing or invalid files with its own exception types
+            raise BPModelUnavailableError(f"PPG2ABP ONNX models could not be loaded: {str(e)}")
+
+    def _load_keras(self) -> tuple:
+        try:
+            # Keras is only needed by processes that serve blood pressure estimates without the ONNX exports
+            from utils.ppg2abp.models import UNetDS64, MultiResUNet1D
+        except ImportError as e:
+            raise BPModelUnavailableError(f"Keras is not installed: {str(e)}")
+
+        try:
+            approximate_model = UNetDS64(WINDOW_LENGTH)
+            approximate_model.load_weights(os.path.join(self.model_dir, 'ApproximateNetwork.h5'))
+            refinement_model = MultiResUNet1D(WINDOW_LENGTH)
+            refinement_model.load_weights(os.path.join(self.model_dir, 'RefinementNetwork.h5'))
+        except (OSError, IOError) as e:
+            raise BPModelUnavailableError(f"PPG2ABP weights not found: {str(e)}")
+        return approximate_model, refinement_model
+
+    def load(self) -> None:
+        """
+        Load both networks and the scaling metadata (only the first call does any work).
+
+        Raises:
+            BPModelUnavailableError: If the backend's runtime, the models or meta9.p are missing
+        """
+        if self.loaded:
+            return
+
+        with self._load_lock:
+            if self.loaded:
+                return
+
+            start_time = time.monotonic()
+            backend = self._resolve_backend()
+            try:
+                meta = load_meta(self.meta_path)
+            except (OSError, IOError) as e:
+                raise BPModelUnavailableError(f"PPG2ABP metadata not found: {str(e)}")
+            approximate_model, refinement_model = self._load_onnx() if backend == 'onnx' else self._load_keras()
+
+            self.meta = {key: float(meta[key]) for key in ('max_ppg', 'min_ppg', 'max_abp', 'min_abp')}
+            self.backend = backend
+            self.approximate_model = approximate_model
+            self.refinement_model = refinement_model
+            set_gauge('bp_model_load_seconds', time.monotonic() - start_time)
+            logger.info(f"Loaded PPG2ABP {backend} models from {self.model_dir} in {time.monotonic() - start_time:.1f}s")
+
+    def scale(self, windows: np.ndarray) -> np.ndarray:
+        """Scale cleaned PPG windows to the networks' input range (see PPG2ABP_PPG_SCALING)."""
+        if self.scaling == 'meta':
+            span = self.meta['max_ppg'] - self.meta['min_ppg']
+            return ((windows - self.meta['min_ppg']) / span).astype(np.float32)
+        return normalize(windows)
+
+    def predict(self, windows: np.ndarray, valid_lengths: np.ndarray = None) -> dict:
+        """
+        Estimate ABP waveforms and SBP/DBP/MAP for a batch of prepared windows.
+
+        Args:
+            windows (np.ndarray): Shape (n, 1024), cleaned PPG at 125 Hz (scaled here)
+            valid_lengths (np.ndarray): Real (unpadded) samples per window; pressures are
+                computed over these samples only (defaults to the whole window)
+
+        Returns:
+            dict: abp (n, 1024) in mmHg, sbp, dbp and map (n,), windows_per_second
+        """
+        self.load()
+        windows = self.scale(np.asarray(windows, dtype=np.float32).reshape(-1, WINDOW_LENGTH))[..., np.newaxis]
+        if valid_lengths is None:
+            valid_lengths = np.full(len(windows), WINDOW_LENGTH)
+
+        start_time = time.monotonic()
+        with self._predict_lock if self.backend == 'keras' else contextlib.nullcontext():
+            # Stage 1 is deeply supervised; its first output is the full-resolution approximation
+            approximate = self.approximate_model.predict(windows, batch_size=self.batch_size)[0]
+            approximate_done = time.monotonic()
+            refined = self.refinement_model.predict(approximate, batch_size=self.batch_size)
+        done = time.monotonic()
+
+        # meta9 holds the dataset's true bounds, so undo the same min-max scaling used for the input
+        abp_span = self.meta['max_abp'] - self.meta['min_abp']
+        abp = refined.reshape(-1, WINDOW_LENGTH) * abp_span + self.meta['min_abp']
+        valid = np.arange(WINDOW_LENGTH)[None, :] < np.asarray(valid_lengths)[:, None]
+        sbp = np.where(valid, abp, -np.inf).max(axis=1)
+        dbp = np.where(valid, abp, np.inf).min(axis=1)
+        mean_pressure = np.where(valid, abp, 0).sum(axis=1) / valid.sum(axis=1)
+
+        windows_per_second = len(windows) / (done - start_time) if done > start_time else None
+        observe('bp.approximate', (approximate_done - start_time) * 1000)
+        observe('bp.refine', (done - approximate_done) * 1000)
+        increment('bp_windows', len(windows))
+        if windows_per_second:
+            set_gauge('bp_windows_per_second', windows_per_second)
+
+        return {
+            'abp': abp,
+            'sbp': sbp,
+            'dbp': dbp,
+            'map': mean_pressure,
+            'windows_per_second': windows_per_second
+        }
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+
+def get_estimator() -> BPEstimator:
+    """Return the process-wide estimator (weights load on its first prediction)."""
+    global _estimator
+
+    if _estimator is None:
+        with _estimator_lock:
+            if _estimator is None:
+                _estimator = BPEstimator()
+    return _estimator
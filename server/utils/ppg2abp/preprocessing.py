@@ -0,0 +1,247 @@
+"""
+    Vectorized preprocessing of watch PPG windows into PPG2ABP model input.
+
+    Works on 2-D batches (one row per window): IQR outlier detection with
+    rolling-median repair, resampling to 125 Hz and segmentation into overlapping
+    1024-sample windows. Segments keep their input units; BPEstimator scales them
+    to the networks' input range (see PPG2ABP_PPG_SCALING in inference.py).
+"""
+
+import os
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# The networks take 8.192 s windows sampled at 125 Hz
+WINDOW_LENGTH = 1024
+SAMPLING_RATE = 125
+
+# Fraction of each model window shared with the next one when a recording spans several
+PPG2ABP_SEGMENT_OVERLAP = float(os.getenv('PPG2ABP_SEGMENT_OVERLAP', '0.5'))
+
+# Outlier detection and repair (same defaults as the original notebook cleaning)
+IQR_FACTOR = 1.5
+MEDIAN_WINDOW = 20
+
+
+def detect_outliers(batch: np.ndarray, iqr_factor: float = IQR_FACTOR) -> np.ndarray:
+    """
+    Flag samples outside [Q1 - k*IQR, Q3 + k*IQR] of their own row.
+
+    Args:
+        batch (np.ndarray): Shape (n, m)
+        iqr_factor (float): IQR multiplier k
+
+    Returns:
+        np.ndarray: Boolean mask of shape (n, m)
+    """
+    q1, q3 = np.percentile(batch, [25, 75], axis=1, keepdims=True)
+    iqr = q3 - q1
+    return (batch < q1 - iqr_factor * iqr) | (batch > q3 + iqr_factor * iqr)
+
+
+def repair_outliers(batch: np.ndarray, outliers: np.ndarray, window: int = MEDIAN_WINDOW) -> np.ndarray:
+    """
+    Replace each outlier with the median of the non-outlier samples around it
+    (window // 2 on either side), or of its whole row if there are none nearby.
+
+    Args:
+        batch (np.ndarray): Shape (n, m)
+        outliers (np.ndarray): Mask from detect_outliers
+        window (int): Neighbourhood size in samples
+
+    Returns:
+        np.ndarray: Repaired copy of batch
+    """
+    repaired = batch.astype(np.float32, copy=True)
+    rows, columns = np.nonzero(outliers)
+    if len(rows) == 0:
+        return repaired
+
+    half = window // 2
+    masked = np.where(outliers, np.nan, repaired)
+    padded = np.pad(masked, ((0, 0), (half, half)), constant_values=np.nan)
+    # Only the outliers' neighbourhoods are gathered, so the cost scales with the number of outliers
+    neighbourhoods = padded[rows[:, None], columns[:, None] + np.arange(window)[None, :]]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN neighbourhoods fall back below
+        replacements = np.nanmedian(neighbourhoods, axis=1)
+        row_medians = np.nanmedian(masked, axis=1)
+
+    missing = np.isnan(replacements)
+    replacements[missing] = row_medians[rows[missing]]
+    # A row that is entirely outliers keeps its values
+    missing = np.isnan(replacements)
+    replacements[missing] = repaired[rows[missing], columns[missing]]
+
+    repaired[rows, columns] = replacements
+    return repaired
+
+
+def resample(batch: np.ndarray, sampling_rate: float, target_rate: float = SAMPLING_RATE) -> np.ndarray:
+    """
+    Linearly resample every row from sampling_rate to target_rate.
+
+    Args:
+        batch (np.ndarray): Shape (n, m)
+        sampling_rate (float): Sampling rate of the rows in Hz
+        target_rate (float): Output sampling rate in Hz
+
+    Returns:
+        np.ndarray: Shape (n, round(m * target_rate / sampling_rate))
+    """
+    length = batch.shape[1]
+    resampled_length = max(2, int(round(length * target_rate / float(sampling_rate))))
+    if resampled_length == length:
+        return batch
+
+    positions = np.linspace(0, length - 1, resampled_length)
+    left = np.floor(positions).astype(np.int64)
+    right = np.minimum(left + 1, length - 1)
+    weight = (positions - left).astype(np.float32)
+    return batch[:, left] * (1 - weight) + batch[:, right] * weight
+
+
+def normalize(batch: np.ndarray) -> np.ndarray:
+    """Scale each row to [0, 1] (constant rows become zeros)."""
+    low = batch.min(axis=1, keepdims=True)
+    span = batch.max(axis=1, keepdims=True) - low
+    return np.divide(batch - low, span, out=np.zeros_like(batch, dtype=np.float32), where=span > 0)
+
+
+def segment_starts(length: int, window_length: int = WINDOW_LENGTH, overlap: float = PPG2ABP_SEGMENT_OVERLAP) -> np.ndarray:
+    """
+    Start offsets of overlapping windows covering a signal; the last window is aligned to the end.
+
+    Args:
+        length (int): Signal length
+        window_length (int): Window length
+        overlap (float): Fraction of a window shared with the next one, in [0, 1)
+
+    Returns:
+        np.ndarray: Start offsets
+    """
+    if length <= window_length:
+        return np.array([0])
+    step = max(1, int(round(window_length * (1 - overlap))))
+    starts = np.arange(0, length - window_length + 1, step)
+    if starts[-1] != length - window_length:
+        starts = np.append(starts, length - window_length)
+    return starts
+
+
+def segment(batch: np.ndarray, window_length: int = WINDOW_LENGTH, overlap: float = PPG2ABP_SEGMENT_OVERLAP):
+    """
+    Cut every row into overlapping model windows. Rows shorter than a window are
+    mirror-padded to one window.
+
+    Args:
+        batch (np.ndarray): Shape (n, m)
+        window_length (int): Window length
+        overlap (float): Fraction of a window shared with the next one
+
+    Returns:
+        tuple: (segments (n * s, window_length), valid samples per segment, source row per segment,
+        start of each segment in its row)
+    """
+    rows, length = batch.shape
+    if length < window_length:
+        padded = np.pad(batch, ((0, 0), (0, window_length - length)), mode='symmetric')
+        return padded, np.full(rows, length), np.arange(rows), np.zeros(rows, dtype=np.int64)
+
+    starts = segment_starts(length, window_length, overlap)
+    segments = sliding_window_view(batch, window_length, axis=1)[:, starts, :].reshape(-1, window_length)
+    return segments, np.full(len(segments), window_length), np.repeat(np.arange(rows), len(starts)), np.tile(starts, rows)
+
+
+def preprocess_batch(batch, sampling_rate: float, overlap: float = PPG2ABP_SEGMENT_OVERLAP):
+    """
+    Turn a batch of equally long, equally sampled PPG windows into model input.
+
+    Args:
+        batch (array-like): Shape (n, m) raw or device-normalized PPG
+        sampling_rate (float): Sampling rate of the batch in Hz
+        overlap (float): Fraction of a model window shared with the next one
+
+    Returns:
+        tuple: (segments (k, 1024) float32 in the input units, valid samples per segment, source row per segment,
+        start of each segment in its row at 125 Hz)
+    """
+    batch = np.asarray(batch, dtype=np.float32)
+    if batch.ndim != 2 or batch.shape[1] < 2:
+        raise ValueError("batch must have shape (windows, samples) with at least 2 samples")
+    if not sampling_rate or sampling_rate <= 0:
+        raise ValueError("sampling_rate must be positive")
+
+    batch = repair_outliers(batch, detect_outliers(batch))
+    batch = resample(batch, sampling_rate)
+    segments, valid_lengths, owners, offsets = segment(batch, WINDOW_LENGTH, overlap)
+    return segments.astype(np.float32, copy=False), valid_lengths, owners, offsets
+
+
+def group_windows(windows: list):
+    """
+    Group PPG IR windows that share a length and sampling rate, so each group can be
+    processed as one 2-D batch.
+
+    Args:
+        windows (list): Dicts with ir_values and sampling_rate
+
+    Returns:
+        list: (sampling_rate, window indices, batch of shape (len(indices), length)) per group
+
+    Raises:
+        ValueError: If a window has no usable ir_values or sampling_rate
+    """
+    groups = {}
+    for index, window in enumerate(windows):
+        try:
+            values = window.get('ir_values')
+            sampling_rate = float(window.get('sampling_rate') or 0)
+            length = len(values)
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError(f"Window {index} needs ir_values and a positive sampling_rate")
+        if length < 2 or sampling_rate <= 0:
+            raise ValueError(f"Window {index} needs ir_values and a positive sampling_rate")
+        groups.setdefault((length, sampling_rate), []).append(index)
+
+    batches = []
+    for (_, sampling_rate), indices in groups.items():
+        try:
+            batch = np.asarray([windows[index]['ir_values'] for index in indices], dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError(f"Windows {indices} have non-numeric ir_values")
+        batches.append((sampling_rate, np.asarray(indices), batch))
+    return batches
+
+
+def preprocess_windows(windows: list, overlap: float = PPG2ABP_SEGMENT_OVERLAP):
+    """
+    Preprocess PPG IR windows of any lengths and sampling rates. Windows that share a
+    length and sampling rate are processed together as one 2-D batch.
+
+    Args:
+        windows (list): Dicts with ir_values and sampling_rate
+        overlap (float): Fraction of a model window shared with the next one
+
+    Returns:
+        tuple: (segments (k, 1024), valid samples per segment, index of the source window per segment,
+        start of each segment in its source window at 125 Hz), with segments ordered by source window
+
+    Raises:
+        ValueError: If a window has no usable ir_values or sampling_rate
+    """
+    segments, valid_lengths, owners, offsets = [], [], [], []
+    for sampling_rate, indices, batch in group_windows(windows):
+        group_segments, group_lengths, group_rows, group_offsets = preprocess_batch(batch, sampling_rate, overlap)
+        segments.append(group_segments)
+        valid_lengths.append(group_lengths)
+        owners.append(indices[group_rows])
+        offsets.append(group_offsets)
+
+    owners = np.concatenate(owners)
+    order = np.argsort(owners, kind='stable')
+    return np.concatenate(segments)[order], np.concatenate(valid_lengths)[order], owners[order], \
+        np.concatenate(offsets)[order]
@@ -0,0 +1,151 @@
+"""
+    Vectorized signal quality index (SQI) for PPG IR windows, so motion-corrupted,
+    flat or saturated windows can be skipped before running the PPG2ABP cascade.
+
+    Four components are computed for a whole batch at once:
+        perfusion               - AC/DC ratio of the raw sensor values, in percent
+        template_correlation    - correlation between consecutive beats (autocorrelation
+                                  at the dominant beat period)
+        clipping_ratio          - share of samples pinned at the window's min or max
+        spectral_concentration  - share of the pulsatile power at the heart rate peak
+                                  and its first harmonic
+    and combined into one score in [0, 1].
+"""
+
+import os
+
+import numpy as np
+
+from utils.ppg2abp.preprocessing import group_windows
+
+# Windows scoring below this are not sent to the blood pressure model
+PPG_SQI_THRESHOLD = float(os.getenv('PPG_SQI_THRESHOLD', '0.5'))
+
+# Heart rate band searched for the dominant pulse frequency (42-210 bpm)
+HR_BAND_HZ = (0.7, 3.5)
+# Below this is respiration and baseline wander, left out of the pulsatile power
+PULSATILE_MIN_HZ = 0.5
+# Half-width of the peak and harmonic bands counted as pulse power
+PEAK_BANDWIDTH_HZ = 0.25
+# Samples within this fraction of the range from the min or max count as clipped
+CLIP_TOLERANCE = 1e-3
+# Perfusion index (%) at and above which perfusion doesn't lower the score
+PERFUSION_FULL_SCALE = 0.2
+
+
+def perfusion_index(min_raw, max_raw, avg_raw) -> np.ndarray:
+    """
+    Perfusion index (AC/DC in percent) from the raw value statistics stored with each window.
+
+    Args:
+        min_raw, max_raw, avg_raw (array-like): Raw IR statistics per window (None when unknown)
+
+    Returns:
+        np.ndarray: Perfusion index per window, NaN where the statistics are missing
+    """
+    stats = np.array([min_raw, max_raw, avg_raw], dtype=np.float64).reshape(3, -1)
+    low, high, mean = stats
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(mean > 0, (high - low) / mean * 100, np.nan)
+
+
+def compute_sqi(batch, sampling_rate: float, perfusion=None) -> dict:
+    """
+    Score a batch of equally long, equally sampled PPG windows.
+
+    Args:
+        batch (array-like): Shape (n, m) PPG IR values (raw or device-normalized)
+        sampling_rate (float): Sampling rate in Hz
+        perfusion (array-like): Perfusion index per window from perfusion_index(); NaN or
+            None leaves perfusion out of the score
+
+    Returns:
+        dict: sqi, perfusion, template_correlation, clipping_ratio, spectral_concentration
+        and hr_bpm, each of shape (n,)
+    """
+    batch = np.asarray(batch, dtype=np.float64)
+    rows, length = batch.shape
+
+    low = batch.min(axis=1, keepdims=True)
+    high = batch.max(axis=1, keepdims=True)
+    span = high - low
+    tolerance = CLIP_TOLERANCE * span
+    clipped = (batch - low <= tolerance) | (high - batch <= tolerance)
+    clipping_ratio = np.where(span[:, 0] > 0, clipped.mean(axis=1), 1.0)
+
+    centered = batch - batch.mean(axis=1, keepdims=True)
+
+    # Dominant pulse frequency and how much of the pulsatile power sits at it
+    freqs = np.fft.rfftfreq(length, d=1.0 / sampling_rate)
+    power = np.abs(np.fft.rfft(centered * np.hanning(length), axis=1)) ** 2
+    pulsatile = freqs >= PULSATILE_MIN_HZ
+    hr_band = (freqs >= HR_BAND_HZ[0]) & (freqs <= HR_BAND_HZ[1])
+    if hr_band.any():
+        band_freqs = freqs[hr_band]
+        peak_hz = band_freqs[np.argmax(power[:, hr_band], axis=1)]
+    else:
+        # Too short to resolve the heart rate band
+        peak_hz = np.full(rows, np.nan)
+    near_peak = (np.abs(freqs[None, :] - peak_hz[:, None]) <= PEAK_BANDWIDTH_HZ) | \
+        (np.abs(freqs[None, :] - 2 * peak_hz[:, None]) <= PEAK_BANDWIDTH_HZ)
+    total = power[:, pulsatile].sum(axis=1)
+    at_peak = np.where(near_peak & pulsatile[None, :], power, 0).sum(axis=1)
+    spectral_concentration = np.divide(at_peak, total, out=np.zeros(rows), where=total > 0)
+
+    # Autocorrelation (via FFT) at one beat period, corrected for the shrinking overlap
+    spectrum = np.fft.rfft(centered, n=2 * length, axis=1)
+    autocorrelation = np.fft.irfft(np.abs(spectrum) ** 2, axis=1)[:, :length]
+    lag = np.where(np.isnan(peak_hz), 0, np.round(sampling_rate / np.nan_to_num(peak_hz, nan=1.0))).astype(np.int64)
+    lag = np.clip(lag, 1, length - 1)
+    energy = autocorrelation[:, 0]
+    at_lag = autocorrelation[np.arange(rows), lag] * length / (length - lag)
+    template_correlation = np.clip(np.divide(at_lag, energy, out=np.zeros(rows), where=energy > 0), 0, 1)
+    template_correlation[np.isnan(peak_hz)] = 0
+
+    if perfusion is None:
+        perfusion = np.full(rows, np.nan)
+    perfusion = np.asarray(perfusion, dtype=np.float64).reshape(rows)
+    perfusion_score = np.where(np.isnan(perfusion), 1.0, np.clip(perfusion / PERFUSION_FULL_SCALE, 0, 1))
+
+    # A window needs both a repeating beat shape and a clean pulse spectrum to score well
+    sqi = perfusion_score * (1 - clipping_ratio) * np.sqrt(template_correlation * spectral_concentration)
+
+    return {
+        'sqi': sqi,
+        'perfusion': perfusion,
+        'template_correlation': template_correlation,
+        'clipping_ratio': clipping_ratio,
+        'spectral_concentration': spectral_concentration,
+        'hr_bpm': peak_hz * 60
+    }
+
+
+def score_windows(windows: list) -> list:
+    """
+    Compute the SQI of PPG IR windows of any lengths and sampling rates.
+
+    Args:
+        windows (list): Dicts with ir_values and sampling_rate, and optionally
+            min_raw_value, max_raw_value and avg_raw_value
+
+    Returns:
+        list: Per window, a dict with sqi and its components (rounded, None when unknown)
+
+    Raises:
+        ValueError: If a window has no usable ir_values or sampling_rate
+    """
+    scores = [None] * len(windows)
+    for sampling_rate, indices, batch in group_windows(windows):
+        group = [windows[index] for index in indices]
+        perfusion = perfusion_index(
+            [window.get('min_raw_value') for window in group],
+            [window.get('max_raw_value') for window in group],
+            [window.get('avg_raw_value') for window in group]
+        )
+        components = compute_sqi(batch, sampling_rate, perfusion)
+        for row, index in enumerate(indices):
+            scores[index] = {
+                name: (None if np.isnan(values[row]) else round(float(values[row]), 3))
+                for name, values in components.items()
+            }
+    return scores
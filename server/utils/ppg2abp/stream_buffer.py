@@ -0,0 +1,302 @@
+"""
+    Continuous blood pressure estimation from streamed PPG IR windows.
+
+    Every window posted to /health/ppg-ir is cleaned, resampled to 125 Hz and
+    appended to its device's ring buffer. Each time a hop's worth of new samples has
+    arrived, the latest 1024 samples (8.192 s) become a frame. Frames from all
+    devices are micro-batched into the PPG2ABP cascade on one background thread, and
+    the resulting SBP/DBP trend is kept per device for low-latency reads.
+
+    Buffers live in the memory of one process: the inference worker (see
+    inference_worker.py and utils/inference_client.py), which every web worker forwards
+    windows to, or the web process itself when there is no inference worker. Each holds
+    at most STREAM_BUFFER_SAMPLES samples and STREAM_TREND_LENGTH estimates, buffers idle
+    for STREAM_IDLE_SECONDS are evicted, and at most STREAM_MAX_DEVICES are kept.
+"""
+
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from utils.metrics import increment, observe, set_gauge
+from utils.ppg2abp.inference import BPModelUnavailableError, get_estimator
+from utils.ppg2abp.preprocessing import (
+    PPG2ABP_SEGMENT_OVERLAP, SAMPLING_RATE, WINDOW_LENGTH, detect_outliers, repair_outliers, resample
+)
+from utils.ppg2abp.signal_quality import PPG_SQI_THRESHOLD, compute_sqi
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Set to 0 to stop feeding /health/ppg-ir windows into the stream (gunicorn.conf.py does so when
+# several web workers run without the inference worker, as each would hold part of every stream)
+BP_STREAM_ENABLED = os.getenv('BP_STREAM_ENABLED', '1') == '1'
+
+# Samples kept per device (at 125 Hz) and estimates kept in each device's trend
+STREAM_BUFFER_SAMPLES = int(os.getenv('STREAM_BUFFER_SAMPLES', str(2 * WINDOW_LENGTH)))
+STREAM_TREND_LENGTH = int(os.getenv('STREAM_TREND_LENGTH', '240'))
+# Buffers not written to for this long are dropped, and at most this many are kept
+STREAM_IDLE_SECONDS = int(os.getenv('STREAM_IDLE_SECONDS', '600'))
+STREAM_MAX_DEVICES = int(os.getenv('STREAM_MAX_DEVICES', '1000'))
+# A window starting further than this from where the previous one ended restarts the buffer
+STREAM_MAX_GAP_SECONDS = float(os.getenv('STREAM_MAX_GAP_SECONDS', '1.0'))
+
+# Frames per forward pass, how long the batcher waits to fill one, and frames waiting at most
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '64'))
+STREAM_BATCH_WAIT_MS = int(os.getenv('STREAM_BATCH_WAIT_MS', '50'))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '1024'))
+
+# New samples between consecutive frames
+HOP_LENGTH = max(1, int(round(WINDOW_LENGTH * (1 - PPG2ABP_SEGMENT_OVERLAP))))
+
+
+def _parse_time(value) -> datetime:
+    if not value:
+        return datetime.now(timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class DeviceStream:
+    """Ring buffer of one device's 125 Hz PPG and its recent blood pressure estimates."""
+
+    def __init__(self, capacity: int = STREAM_BUFFER_SAMPLES, trend_length: int = STREAM_TREND_LENGTH):
+        self.capacity = max(capacity, WINDOW_LENGTH)
+        self.buffer = np.zeros(self.capacity, dtype=np.float32)
+        # Absolute sample positions: [start, end) is buffered, frames end at last_frame_end
+        self.start = 0
+        self.end = 0
+        self.last_frame_end = None
+        self.expected_time = None
+        self.trend = deque(maxlen=trend_length)
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reset(self) -> None:
+        """Forget the buffered signal (the trend is kept)."""
+        self.start = self.end
+        self.last_frame_end = None
+        self.expected_time = None
+
+    def append(self, samples: np.ndarray, start_time: datetime) -> list:
+        """
+        Append 125 Hz samples and cut the frames that became complete.
+
+        Args:
+            samples (np.ndarray): Cleaned samples at 125 Hz
+            start_time (datetime): Time of the first sample
+
+        Returns:
+            list: (frame of shape (1024,), time of the frame's last sample) per new frame
+        """
+        self.last_seen = time.monotonic()
+        if self.expected_time is not None and \
+                abs((start_time - self.expected_time).total_seconds()) > STREAM_MAX_GAP_SECONDS:
+            self.reset()
+        end_time = start_time + timedelta(seconds=len(samples) / SAMPLING_RATE)
+        self.expected_time = end_time
+
+        samples = samples[-self.capacity:]
+        self.buffer[(self.end + np.arange(len(samples))) % self.capacity] = samples
+        self.end += len(samples)
+        self.start = max(self.start, self.end - self.capacity)
+
+        first_end = self.start + WINDOW_LENGTH if self.last_frame_end is None else self.last_frame_end + HOP_LENGTH
+        first_end = max(first_end, self.start + WINDOW_LENGTH)
+        if first_end > self.end:
+            return []
+
+        frame_ends = np.arange(first_end, self.end + 1, HOP_LENGTH)
+        self.last_frame_end = int(frame_ends[-1])
+        frames = self.buffer[(frame_ends[:, None] - WINDOW_LENGTH + np.arange(WINDOW_LENGTH)[None, :]) % self.capacity]
+        return [
+            (frame, end_time - timedelta(seconds=(self.end - frame_end) / SAMPLING_RATE))
+            for frame, frame_end in zip(frames, frame_ends)
+        ]
+
+
+class MicroBatcher:
+    """Collects frames from every device and runs them through the model in batches."""
+
+    def __init__(self, registry, batch_size: int = STREAM_BATCH_SIZE, max_wait_ms: int = STREAM_BATCH_WAIT_MS,
+                 queue_size: int = STREAM_QUEUE_SIZE):
+        self.registry = registry
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, device_id: str, frame: np.ndarray, frame_time: datetime) -> bool:
+        """Queue a frame for estimation; returns False if the queue is full and the frame was dropped."""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait((device_id, frame, frame_time))
+            return True
+        except queue.Full:
+            increment('bp_stream_frames_dropped')
+            return False
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bp-stream-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._process(items)
+            except BPModelUnavailableError as e:
+                increment('bp_stream_frames_dropped', len(items))
+                logger.warning(f"Blood pressure model unavailable, dropped {len(items)} stream frames: {str(e)}")
+            except Exception as e:
+                increment('bp_stream_frames_dropped', len(items))
+                logger.error(f"Error estimating stream frames: {str(e)}", exc_info=True)
+
+    def _process(self, items: list) -> None:
+        start_time = time.monotonic()
+        frames = np.stack([frame for _, frame, _ in items])
+
+        # Frames without a usable pulse are recorded in the trend without running the model
+        sqi = compute_sqi(frames, SAMPLING_RATE)['sqi']
+        usable = np.flatnonzero(sqi >= PPG_SQI_THRESHOLD)
+        estimates = get_estimator().predict(frames[usable]) if len(usable) else None
+        positions = {item_index: row for row, item_index in enumerate(usable)}
+
+        for index, (device_id, _, frame_time) in enumerate(items):
+            entry = {'timestamp': frame_time.isoformat(), 'sqi': round(float(sqi[index]), 3)}
+            if index in positions:
+                row = positions[index]
+                entry.update({
+                    'sbp': round(float(estimates['sbp'][row]), 1),
+                    'dbp': round(float(estimates['dbp'][row]), 1),
+                    'map': round(float(estimates['map'][row]), 1)
+                })
+            self.registry.record(device_id, entry)
+
+        observe('bp.stream_batch', (time.monotonic() - start_time) * 1000)
+        increment('bp_stream_frames', len(items))
+        set_gauge('bp_stream_batch_size', len(items))
+
+
+class StreamRegistry:
+    """Per-device streams with idle and capacity eviction."""
+
+    def __init__(self, max_devices: int = STREAM_MAX_DEVICES, idle_seconds: int = STREAM_IDLE_SECONDS):
+        self.max_devices = max_devices
+        self.idle_seconds = idle_seconds
+        self.batcher = MicroBatcher(self)
+        # Ordered from least to most recently written
+        self._streams = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self) -> None:
+        """Drop idle streams and the least recently written ones beyond max_devices (lock held)."""
+        cutoff = time.monotonic() - self.idle_seconds
+        evicted = 0
+        while self._streams:
+            stream = next(iter(self._streams.values()))
+            if stream.last_seen >= cutoff and len(self._streams) <= self.max_devices:
+                break
+            self._streams.popitem(last=False)
+            evicted += 1
+        if evicted:
+            increment('bp_stream_evicted', evicted)
+        set_gauge('bp_stream_devices', len(self._streams))
+
+    def _stream(self, device_id: str, create: bool):
+        with self._lock:
+            stream = self._streams.get(device_id)
+            if stream is None and create:
+                stream = self._streams[device_id] = DeviceStream()
+            if stream is not None and create:
+                self._streams.move_to_end(device_id)
+                stream.last_seen = time.monotonic()
+            self._evict()
+            return stream
+
+    def add_window(self, device_id: str, window: dict) -> int:
+        """
+        Append one PPG IR window to its device's buffer and queue the frames it completes.
+        A window below the signal quality threshold restarts the buffer instead, so no
+        frame spans it.
+
+        Args:
+            device_id (str): The device's device_id
+            window (dict): ir_values, sampling_rate and optionally timestamp and sqi
+
+        Returns:
+            int: Frames queued for estimation
+
+        Raises:
+            ValueError: If the window has no usable ir_values or sampling_rate
+        """
+        stream = self._stream(device_id, create=True)
+        if window.get('sqi') is not None and float(window['sqi']) < PPG_SQI_THRESHOLD:
+            with stream.lock:
+                stream.reset()
+            return 0
+
+        try:
+            values = np.asarray(window.get('ir_values'), dtype=np.float32).reshape(1, -1)
+            sampling_rate = float(window.get('sampling_rate') or 0)
+        except (TypeError, ValueError):
+            raise ValueError("Window needs numeric ir_values and a positive sampling_rate")
+        if values.shape[1] < 2 or sampling_rate <= 0:
+            raise ValueError("Window needs numeric ir_values and a positive sampling_rate")
+
+        samples = resample(repair_outliers(values, detect_outliers(values)), sampling_rate)[0]
+        with stream.lock:
+            frames = stream.append(samples, _parse_time(window.get('timestamp')))
+        return sum(self.batcher.submit(device_id, frame, frame_time) for frame, frame_time in frames)
+
+    def record(self, device_id: str, entry: dict) -> None:
+        """Add an estimate to a device's trend (ignored if the stream was evicted)."""
+        stream = self._stream(device_id, create=False)
+        if stream is not None:
+            with stream.lock:
+                stream.trend.append(entry)
+
+    def trend(self, device_id: str, limit: int = None):
+        """Return a device's most recent estimates, oldest first, or None if it has no stream."""
+        stream = self._stream(device_id, create=False)
+        if stream is None:
+            return None
+        with stream.lock:
+            entries = list(stream.trend)
+        return entries[-limit:] if limit else entries
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_stream_registry() -> StreamRegistry:
+    """Return the process-wide stream registry."""
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = StreamRegistry()
+    return _registry
@@ -0,0 +1,240 @@
+import base64
+import logging
+import os
+import numpy as np
+from utils.icd9_index import get_icd9_description, load_icd9_index
+from utils.supabase.init_supabase import get_supabase
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Probability above which a label counts as predicted
+RISK_THRESHOLD = float(os.getenv('RISK_THRESHOLD', '0.3'))
+
+# Stored vectors are little-endian float16, one value per model label
+VECTOR_DTYPE = np.dtype('<f2')
+
+# Page size used when reading vectors for many devices
+PAGE_SIZE = 1000
+
+_three_digit_masks = {}
+
+
+def load_labels() -> list:
+    """
+    Return the model labels in output order without needing the model loaded.
+    Uses the bundled ICD-9 index and falls back to asking the model backend.
+    """
+    labels = load_icd9_index().get('labels')
+    if labels:
+        return labels
+
+    from utils.inference_client import get_labels
+    return get_labels()
+
+
+def encode_probabilities(probabilities) -> str:
+    """
+    Encode a probability vector as base64 float16 bytes.
+
+    Args:
+        probabilities (array-like): Sigmoid output, one value per label
+
+    Returns:
+        str: base64-encoded little-endian float16 bytes
+    """
+    return base64.b64encode(np.asarray(probabilities, dtype=VECTOR_DTYPE).tobytes()).decode('ascii')
+
+
+def decode_probabilities(encoded_vectors: list, num_labels: int) -> np.ndarray:
+    """
+    Decode stored vectors into one float32 matrix.
+
+    Args:
+        encoded_vectors (list): base64 strings produced by encode_probabilities
+        num_labels (int): Expected length of each vector
+
+    Returns:
+        numpy.ndarray: float32 array of shape (len(encoded_vectors), num_labels)
+    """
+    raw = b''.join(base64.b64decode(vector) for vector in encoded_vectors)
+    return np.frombuffer(raw, dtype=VECTOR_DTYPE).reshape(len(encoded_vectors), num_labels).astype(np.float32)
+
+
+def _three_digit_mask(labels: list) -> np.ndarray:
+    """Boolean mask of labels that are 3-digit ICD-9 codes, cached per label set."""
+    # Keyed on the full label tuple so label sets can never share a mask by accident
+    key = tuple(labels)
+    mask = _three_digit_masks.get(key)
+    if mask is None:
+        mask = np.array([len(label.split('.')[0]) == 3 for label in labels], dtype=bool)
+        _three_digit_masks[key] = mask
+    return mask
+
+
+def select_predictions(probabilities, labels: list, threshold: float = RISK_THRESHOLD, three_digit_only: bool = True) -> list:
+    """
+    Apply the threshold (and 3-digit code filter) to one or many probability vectors.
+
+    Args:
+        probabilities (array-like): Vector of shape (num_labels,) or matrix (num_vectors, num_labels)
+        labels (list): Model labels in output order
+        threshold (float): Probability above which a label is predicted
+        three_digit_only (bool): Only keep 3-digit ICD-9 codes, as recommended for the model
+
+    Returns:
+        list: For a vector, a list of predictions sorted by probability; for a matrix, one such list per row.
+        Each prediction has icd9_code, probability and description.
+    """
+    matrix = np.atleast_2d(np.asarray(probabilities, dtype=np.float32))
+    hits = matrix > threshold
+    if three_digit_only:
+        hits &= _three_digit_mask(labels)
+
+    rows, columns = np.nonzero(hits)
+    scores = matrix[rows, columns]
+    # Sort by row, then by descending probability within each row
+    order = np.lexsort((-scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+
+    results = [[] for _ in range(matrix.shape[0])]
+    for row, column, score in zip(rows.tolist(), columns.tolist(), scores.tolist()):
+        label = labels[column]
+        results[row].append({
+            "icd9_code": label,
+            "probability": score,
+            "description": get_icd9_description(label) or "Description not found"
+        })
+
+    return results[0] if np.ndim(probabilities) == 1 else results
+
+
+def store_probability_vector(device_id: str, probabilities, model_version: str) -> bool:
+    """
+    Store the full probability vector of an analysis so it can be re-thresholded later.
+
+    Args:
+        device_id (str): The device_id of the user
+        probabilities (array-like): Sigmoid output, one value per label
+        model_version (str): Model name and revision that produced the vector
+
+    Returns:
+        bool: True if storage was successful, False otherwise
+    """
+    try:
+        supabase = get_supabase()
+        device_response = supabase.table('devices').select('id').eq('device_id', device_id).execute()
+        if not device_response.data:
+            logger.warning(f"Device not found for device_id: {device_id}")
+            return False
+
+        vector_data = {
+            'device_id': device_response.data[0]['id'],
+            'model_version': model_version,
+            'num_labels': int(np.size(probabilities)),
+            'probabilities': encode_probabilities(probabilities)
+        }
+        result = supabase.table('risk_analysis_vectors').insert(vector_data).execute()
+        return bool(result.data)
+
+    except Exception as e:
+        logger.error(f"Error storing probability vector for device {device_id}: {str(e)}", exc_info=True)
+        return False
+
+
+def _fetch_all_pages(build_query) -> list:
+    """Read every row of a query, PAGE_SIZE rows at a time."""
+    rows = []
+    offset = 0
+    while True:
+        page = build_query().range(offset, offset + PAGE_SIZE - 1).execute().data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            return rows
+        offset += PAGE_SIZE
+
+
+def retrieve_latest_vectors(device_ids: list = None, model_version: str = None) -> dict:
+    """
+    Retrieve the most recent stored probability vector for each device.
+
+    Args:
+        device_ids (list): device_ids to include (all devices if None)
+        model_version (str): Only include vectors produced by this model version
+
+    Returns:
+        dict: device_ids, model_versions, created_at lists and a float32 'probabilities' matrix,
+        grouped by num_labels as {num_labels: {...}}
+    """
+    supabase = get_supabase()
+
+    def devices_query():
+        query = supabase.table('devices').select('id, device_id').order('id')
+        if device_ids:
+            query = query.in_('device_id', device_ids)
+        return query
+
+    devices = {row['id']: row['device_id'] for row in _fetch_all_pages(devices_query)}
+    if not devices:
+        return {}
+
+    def vectors_query():
+        # One row per device (DISTINCT ON in the database), so the cost follows the number of devices
+        query = supabase.rpc('latest_risk_analysis_vectors', {'p_model_version': model_version})\
+            .order('device_id')
+        if device_ids:
+            query = query.in_('device_id', list(devices.keys()))
+        return query
+
+    latest = {row['device_id']: row for row in _fetch_all_pages(vectors_query) if row['device_id'] in devices}
+
+    grouped = {}
+    for internal_id, row in latest.items():
+        group = grouped.setdefault(row['num_labels'], {
+            'device_ids': [],
+            'model_versions': [],
+            'created_at': [],
+            'encoded': []
+        })
+        group['device_ids'].append(devices[internal_id])
+        group['model_versions'].append(row['model_version'])
+        group['created_at'].append(row['created_at'])
+        group['encoded'].append(row['probabilities'])
+
+    for num_labels, group in grouped.items():
+        group['probabilities'] = decode_probabilities(group.pop('encoded'), num_labels)
+
+    return grouped
+
+
+def rethreshold(labels: list, threshold: float = RISK_THRESHOLD, device_ids: list = None,
+                model_version: str = None, three_digit_only: bool = True) -> list:
+    """
+    Re-apply a threshold to the latest stored vectors of many devices without re-running inference.
+
+    Args:
+        labels (list): Model labels in output order
+        threshold (float): Probability above which a label is predicted
+        device_ids (list): device_ids to include (all devices if None)
+        model_version (str): Only include vectors produced by this model version
+        three_digit_only (bool): Only keep 3-digit ICD-9 codes
+
+    Returns:
+        list: One entry per device with device_id, model_version, created_at and predictions
+    """
+    results = []
+    for num_labels, group in retrieve_latest_vectors(device_ids, model_version).items():
+        if num_labels != len(labels):
+            logger.warning(f"Skipping {len(group['device_ids'])} vectors with {num_labels} labels (model has {len(labels)})")
+            continue
+
+        predictions = select_predictions(group['probabilities'], labels, threshold, three_digit_only)
+        for i, device_id in enumerate(group['device_ids']):
+            results.append({
+                'device_id': device_id,
+                'model_version': group['model_versions'][i],
+                'created_at': group['created_at'][i],
+                'predictions': predictions[i]
+            })
+
+    return results
@@ -0,0 +1,229 @@
+import json
+import logging
+import math
+import os
+from utils.metrics import increment
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Bump when the encoding changes so cached LLM outputs built from the old encoding aren't reused
+ENCODING_VERSION = '2'
+
+# History caps (newest entries are kept)
+PROMPT_MAX_NOTES = int(os.getenv('PROMPT_MAX_NOTES', '10'))
+PROMPT_MAX_NOTE_CHARS = int(os.getenv('PROMPT_MAX_NOTE_CHARS', '500'))
+PROMPT_MAX_PAST_RECOMMENDATIONS = int(os.getenv('PROMPT_MAX_PAST_RECOMMENDATIONS', '5'))
+# Predictions are already thresholded, so they are all sent unless a cap is set (0 = no cap)
+PROMPT_MAX_PREDICTIONS = int(os.getenv('PROMPT_MAX_PREDICTIONS', '0'))
+
+# Rough characters per token for English text with numbers; only used for reporting
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for a prompt (about 4 characters per token)."""
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN)
+
+
+def report_prompt_size(name: str, text: str) -> int:
+    """
+    Log and count the estimated token size of a prompt.
+
+    Args:
+        name (str): Prompt name, e.g. "soap" or "recommendations"
+        text (str): Prompt text
+
+    Returns:
+        int: Estimated tokens
+    """
+    tokens = estimate_tokens(text)
+    increment(f"prompt_tokens_estimated.{name}", tokens)
+    increment(f"prompts.{name}")
+    logger.info(f"Prompt '{name}': {len(text)} chars, ~{tokens} tokens")
+    return tokens
+
+
+def encode_json(data) -> str:
+    """Compact, deterministic JSON (sorted keys, no whitespace)."""
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _number(value, digits: int = 1) -> str:
+    """Format a number without trailing zeros (72.0 -> 72, 72.46 -> 72.5)."""
+    if value is None:
+        return '?'
+    rounded = round(float(value), digits)
+    return str(int(rounded)) if rounded == int(rounded) else str(rounded)
+
+
+def _duration(minutes) -> str:
+    """Format minutes as e.g. 7h12m."""
+    minutes = int(round(float(minutes)))
+    return f"{minutes // 60}h{minutes % 60:02d}m"
+
+
+def _minute(timestamp: str) -> str:
+    """Trim an ISO or 'YYYY-MM-DD HH:MM:SS UTC' timestamp to 'YYYY-MM-DD HH:MM'."""
+    return (timestamp or '')[:16].replace('T', ' ')
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def encode_notes(notes: list, label: str = 'notes', limit: int = PROMPT_MAX_NOTES) -> list:
+    """
+    Encode user notes (newest first) as one line each under a header, keeping the newest `limit`.
+
+    Args:
+        notes (list): Notes with timestamp and note, newest first
+        label (str): Header label
+        limit (int): Maximum notes to keep
+
+    Returns:
+        list: Encoded lines (empty if there are no notes)
+    """
+    if not notes:
+        return []
+
+    kept = notes[:limit]
+    header = f"{label} (newest first, {len(kept)} of {len(notes)}):" if len(notes) > len(kept) else f"{label} (newest first):"
+    return [header] + [f"- {_minute(note.get('timestamp'))} {_truncate(note.get('note'), PROMPT_MAX_NOTE_CHARS)}" for note in kept]
+
+
+def encode_metrics(metrics: dict) -> str:
+    """
+    Encode retrieve_user_metrics output as dense, deterministic lines with units.
+    Keeps every value the SOAP prompt uses, drops keys, indentation and sync metadata.
+
+    Args:
+        metrics (dict): Output of retrieve_user_metrics
+
+    Returns:
+        str: Encoded metrics
+    """
+    if not metrics:
+        return "no metrics"
+
+    lines = []
+    metadata = metrics.get('metadata') or {}
+    if metadata.get('date'):
+        lines.append(f"date: {metadata['date']}")
+
+    characteristics = metrics.get('characteristics') or {}
+    if characteristics:
+        parts = [f"sex {characteristics.get('biological_sex') or 'undefined'}"]
+        if characteristics.get('date_of_birth'):
+            parts.append(f"dob {characteristics['date_of_birth']}")
+        if characteristics.get('blood_type'):
+            parts.append(f"blood {characteristics['blood_type']}")
+        lines.append("profile: " + ", ".join(parts))
+
+    heart_rate = metrics.get('heart_rate') or {}
+    if heart_rate.get('measurements_count'):
+        lines.append(
+            f"heart_rate: avg {_number(heart_rate['average'])} BPM, low {_number(heart_rate['low'])}, "
+            f"peak {_number(heart_rate['peak'])} (n={heart_rate['measurements_count']})"
+        )
+    else:
+        lines.append("heart_rate: no data")
+
+    steps = metrics.get('steps') or []
+    if steps:
+        lines.append("steps: " + "; ".join(f"{row['date']} {int(row['step_count'])}" for row in steps))
+    else:
+        lines.append("steps: no data")
+
+    sleep = metrics.get('sleep')
+    if sleep:
+        stages = ", ".join(f"{stage} {_duration(minutes)}" for stage, minutes in sorted(sleep.get('stages', {}).items()))
+        lines.append(
+            f"sleep: night ending {sleep['date']} {_duration(sleep['total_duration_minutes'])} "
+            f"({sleep['start_time'][11:16]}-{sleep['end_time'][11:16]} UTC)" + (f"; {stages}" if stages else "")
+        )
+    else:
+        lines.append("sleep: no data")
+
+    body_measurements = metrics.get('body_measurements') or {}
+    if body_measurements:
+        parts = []
+        for measurement_type in sorted(body_measurements):
+            measurement = body_measurements[measurement_type]
+            calculated = ' calc' if measurement.get('calculated') else ''
+            parts.append(f"{measurement_type} {_number(measurement['value'], 2)} {measurement['unit']}{calculated} ({str(measurement['timestamp'])[:10]})")
+        lines.append("body: " + "; ".join(parts))
+
+    lines.extend(encode_notes(metrics.get('notes')))
+    return "\n".join(lines)
+
+
+def encode_predictions(predictions: list, limit: int = PROMPT_MAX_PREDICTIONS) -> list:
+    """
+    Sort ICD-9 predictions by probability and round the probabilities.
+
+    Args:
+        predictions (list): Predictions with icd9_code, probability and description
+        limit (int): Maximum predictions to keep (0 keeps them all)
+
+    Returns:
+        list: Encoded predictions
+    """
+    ranked = sorted(predictions or [], key=lambda prediction: -prediction['probability'])
+    if limit and len(ranked) > limit:
+        logger.warning(f"Dropping {len(ranked) - limit} of {len(ranked)} predictions from the prompt (PROMPT_MAX_PREDICTIONS={limit})")
+        increment('prompt_predictions_truncated', len(ranked) - limit)
+        ranked = ranked[:limit]
+    return [{
+        'icd9_code': prediction['icd9_code'],
+        'probability': round(float(prediction['probability']), 3),
+        'description': prediction['description']
+    } for prediction in ranked]
+
+
+def encode_risk_clusters(clusters: list) -> str:
+    """
+    Encode formatted risk clusters (from format_predictions or the stored analysis) one per line.
+
+    Args:
+        clusters (list): Clusters with cluster_name, risk_level, explanation and diseases
+
+    Returns:
+        str: Encoded clusters
+    """
+    if not clusters:
+        return "no risk clusters"
+
+    lines = []
+    for cluster in sorted(clusters, key=lambda cluster: cluster.get('cluster_name', '')):
+        diseases = "; ".join(f"{disease.get('icd9_code')} {disease.get('description')}" for disease in cluster.get('diseases', []))
+        lines.append(f"{cluster.get('cluster_name')} [{cluster.get('risk_level')}]: {diseases}")
+        if cluster.get('explanation'):
+            lines.append(f"  why: {_truncate(cluster['explanation'], 300)}")
+    return "\n".join(lines)
+
+
+def encode_past_recommendations(past_recommendations: dict, limit: int = PROMPT_MAX_PAST_RECOMMENDATIONS) -> str:
+    """
+    Encode past recommendations by acceptance status and category, keeping the newest `limit` of each.
+
+    Args:
+        past_recommendations (dict): {'accepted'|'unaccepted': {category: [recommendations]}}
+        limit (int): Maximum recommendations per status and category
+
+    Returns:
+        str: Encoded recommendations (empty if there are none)
+    """
+    if not past_recommendations:
+        return ""
+
+    lines = []
+    for status in ('accepted', 'unaccepted'):
+        for category, recommendations in sorted((past_recommendations.get(status) or {}).items()):
+            if not recommendations:
+                continue
+            newest = sorted(recommendations, key=lambda rec: rec.get('created_at') or '', reverse=True)[:limit]
+            lines.append(f"{status} {category}:")
+            lines.extend(f"- {_truncate(rec['recommendation'], 200)} ({rec.get('frequency')})" for rec in newest)
+    return "\n".join(lines)
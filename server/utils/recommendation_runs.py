@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+from utils.supabase.init_supabase import get_supabase
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+
+def compute_category_digest(inputs: dict) -> str:
+    """
+    Hash everything one recommendation category is generated from.
+
+    Args:
+        inputs (dict): The category's clusters, metric, notes, count and prompt versions
+
+    Returns:
+        str: sha256 hex digest
+    """
+    canonical = json.dumps(inputs, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def get_category_digests(device_internal_id: int) -> dict:
+    """
+    Return the digest each category of a device was last generated from.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+
+    Returns:
+        dict: {category: digest}, empty if recommendations were never generated (or on error)
+    """
+    try:
+        response = get_supabase().table('recommendation_runs')\
+            .select('category, digest')\
+            .eq('device_id', device_internal_id)\
+            .execute()
+    except Exception as e:
+        logger.warning(f"Failed to read recommendation runs: {str(e)}")
+        return {}
+    return {row['category']: row['digest'] for row in response.data}
+
+
+def store_category_digests(device_internal_id: int, digests: dict) -> bool:
+    """
+    Record the digests of the categories that were just generated.
+
+    Args:
+        device_internal_id (int): Internal devices.id
+        digests (dict): {category: digest}
+
+    Returns:
+        bool: True if storage was successful, False otherwise
+    """
+    if not digests:
+        return True
+
+    updated_at = datetime.now(timezone.utc).isoformat()
+    try:
+        response = get_supabase().table('recommendation_runs').upsert([{
+            'device_id': device_internal_id,
+            'category': category,
+            'digest': digest,
+            'updated_at': updated_at
+        } for category, digest in digests.items()], on_conflict='device_id,category').execute()
+        return bool(response.data)
+    except Exception as e:
+        logger.error(f"Error storing recommendation runs: {str(e)}", exc_info=True)
+        return False
@@ -0,0 +1,41 @@
+"""
+Re-applies a threshold to stored diagnosis probability vectors across many devices.
+
+Run from the server directory, e.g.:
+    python -m utils.rethreshold --threshold 0.25 --output predictions.json
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from utils.probability_vectors import RISK_THRESHOLD, load_labels, rethreshold
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Re-threshold stored diagnosis probability vectors")
+    parser.add_argument('--threshold', type=float, default=RISK_THRESHOLD, help="Probability above which a label is predicted")
+    parser.add_argument('--device', action='append', dest='device_ids', help="device_id to include (repeatable, default: all devices)")
+    parser.add_argument('--model-version', help="Only use vectors produced by this model version")
+    parser.add_argument('--all-codes', action='store_true', help="Keep codes other than 3-digit ICD-9 codes")
+    parser.add_argument('--output', help="Write results as JSON to this file instead of stdout")
+    args = parser.parse_args()
+
+    start_time = time.monotonic()
+    results = rethreshold(load_labels(), args.threshold, args.device_ids, args.model_version, not args.all_codes)
+    logger.info(f"Re-thresholded {len(results)} devices in {time.monotonic() - start_time:.2f} seconds")
+
+    output = json.dumps({'threshold': args.threshold, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 import logging
 from datetime import datetime, timedelta
-from utils.supabase.init_supabase import init_supabase
+from utils.supabase.init_supabase import get_supabase
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,8 +16,8 @@ def retrieve_user_notes(user_id):
         list: A list of user notes with timestamps
     """
     try:
-        # Initialize Supabase
-        supabase = init_supabase()
+        # Shared Supabase client
+        supabase = get_supabase()
         
         # First get the internal device ID
         device_response = supabase.table('devices').select('id').eq('device_id', user_id).execute()
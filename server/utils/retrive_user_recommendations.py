@@ -1,4 +1,4 @@
-from utils.supabase.init_supabase import init_supabase, logger
+from utils.supabase.init_supabase import get_supabase, logger
 
 def retrieve_user_recommendations(user_id: str) -> dict:
     """
@@ -11,8 +11,8 @@ def retrieve_user_recommendations(user_id: str) -> dict:
         dict: Dictionary containing past recommendations categorized by type and acceptance status
     """
     try:
-        # Initialize Supabase client
-        supabase = init_supabase()
+        # Shared Supabase client
+        supabase = get_supabase()
         
         # First verify the device exists and get internal ID
         device_response = supabase.table('devices').select('id').eq('device_id', user_id).execute()
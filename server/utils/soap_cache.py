@@ -0,0 +1,267 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from utils.metrics import increment
+from utils.soap_generator import (
+    PROMPT_VERSION, ASSESSMENT_PROMPT_VERSION, generate_soap_note, generate_soap_note_stream, generate_soap_assessment
+)
+from utils.soap_template import TEMPLATE_VERSION, render_soap_note, resolve_soap_mode
+from utils.prompt_encoder import ENCODING_VERSION
+from utils.supabase.init_supabase import get_supabase
+
+# Simple logger without custom configuration
+logger = logging.getLogger(__name__)
+
+# Seconds a generated note stays valid (0 disables the cache)
+SOAP_CACHE_TTL_SECONDS = int(os.getenv('SOAP_CACHE_TTL_SECONDS', '86400'))
+# Notes kept in this process in front of the soap_notes table
+SOAP_CACHE_SIZE = int(os.getenv('SOAP_CACHE_SIZE', '256'))
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+# Striped locks so concurrent requests for the same inputs make a single LLM call
+_generation_locks = [threading.Lock() for _ in range(64)]
+
+
+def canonicalize(inputs: dict) -> str:
+    """Serialize SOAP inputs deterministically (sorted keys, no whitespace)."""
+    return json.dumps(inputs, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def soap_version(mode: str) -> str:
+    """
+    Version of whatever produces notes in a SOAP mode: the Gemini prompt, the
+    template, or both. Changes whenever notes from that mode would change.
+
+    Args:
+        mode (str): One of SOAP_MODES
+
+    Returns:
+        str: Version string
+    """
+    if mode == 'template':
+        return f"template:{TEMPLATE_VERSION}"
+    if mode == 'hybrid':
+        return f"hybrid:{ASSESSMENT_PROMPT_VERSION}:{TEMPLATE_VERSION}"
+    if mode == 'auto':
+        return f"auto:{PROMPT_VERSION}:{TEMPLATE_VERSION}"
+    return PROMPT_VERSION
+
+
+def soap_cache_key(inputs: dict, mode: str = 'llm') -> str:
+    """
+    Content address of a SOAP note: sha256 of the canonical inputs, the version of
+    what generated the note and the version of the encoding used to put the inputs in the prompt.
+
+    Args:
+        inputs (dict): Everything the note is generated from (e.g. metrics and clinical text)
+        mode (str): 'llm' or 'hybrid' (template notes aren't cached)
+
+    Returns:
+        str: 64-character hex digest
+    """
+    return hashlib.sha256(f"{soap_version(mode)}\n{ENCODING_VERSION}\n{canonicalize(inputs)}".encode()).hexdigest()
+
+
+def _get_from_memory(key: str):
+    with _memory_lock:
+        entry = _memory_cache.get(key)
+        if entry is None:
+            return None
+        soap_note, expires_at = entry
+        if expires_at <= time.time():
+            del _memory_cache[key]
+            return None
+        _memory_cache.move_to_end(key)
+        return soap_note
+
+
+def _put_in_memory(key: str, soap_note: str, expires_at: float) -> None:
+    with _memory_lock:
+        _memory_cache[key] = (soap_note, expires_at)
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > SOAP_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def _get_from_store(key: str):
+    """Return (soap_note, expires_at) from the soap_notes table, or None if missing or expired."""
+    try:
+        response = get_supabase().table('soap_notes')\
+            .select('soap_note, created_at')\
+            .eq('cache_key', key)\
+            .limit(1)\
+            .execute()
+    except Exception as e:
+        logger.warning(f"Failed to read cached SOAP note: {str(e)}")
+        return None
+
+    if not response.data:
+        return None
+
+    row = response.data[0]
+    created_at = datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    expires_at = created_at.timestamp() + SOAP_CACHE_TTL_SECONDS
+    if expires_at <= time.time():
+        return None
+    return row['soap_note'], expires_at
+
+
+def _put_in_store(key: str, version: str, soap_note: str) -> None:
+    try:
+        get_supabase().table('soap_notes').upsert({
+            'cache_key': key,
+            'prompt_version': version,
+            'soap_note': soap_note,
+            'created_at': datetime.now(timezone.utc).isoformat()
+        }).execute()
+    except Exception as e:
+        logger.warning(f"Failed to store SOAP note: {str(e)}")
+
+
+def _generation_lock(key: str) -> threading.Lock:
+    return _generation_locks[int(key[:8], 16) % len(_generation_locks)]
+
+
+def _lookup(key: str):
+    """Return a fresh cached note from memory or the soap_notes table, or None."""
+    soap_note = _get_from_memory(key)
+    if soap_note is not None:
+        increment('soap_cache_hits_memory')
+        return soap_note
+
+    stored = _get_from_store(key)
+    if stored is not None:
+        increment('soap_cache_hits_store')
+        _put_in_memory(key, *stored)
+        return stored[0]
+    return None
+
+
+def _remember(key: str, version: str, soap_note: str) -> None:
+    _put_in_memory(key, soap_note, time.time() + SOAP_CACHE_TTL_SECONDS)
+    _put_in_store(key, version, soap_note)
+
+
+def _cached(inputs: dict, mode: str, generate) -> str:
+    """Return the cached note for these inputs and mode, calling generate() only on a miss."""
+    if SOAP_CACHE_TTL_SECONDS <= 0:
+        return generate()
+
+    key = soap_cache_key(inputs, mode)
+    soap_note = _get_from_memory(key)
+    if soap_note is not None:
+        increment('soap_cache_hits_memory')
+        return soap_note
+
+    with _generation_lock(key):
+        # Another request may have generated it while we waited for the lock
+        soap_note = _lookup(key)
+        if soap_note is not None:
+            return soap_note
+
+        increment('soap_cache_misses')
+        soap_note = generate()
+        _remember(key, soap_version(mode), soap_note)
+        return soap_note
+
+
+def _iter_cached_llm(inputs: dict, input_text: str):
+    """Stream a Gemini note, or yield a cached one as a single chunk."""
+    if SOAP_CACHE_TTL_SECONDS <= 0:
+        yield from generate_soap_note_stream(input_text)
+        return
+
+    key = soap_cache_key(inputs)
+    soap_note = _get_from_memory(key)
+    if soap_note is not None:
+        increment('soap_cache_hits_memory')
+        yield soap_note
+        return
+
+    with _generation_lock(key):
+        soap_note = _lookup(key)
+        if soap_note is not None:
+            yield soap_note
+            return
+
+        increment('soap_cache_misses')
+        chunks = []
+        for chunk in generate_soap_note_stream(input_text):
+            chunks.append(chunk)
+            yield chunk
+        # Only cache notes that were streamed to completion
+        _remember(key, PROMPT_VERSION, "".join(chunks))
+
+
+def _render_template(inputs: dict, assessment: str = None) -> str:
+    increment('soap_template_rendered')
+    return render_soap_note(inputs.get('metrics'), inputs.get('clinical_text'), assessment)
+
+
+def get_soap_note(inputs: dict, input_text: str, mode: str = None):
+    """
+    Return the SOAP note for these inputs. Gemini is only called if no fresh note
+    is cached; template notes are rendered locally every time.
+
+    Args:
+        inputs (dict): Structured inputs the note depends on; used for the cache key
+            and, for template notes, rendered directly ('metrics' and 'clinical_text')
+        input_text (str): Prompt text passed to Gemini on a miss
+        mode (str): SOAP mode (see utils.soap_template.SOAP_MODES), defaults to SOAP_MODE
+
+    Returns:
+        tuple: (SOAP note, source) where source is 'llm', 'template' or 'hybrid'
+    """
+    mode = resolve_soap_mode(mode)
+    if mode == 'template':
+        return _render_template(inputs), 'template'
+    if mode == 'hybrid':
+        return _cached(inputs, 'hybrid', lambda: _render_template(inputs, generate_soap_assessment(input_text))), 'hybrid'
+    try:
+        return _cached(inputs, 'llm', lambda: generate_soap_note(input_text)), 'llm'
+    except Exception as e:
+        if mode != 'auto':
+            raise
+        logger.warning(f"SOAP generation failed, falling back to the template: {str(e)}")
+        increment('soap_template_fallbacks')
+        return _render_template(inputs), 'template'
+
+
+def iter_soap_note(inputs: dict, input_text: str, mode: str = None):
+    """
+    Like get_soap_note, but streams Gemini notes while they are generated.
+    Cached, template and hybrid notes are yielded as a single chunk.
+
+    Args:
+        inputs (dict): Structured inputs the note depends on
+        input_text (str): Prompt text passed to Gemini on a miss
+        mode (str): SOAP mode, defaults to SOAP_MODE
+
+    Yields:
+        tuple: (SOAP note text chunk, source)
+    """
+    mode = resolve_soap_mode(mode)
+    if mode in ('template', 'hybrid'):
+        yield get_soap_note(inputs, input_text, mode)
+        return
+
+    yielded = False
+    try:
+        for chunk in _iter_cached_llm(inputs, input_text):
+            yielded = True
+            yield chunk, 'llm'
+    except Exception as e:
+        # A half-streamed note can't be swapped for the template
+        if mode != 'auto' or yielded:
+            raise
+        logger.warning(f"SOAP generation failed, falling back to the template: {str(e)}")
+        increment('soap_template_fallbacks')
+        yield _render_template(inputs), 'template'
@@ -1,26 +1,7 @@
-from google import genai
-from google.genai import types
+from utils.llm_gateway import config_version, generate_content, generate_content_stream, make_config
+from utils.prompt_encoder import report_prompt_size
 
-def generate_soap_note(input_text: str) -> str:
-    """
-    Generate a SOAP note using Gemini model based on input text.
-    Focuses on objective data and user-reported symptoms without speculation.
-    
-    Args:
-        input_text (str): The input text containing patient data and notes
-        
-    Returns:
-        str: Generated SOAP note response
-    """
-    client = genai.Client(
-        vertexai=True,
-        project="eon-health-450706",
-        location="us-central1",
-    )
-
-    text_part = types.Part.from_text(text=input_text)
-    
-    system_instruction = """You are a clinical note generator. Your task is to create a factual, data-driven SOAP note based on provided health metrics and user notes. Focus only on presenting the available data without speculation or interpretation. The SOAP note should have four clearly labeled sections:
+SYSTEM_INSTRUCTION = """You are a clinical note generator. Your task is to create a factual, data-driven SOAP note based on provided health metrics and user notes. Focus only on presenting the available data without speculation or interpretation. The SOAP note should have four clearly labeled sections:
 
 Subjective (S):
 - Include only user-reported symptoms and experiences from their notes
@@ -59,44 +40,60 @@ Important Guidelines:
 
 Return the SOAP note in a clear, structured format with each section clearly labeled."""
 
-    model = "gemini-2.0-flash-001"
-    contents = [
-        types.Content(
-            role="user",
-            parts=[text_part]
-        )
-    ]
+# Built once and shared by every call
+GENERATE_CONTENT_CONFIG = make_config(SYSTEM_INSTRUCTION, temperature=0.7)
+
+# Changes whenever the prompt or model changes, so cached notes from an older prompt are never reused
+PROMPT_VERSION = config_version(GENERATE_CONTENT_CONFIG)
+
+def generate_soap_note(input_text: str) -> str:
+    """
+    Generate a SOAP note using Gemini model based on input text.
+    Focuses on objective data and user-reported symptoms without speculation.
+    
+    Args:
+        input_text (str): The input text containing patient data and notes
+        
+    Returns:
+        str: Generated SOAP note response
+    """
+    report_prompt_size('soap', input_text)
+    return generate_content(input_text, GENERATE_CONTENT_CONFIG, name='soap')
+
+def generate_soap_note_stream(input_text: str):
+    """
+    Stream a SOAP note from the Gemini model as it is generated.
     
-    generate_content_config = types.GenerateContentConfig(
-        temperature=0.7,  # Reduced from 1.0 to be more consistent
-        top_p=0.95,
-        max_output_tokens=8192,
-        response_modalities=["TEXT"],
-        safety_settings=[
-            types.SafetySetting(
-                category="HARM_CATEGORY_HATE_SPEECH",
-                threshold="OFF"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_DANGEROUS_CONTENT",
-                threshold="OFF"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                threshold="OFF"
-            ),
-            types.SafetySetting(
-                category="HARM_CATEGORY_HARASSMENT",
-                threshold="OFF"
-            )
-        ],
-        system_instruction=[types.Part.from_text(text=system_instruction)],
-    )
-
-    response = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
-    )
+    Args:
+        input_text (str): The input text containing patient data and notes
+        
+    Yields:
+        str: SOAP note text chunks
+    """
+    report_prompt_size('soap', input_text)
+    yield from generate_content_stream(input_text, GENERATE_CONTENT_CONFIG, name='soap')
+
+ASSESSMENT_SYSTEM_INSTRUCTION = """You are a clinical note assistant. You write only the Assessment (A) section of a SOAP note from the provided health metrics and user notes; the other sections are written separately.
+
+- Summarize the objective findings and recent subjective reports
+- Note significant changes or patterns only if explicitly shown in the data
+- Do not speculate about possible causes or conditions, diagnose, or give advice
+- If data is insufficient for assessment, state "Limited data available for assessment"
+- Return 2-5 short bullet points starting with "- ", with no heading and no other sections"""
+
+ASSESSMENT_CONFIG = make_config(ASSESSMENT_SYSTEM_INSTRUCTION, temperature=0.7, max_output_tokens=1024)
+
+ASSESSMENT_PROMPT_VERSION = config_version(ASSESSMENT_CONFIG)
+
+def generate_soap_assessment(input_text: str) -> str:
+    """
+    Generate only the Assessment section of a SOAP note (used by the hybrid SOAP mode).
     
-    return response.text 
\ No newline at end of file
+    Args:
+        input_text (str): The input text containing patient data and notes
+        
+    Returns:
+        str: Assessment bullet points
+    """
+    report_prompt_size('soap_assessment', input_text)
+    return generate_content(input_text, ASSESSMENT_CONFIG, name='soap_assessment')
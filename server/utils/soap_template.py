@@ -0,0 +1,162 @@
+import os
+
+# How SOAP notes are produced:
+#   llm      - Gemini writes the whole note
+#   template - rendered locally from the metrics, no LLM call
+#   auto     - Gemini, falling back to the template when Gemini is busy or failing
+#   hybrid   - template Subjective/Objective/Plan with a Gemini-written Assessment
+SOAP_MODES = ('llm', 'template', 'auto', 'hybrid')
+SOAP_MODE = os.getenv('SOAP_MODE', 'llm')
+
+# Bump when the rendered text changes, so cached hybrid notes and analyses are regenerated
+TEMPLATE_VERSION = '1'
+
+# Notes quoted in the Subjective section (newest first)
+TEMPLATE_MAX_NOTES = 10
+
+PLAN_TEXT = "Continued monitoring of health metrics"
+
+
+def resolve_soap_mode(mode: str = None) -> str:
+    """
+    Return the SOAP mode to use for a request, defaulting to SOAP_MODE.
+
+    Args:
+        mode (str): Requested mode, or None for the default
+
+    Returns:
+        str: One of SOAP_MODES
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    mode = (mode or SOAP_MODE).lower()
+    if mode not in SOAP_MODES:
+        raise ValueError(f"soap_mode must be one of {', '.join(SOAP_MODES)}")
+    return mode
+
+
+def _hours_minutes(minutes) -> str:
+    total = int(round(float(minutes)))
+    hours, minutes = divmod(total, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour{'s' if hours != 1 else ''}")
+    if minutes or not hours:
+        parts.append(f"{minutes} minute{'s' if minutes != 1 else ''}")
+    return " ".join(parts)
+
+
+def _bpm(value) -> str:
+    return f"{int(round(float(value)))} BPM"
+
+
+def _subjective(metrics: dict, clinical_text: str = None) -> list:
+    lines = []
+    if clinical_text:
+        lines.append(f"- Reported: {' '.join(clinical_text.split())}")
+
+    notes = (metrics or {}).get('notes') or []
+    for note in notes[:TEMPLATE_MAX_NOTES]:
+        lines.append(f"- {note['timestamp']}: {' '.join((note.get('note') or '').split())}")
+    if len(notes) > TEMPLATE_MAX_NOTES:
+        lines.append(f"- {len(notes) - TEMPLATE_MAX_NOTES} older notes not shown")
+
+    return lines or ["- No subjective data provided"]
+
+
+def _objective(metrics: dict) -> list:
+    metrics = metrics or {}
+    lines = []
+
+    characteristics = metrics.get('characteristics')
+    if characteristics:
+        lines.append(f"- Sex: {characteristics.get('biological_sex') or 'undefined'}")
+
+    heart_rate = metrics.get('heart_rate') or {}
+    if heart_rate.get('measurements_count'):
+        lines.append(
+            f"- Heart Rate: {_bpm(heart_rate['average'])} average, range {_bpm(heart_rate['low'])} to "
+            f"{_bpm(heart_rate['peak'])} ({heart_rate['measurements_count']} measurements on {heart_rate['date']})"
+        )
+    else:
+        lines.append("- Heart Rate: No data available")
+
+    steps = metrics.get('steps') or []
+    if steps:
+        for row in steps:
+            lines.append(f"- Steps: {int(row['step_count']):,} steps on {row['date']}")
+    else:
+        lines.append("- Steps: No data available")
+
+    sleep = metrics.get('sleep')
+    if sleep:
+        lines.append(
+            f"- Sleep: {_hours_minutes(sleep['total_duration_minutes'])} on the night ending {sleep['date']} "
+            f"({sleep['start_time'][11:16]} to {sleep['end_time'][11:16]} UTC)"
+        )
+        for stage, minutes in sorted((sleep.get('stages') or {}).items()):
+            # Stages arrive upper-cased (CORE, DEEP, REM, AWAKE); keep acronyms as they are
+            label = stage if len(stage) <= 3 else stage.capitalize()
+            lines.append(f"  - {label}: {_hours_minutes(minutes)}")
+    else:
+        lines.append("- Sleep: No data available")
+
+    body_measurements = metrics.get('body_measurements') or {}
+    for measurement_type in sorted(body_measurements):
+        measurement = body_measurements[measurement_type]
+        label = 'BMI' if measurement_type == 'bmi' else measurement_type.replace('_', ' ').capitalize()
+        calculated = ", calculated" if measurement.get('calculated') else ""
+        lines.append(f"- {label}: {measurement['value']} {measurement['unit']} ({str(measurement['timestamp'])[:10]}{calculated})")
+
+    return lines
+
+
+def _assessment(metrics: dict, clinical_text: str = None) -> list:
+    metrics = metrics or {}
+    available = []
+    if (metrics.get('heart_rate') or {}).get('measurements_count'):
+        available.append('heart rate')
+    if metrics.get('steps'):
+        available.append('step count')
+    if metrics.get('sleep'):
+        available.append('sleep')
+
+    notes = metrics.get('notes') or []
+    if len(available) < 2 and not notes and not clinical_text:
+        return ["- Limited data available for assessment"]
+
+    lines = []
+    if available:
+        lines.append(f"- Objective data available for {', '.join(available)}")
+    missing = [name for name in ('heart rate', 'step count', 'sleep') if name not in available]
+    if missing:
+        lines.append(f"- No data recorded for {', '.join(missing)}")
+    if notes:
+        lines.append(f"- {len(notes)} user note{'s' if len(notes) != 1 else ''} reported in the last 30 days")
+    if clinical_text:
+        lines.append("- Clinical text provided with the request")
+    return lines
+
+
+def render_soap_note(metrics: dict = None, clinical_text: str = None, assessment: str = None) -> str:
+    """
+    Render a factual SOAP note from retrieve_user_metrics output without calling an LLM.
+    Follows the same rules as the Gemini SOAP prompt: notes newest first, available metrics
+    with units, missing data stated explicitly and a fixed Plan.
+
+    Args:
+        metrics (dict): Output of retrieve_user_metrics
+        clinical_text (str): Free-text clinical notes
+        assessment (str): Assessment text to use instead of the rendered summary (hybrid mode)
+
+    Returns:
+        str: SOAP note
+    """
+    sections = [
+        ("Subjective (S):", _subjective(metrics, clinical_text)),
+        ("Objective (O):", _objective(metrics)),
+        ("Assessment (A):", [assessment.strip()] if assessment else _assessment(metrics, clinical_text)),
+        ("Plan (P):", [f"- {PLAN_TEXT}"])
+    ]
+    return "\n\n".join(f"{title}\n" + "\n".join(lines) for title, lines in sections)
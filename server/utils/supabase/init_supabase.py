@@ -1,4 +1,5 @@
 import logging
+import threading
 from supabase import create_client
 
 # Configure logging
@@ -22,3 +23,16 @@ def init_supabase():
     except Exception as e:
         logger.error(f"Failed to initialize Supabase client: {str(e)}", exc_info=True)
         raise
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_supabase():
+    """Return the process-wide Supabase client, creating it on first use"""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = init_supabase()
+    return _client
@@ -0,0 +1,94 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_request_context, request
+from utils.metrics import observe, set_gauge_once
+
+# Pipeline whose stages are being timed (set by pipeline(), per thread/context)
+_current_pipeline = ContextVar('pipeline', default=None)
+
+
+@contextmanager
+def pipeline(name: str):
+    """
+    Name the pipeline whose stages run inside this block (also usable as a decorator),
+    so pipelines that share stage names keep separate histograms.
+
+    Args:
+        name (str): Pipeline name (e.g. "risk_analysis")
+    """
+    token = _current_pipeline.set(name)
+    try:
+        yield
+    finally:
+        _current_pipeline.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage. The duration goes into the 'stage.<pipeline>.<name>' histogram
+    and, inside a request, into that response's Server-Timing header.
+
+    Args:
+        name (str): Short stage name (a Server-Timing token, e.g. "soap")
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, (time.perf_counter() - start_time) * 1000)
+
+
+def record_stage(name: str, duration_ms: float) -> None:
+    """
+    Record a stage duration measured elsewhere (e.g. reported by the inference worker).
+
+    Args:
+        name (str): Short stage name
+        duration_ms (float): Duration in milliseconds
+    """
+    # Outside a named pipeline, stages are grouped by the endpoint (or as background work)
+    prefix = _current_pipeline.get() or (request.endpoint if has_request_context() else None) or 'background'
+    observe(f"stage.{prefix}.{name}", duration_ms)
+    if has_request_context():
+        g.setdefault('server_timings', []).append((name, duration_ms))
+
+
+def format_server_timing(timings: list) -> str:
+    """
+    Format recorded stages as a Server-Timing header value.
+
+    Args:
+        timings (list): (name, duration_ms) tuples
+
+    Returns:
+        str: Header value, e.g. 'metrics;dur=120.4, soap;dur=2310.0'
+    """
+    return ", ".join(f"{name};dur={duration_ms:.1f}" for name, duration_ms in timings)
+
+
+def init_app(app):
+    """Register request hooks that time every request and emit Server-Timing headers."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        start_time = g.get('request_start_time')
+        # Streamed bodies are produced after the headers are sent, so there is nothing to report yet
+        if start_time is None or response.is_streamed:
+            return response
+
+        total_ms = (time.perf_counter() - start_time) * 1000
+        observe(f"request.{request.endpoint or 'unknown'}", total_ms)
+        # First request per endpoint in this process, whatever its status
+        set_gauge_once(f"first_request_seconds.{request.endpoint or 'unknown'}", total_ms / 1000)
+
+        timings = g.get('server_timings', []) + [('total', total_ms)]
+        response.headers['Server-Timing'] = format_server_timing(timings)
+        # Let the cross-origin dashboard read the breakdown
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response